@@ -0,0 +1,40 @@
+'''Сравнение двух результатов run.py.
+
+Запуск: python benchmarks/compare.py base.json new.json [--threshold 0.1]
+
+Печатает по каждой операции пропускную способность и p99 обоих запусков и
+завершается с кодом 1, если пропускная способность какой-либо операции
+упала больше чем на threshold (доля).
+'''
+import argparse
+import json
+import sys
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Сравнение замеров CarService')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1, help='допустимое падение пропускной способности')
+    args = parser.parse_args()
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)['operations']
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)['operations']
+
+    regressions = []
+    print(f'{"операция":>20} {"оп/с было":>12} {"оп/с стало":>12} {"изм.":>8} {"p99 было":>10} {"p99 стало":>10}')
+    for name in [name for name in base if name in new]:
+        before, after = base[name]['ops_per_second'], new[name]['ops_per_second']
+        change = (after - before) / before if before and after is not None else 0.0
+        if change < -args.threshold:
+            regressions.append(name)
+        print(f'{name:>20} {before:>12} {after:>12} {change:>+8.1%} '
+              f'{base[name]["p99_ms"]:>10} {new[name]["p99_ms"]:>10}')
+    if regressions:
+        print(f'Замедлились: {", ".join(sorted(regressions))}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''Детерминированный генератор данных для замеров: модели, автомобили и продажи.
+
+Одинаковые seed и размер дают одинаковые данные, поэтому замеры разных
+версий сервиса можно сравнивать между собой.
+'''
+import random
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from models import Car, CarStatus, Model, Sale
+
+# Размеры наборов данных: число автомобилей
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+BRANDS = {
+    'Kia': ('KNA', ['Optima', 'Sorento', 'Rio', 'Ceed', 'Sportage']),
+    'Mazda': ('JM1', ['3', '6', 'CX-5', 'CX-30', 'MX-5']),
+    'Nissan': ('5N1', ['Pathfinder', 'Qashqai', 'X-Trail', 'Juke', 'Murano']),
+    'Renault': ('VF1', ['Logan', 'Duster', 'Arkana', 'Kaptur', 'Sandero']),
+    'Hyundai': ('5XY', ['Solaris', 'Creta', 'Tucson', 'Santa Fe', 'Elantra']),
+}
+
+# Символы VIN: латиница без I, O, Q и цифры
+VIN_CHARS = 'ABCDEFGHJKLMNPRSTUVWXYZ0123456789'
+_VIN_VALUES = {
+    **{str(digit): digit for digit in range(10)},
+    **dict(zip('ABCDEFGH', range(1, 9))), **dict(zip('JKLMN', range(1, 6))), 'P': 7, 'R': 9,
+    **dict(zip('STUVWXYZ', range(2, 10))),
+}
+_VIN_WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+# Буквы годов выпуска 2010-2024 в десятой позиции VIN
+_YEAR_CODES = 'ABCDEFGHJKLMNPR'
+
+START_DATE = datetime(2024, 1, 1)
+
+
+def vin_check_digit(vin: str) -> str:
+    '''Контрольный символ VIN (девятая позиция) по ISO 3779'''
+    total = sum(_VIN_VALUES[char] * weight for char, weight in zip(vin, _VIN_WEIGHTS))
+    remainder = total % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+
+class DataGenerator:
+    '''Генератор модельных данных на собственном random.Random(seed)'''
+
+    def __init__(self, seed: int = 42) -> None:
+        self._random = random.Random(seed)
+        self._vins: set[str] = set()
+        self.models = [
+            Model(id=model_id, name=name, brand=brand)
+            for model_id, (brand, name) in enumerate(
+                ((brand, name) for brand, (_, names) in BRANDS.items() for name in names), start=1)
+        ]
+        self._prefixes = {model.id: BRANDS[model.brand][0] for model in self.models}
+
+    def vin(self, model_id: int) -> str:
+        '''Новый уникальный VIN с кодом производителя бренда модели и верным контрольным символом'''
+        choice = self._random.choice
+        while True:
+            descriptor = ''.join(choice(VIN_CHARS) for _ in range(5))
+            serial = choice(_YEAR_CODES) + choice(VIN_CHARS) + f'{self._random.randrange(1_000_000):06d}'
+            vin = self._prefixes[model_id] + descriptor + '0' + serial
+            vin = vin[:8] + vin_check_digit(vin) + vin[9:]
+            if vin not in self._vins:
+                self._vins.add(vin)
+                return vin
+
+    def cars(self, count: int) -> Iterator[Car]:
+        for _ in range(count):
+            model = self._random.choice(self.models)
+            yield Car(
+                vin=self.vin(model.id),
+                model=model.id,
+                price=Decimal(self._random.randrange(1_000_000, 6_000_000)) / 100,
+                date_start=START_DATE + timedelta(minutes=self._random.randrange(365 * 24 * 60)),
+                status=CarStatus.available,
+            )
+
+    def sale(self, car: Car) -> Sale:
+        sales_date = car.date_start + timedelta(days=self._random.randrange(1, 120))
+        return Sale(
+            sales_number=f'{sales_date:%Y%m%d}#{car.vin}',
+            car_vin=car.vin,
+            sales_date=sales_date,
+            cost=(car.price * Decimal(self._random.randrange(90, 101)) / 100).quantize(Decimal('0.01')),
+        )
+
+    def sample(self, items: list, count: int) -> list:
+        return self._random.sample(items, min(count, len(items)))
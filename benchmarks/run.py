@@ -0,0 +1,183 @@
+'''Замеры производительности операций CarService.
+
+Запуск (из корня репозитория):
+    PYTHONPATH=src python benchmarks/run.py --scale 10k --output results.json
+
+Каталог заполняется детерминированными данными нужного размера (автомобили
+и продажи для половины из них), затем каждая операция выполняется --ops
+раз (тяжелые get_cars и top_models_by_sales - --heavy-ops раз). Для каждой
+операции в JSON попадают пропускная способность, задержки p50/p99, пиковый
+размер памяти процесса и число записанных байт.
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+
+from bibip_car_service import CarService
+from models import CarStatus
+from generator import SCALES, DataGenerator
+
+# Сколько автомобилей добавляется за один вызов при подготовке данных
+SETUP_BATCH = 10_000
+
+
+def peak_rss_kb() -> int:
+    '''Пиковый размер резидентной памяти процесса (на Linux ru_maxrss в КБ, на macOS в байтах)'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def written_bytes() -> int | None:
+    '''Байты, записанные процессом на устройство (с учетом сброса страниц отображений)'''
+    try:
+        with open('/proc/self/io', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def directory_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(name: str, calls: list[Callable[[], object]], root: str) -> dict:
+    '''Выполняет вызовы по одному и собирает показатели операции'''
+    written_before = written_bytes()
+    size_before = directory_size(root)
+    latencies = []
+    started = time.perf_counter()
+    for call in calls:
+        call_started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    written_after = written_bytes()
+    latencies.sort()
+    result = {
+        'ops': len(calls),
+        'seconds': round(elapsed, 6),
+        'ops_per_second': round(len(calls) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 4) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 4) if latencies else None,
+        'peak_rss_kb': peak_rss_kb(),
+        'bytes_written': None if written_before is None else written_after - written_before,
+        'disk_growth_bytes': directory_size(root) - size_before,
+    }
+    print(f'{name:>20}: {result["ops_per_second"]} оп/с, p50 {result["p50_ms"]} мс, '
+          f'p99 {result["p99_ms"]} мс', file=sys.stderr)
+    return result
+
+
+def run(cars_count: int, ops: int, heavy_ops: int, seed: int, root: str, service_options: dict) -> dict:
+    generator = DataGenerator(seed)
+    service = CarService(root, **service_options)
+
+    # Подготовка: модели, автомобили и продажи половины автомобилей пачками
+    setup_started = time.perf_counter()
+    service.add_models_bulk(generator.models)
+    cars = []
+    for start in range(0, cars_count, SETUP_BATCH):
+        batch = list(generator.cars(min(SETUP_BATCH, cars_count - start)))
+        service.add_cars_bulk(batch)
+        cars.extend(batch)
+    sold = cars[::2]
+    for start in range(0, len(sold), SETUP_BATCH):
+        service.sell_cars_bulk([generator.sale(car) for car in sold[start:start + SETUP_BATCH]])
+    setup = {'seconds': round(time.perf_counter() - setup_started, 3), 'peak_rss_kb': peak_rss_kb(),
+             'disk_bytes': directory_size(root)}
+
+    results = {}
+    new_cars = list(generator.cars(ops))
+    results['add_car'] = measure('add_car', [lambda car=car: service.add_car(car) for car in new_cars], root)
+
+    available = generator.sample(cars[1::2], ops)
+    sales = [generator.sale(car) for car in available]
+    results['sell_car'] = measure('sell_car', [lambda sale=sale: service.sell_car(sale) for sale in sales], root)
+
+    results['get_cars'] = measure(
+        'get_cars', [lambda: service.get_cars(CarStatus.available)] * heavy_ops, root)
+
+    lookups = generator.sample(cars, ops)
+    results['get_car_info'] = measure(
+        'get_car_info', [lambda vin=car.vin: service.get_car_info(vin) for car in lookups], root)
+
+    renamed = generator.sample(cars[1::2], ops)
+    renames = [(car.vin, generator.vin(car.model)) for car in renamed]
+    results['update_vin'] = measure(
+        'update_vin', [lambda vin=vin, new_vin=new_vin: service.update_vin(vin, new_vin)
+                       for vin, new_vin in renames], root)
+
+    # Отменяются продажи из замера sell_car, VIN которых не менялись
+    renamed_vins = {vin for vin, _ in renames}
+    reverts = [sale.sales_number for sale in sales if sale.car_vin not in renamed_vins]
+    results['revert_sale'] = measure(
+        'revert_sale', [lambda number=number: service.revert_sale(number) for number in reverts], root)
+
+    results['top_models_by_sales'] = measure(
+        'top_models_by_sales', [lambda: service.top_models_by_sales(3)] * heavy_ops, root)
+    service.close()
+    return {'setup': setup, 'operations': results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Замеры производительности CarService')
+    parser.add_argument('--scale', default='10k', help=f'размер данных: {", ".join(SCALES)} или число автомобилей')
+    parser.add_argument('--ops', type=int, default=1000, help='вызовов на операцию')
+    parser.add_argument('--heavy-ops', type=int, default=20, help='вызовов get_cars и top_models_by_sales')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--storage-format', default='text', choices=['text', 'binary'])
+    parser.add_argument('--no-wal-sync', action='store_true', help='без fsync журнала предзаписи')
+    parser.add_argument('--index-backend', default='sorted', choices=['sorted', 'btree'])
+    parser.add_argument('--directory', help='каталог данных (по умолчанию временный, удаляется после замера)')
+    parser.add_argument('--output', help='файл для JSON с результатами (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    cars_count = SCALES[args.scale.lower()] if args.scale.lower() in SCALES else int(args.scale)
+    service_options = {'storage_format': args.storage_format, 'wal_sync': not args.no_wal_sync,
+                       'index_backend': args.index_backend}
+    root = args.directory or tempfile.mkdtemp(prefix='bibip-bench-')
+    os.makedirs(root, exist_ok=True)
+    try:
+        measured = run(cars_count, args.ops, args.heavy_ops, args.seed, root, service_options)
+    finally:
+        if args.directory is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        'started_at': datetime.now(UTC).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': cars_count,
+        'seed': args.seed,
+        'ops': args.ops,
+        'heavy_ops': args.heavy_ops,
+        'service_options': service_options,
+        **measured,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bibip_car_service import CarService
+from models import Car, CarFullInfo, CarStatus, Model, ModelSaleStats, Sale
+
+# Сколько потоков по умолчанию выполняют работу с файлами
+DEFAULT_MAX_WORKERS = 4
+
+
+class AsyncCarService:
+    '''Асинхронный фасад CarService для приложений на asyncio.
+
+    Работа с файлами выполняется в ограниченном пуле потоков, поэтому цикл
+    событий не блокируется. Поверх пула:
+    - запросы get_car_info, пришедшие в одной итерации цикла событий,
+      объединяются в одно задание пула;
+    - одинаковые одновременные чтения выполняются один раз, и результат
+      получают все ожидающие.
+
+    К уже начатому чтению присоединяются, только если с его начала не
+    началась и не закончилась ни одна запись, поэтому после await записи
+    чтение всегда видит ее результат. Общие для нескольких вызывающих
+    объекты результатов изменять не следует.
+    '''
+
+    def __init__(self, root_directory_path: str, max_workers: int = DEFAULT_MAX_WORKERS,
+                 **service_options) -> None:
+        self.service = CarService(root_directory_path, **service_options)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bibip')
+        # Ключ чтения -> (эпоха записей при старте, будущий результат)
+        self._inflight: dict[tuple, tuple[int, asyncio.Future]] = {}
+        # Счетчик увеличивается в начале и в конце каждой записи
+        self._epoch = 0
+        # VIN -> будущий результат для запросов, еще не отправленных в пул
+        self._pending_info: dict[str, asyncio.Future] = {}
+
+    async def __aenter__(self) -> 'AsyncCarService':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        '''Дожидается работы пула и закрывает сервис'''
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        self.service.close()
+
+    def _run(self, function: Callable, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def _write(self, function: Callable, *args):
+        self._epoch += 1
+        try:
+            return await self._run(function, *args)
+        finally:
+            self._epoch += 1
+
+    async def _read(self, key: tuple, start: Callable[[], asyncio.Future]):
+        '''Выполняет чтение или присоединяется к такому же уже идущему'''
+        entry = self._inflight.get(key)
+        if entry is None or entry[0] != self._epoch:
+            future = start()
+            entry = (self._epoch, future)
+            self._inflight[key] = entry
+            future.add_done_callback(lambda _: self._forget(key, entry))
+        # shield: отмена одного из ожидающих не отменяет чтение для остальных
+        return await asyncio.shield(entry[1])
+
+    def _forget(self, key: tuple, entry: tuple[int, asyncio.Future]) -> None:
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    async def add_model(self, model: Model) -> Model:
+        return await self._write(self.service.add_model, model)
+
+    async def add_car(self, car: Car) -> Car:
+        return await self._write(self.service.add_car, car)
+
+    async def sell_car(self, sale: Sale) -> Car:
+        return await self._write(self.service.sell_car, sale)
+
+    async def update_vin(self, vin: str, new_vin: str) -> Car:
+        return await self._write(self.service.update_vin, vin, new_vin)
+
+    async def revert_sale(self, sales_number: str) -> Car:
+        return await self._write(self.service.revert_sale, sales_number)
+
+    async def get_cars(self, status: CarStatus) -> list[Car]:
+        cars = await self._read(('cars', status), lambda: self._run(self.service.get_cars, status))
+        # Список у каждого вызывающего свой
+        return list(cars)
+
+    async def top_models_by_sales(self, n: int = 3, start: datetime | None = None,
+                                  end: datetime | None = None) -> list[ModelSaleStats]:
+        top = await self._read(('top', n, start, end),
+                               lambda: self._run(self.service.top_models_by_sales, n, start, end))
+        return list(top)
+
+    async def sales_between(self, start: datetime, end: datetime) -> list[Sale]:
+        return await self._run(self.service.sales_between, start, end)
+
+    async def get_car_info(self, vin: str) -> CarFullInfo | None:
+        return await self._read(('info', vin), lambda: self._queue_car_info(vin))
+
+    async def get_car_info_many(self, vins: list[str]) -> list[CarFullInfo | None]:
+        return await self._run(self.service.get_car_info_many, list(vins))
+
+    def _queue_car_info(self, vin: str) -> asyncio.Future:
+        '''Ставит VIN в очередь; очередь уходит в пул одним заданием в конце итерации цикла'''
+        # Еще не начатое чтение можно разделить независимо от записей
+        future = self._pending_info.get(vin)
+        if future is not None:
+            return future
+        loop = asyncio.get_running_loop()
+        if not self._pending_info:
+            loop.call_soon(self._flush_car_info)
+        future = loop.create_future()
+        self._pending_info[vin] = future
+        return future
+
+    def _flush_car_info(self) -> None:
+        pending, self._pending_info = self._pending_info, {}
+        job = self._run(self._car_info_batch, list(pending))
+
+        def resolve(done: asyncio.Future) -> None:
+            error = done.exception()
+            for vin, future in pending.items():
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                    continue
+                result, vin_error = done.result()[vin]
+                if vin_error is not None:
+                    future.set_exception(vin_error)
+                else:
+                    future.set_result(result)
+        job.add_done_callback(resolve)
+
+    def _car_info_batch(self, vins: list[str]) -> dict[str, tuple[CarFullInfo | None, Exception | None]]:
+        '''Выполняется в пуле: читает информацию по всем VIN группы'''
+        try:
+            return {
+                vin: (info, None)
+                for vin, info in zip(vins, self.service.get_car_info_many(vins))
+            }
+        except Exception:
+            # Ошибка достается только тем VIN, на которых она возникает
+            pass
+        results = {}
+        for vin in vins:
+            try:
+                results[vin] = (self.service.get_car_info(vin), None)
+            except Exception as error:
+                results[vin] = (None, error)
+        return results
@@ -1,544 +1,1191 @@
 from models import Car, CarFullInfo, CarStatus, Model, ModelSaleStats, Sale
+from indexes import ChangeLog, SortedIndex, StatusIndex
+from btree import BTreeIndex
+from bloom import BloomFilter
+from cache import MISSING, LRUCache
+from counters import ModelSalesCounter
+from codec import build_full_info, gc_paused
+from formats import get_format
+from parallel import PARALLEL_SCAN_MIN_BYTES, ScanEngine
+from snapshot import InventorySnapshot, RowChanges
+from storage import RecordStore
+from locks import FileLocks, locked
+from metrics import Metrics
+from wal import REPLACE_MANIFEST, GroupCommit, WriteAheadLog, finish_replace, replace_files
+import functools
+import itertools
 import os
-import bisect
+import time
+from collections.abc import Iterable, Iterator
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from datetime import datetime
+
+# Сколько автомобилей iter_cars читает под одной блокировкой
+ITER_CHUNK_SIZE = 256
+
+# После скольких записей журнал смен статуса очищается
+STATUS_CHANGES_MAX = 65536
+
+# Размер журнала предзаписи, после которого файлы сохраняются на диск, а журнал очищается
+WAL_CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+# Размер кэша get_car_info по умолчанию и кэша моделей
+INFO_CACHE_SIZE = 1024
+MODEL_CACHE_SIZE = 4096
+
+# Виды индексов "ключ -> номер строки" и расширения их файлов
+INDEX_BACKENDS = {'sorted': '.txt', 'btree': '.btree'}
+Index = SortedIndex | BTreeIndex
+
+# Операции, время которых пишется в гистограммы при metrics=True
+TIMED_OPERATIONS = (
+    'add_model', 'add_car', 'add_models_bulk', 'add_cars_bulk', 'sell_car', 'sell_cars_bulk',
+    'get_cars', 'get_car_info', 'get_car_info_many', 'update_vin', 'revert_sale', 'get_sale',
+    'sales_between', 'sales_revenue', 'sales_by_day', 'sales_count_by_model', 'sales_count_by_brand',
+    'top_models_by_sales', 'compact', 'rebuild_model_sales', 'inventory_snapshot', 'refresh_snapshot',
+)
+# Внутренние этапы записи: фиксация группы, уплотнение журналов после нее, сброс на диск
+TIMED_PHASES = ('_commit_batch', '_after_commit', '_checkpoint')
+
+
+def sales_date_key(sales_date: datetime, sales_number: str = '') -> str:
+    '''Ключ индекса дат продаж: дата фиксированной ширины, затем номер продажи.
+
+    Ключи сортируются как строки в хронологическом порядке, а ключ без
+    номера продажи - нижняя граница всех продаж этой секунды. Дата в ключе
+    с точностью до секунды, как в текстовом формате: ключ, построенный по
+    прочитанной из файла продаже, совпадает с ключом при ее записи.
+    '''
+    prefix = sales_date.strftime('%Y-%m-%d %H:%M:%S')
+    return f'{prefix}|{sales_number}' if sales_number else prefix
+
+
+
+# Задачи просмотра файлов для parallel.ScanEngine. Они выполняются и в
+# процессах пула, поэтому это функции уровня модуля, а формат передается именем
+def _scan_car_statuses(records: Iterator, format_name: str, pause_gc: bool) -> list[tuple[int, str]]:
+    storage_format = get_format(format_name)
+    return [(line_number, storage_format.car_status(record)) for line_number, record in records]
+
+
+def _scan_car_columns(records: Iterator, format_name: str, pause_gc: bool) -> list[tuple[int, tuple]]:
+    '''Номер строки -> (модель, цена, дата поступления, статус) для снимка'''
+    storage_format = get_format(format_name)
+    rows = []
+    with gc_paused(pause_gc):
+        for line_number, record in records:
+            car = storage_format.decode_car(record)
+            rows.append((line_number, (car.model, car.price, car.date_start, car.status.value)))
+    return rows
+
+
+def _scan_sale_keys(records: Iterator, format_name: str, pause_gc: bool) -> list[tuple[int, str, str, bool]]:
+    '''Номер строки, номер продажи, VIN и признак отмены'''
+    storage_format = get_format(format_name)
+    return [(line_number, *storage_format.sale_key(record)) for line_number, record in records]
+
+
+def _scan_sales(records: Iterator, format_name: str, pause_gc: bool) -> list[tuple[int, Sale, bool]]:
+    '''Номер строки, разобранная продажа и признак отмены'''
+    storage_format = get_format(format_name)
+    with gc_paused(pause_gc):
+        return [
+            (line_number, storage_format.decode_sale(record), storage_format.sale_key(record)[2])
+            for line_number, record in records
+        ]
 
 
 class CarService:
-    def __init__(self, root_directory_path: str) -> None:
+    '''Сервис учета автомобилей, моделей и продаж поверх файлов в каталоге.
+
+    Один экземпляр можно безопасно использовать из нескольких потоков: у
+    каждого файла данных (и связанных с ним индексов в памяти) своя
+    блокировка "читатели-писатель", чтения идут параллельно, а записи
+    упорядочиваются только по тем файлам, которые они меняют.
+
+    С shared=True (по умолчанию, где есть fcntl) с одним каталогом могут
+    работать и несколько процессов: файлы защищены рекомендательными
+    блокировками flock, а процесс, заметивший по счетчику поколения чужую
+    запись, дочитывает только хвосты журналов индексов и новые записи.
+    Экземпляр нужно создавать уже после fork: открытые файлы-замки,
+    унаследованные дочерним процессом, не разделяют процессы между собой.
+
+    Изменения автомобилей и продаж проходят через журнал предзаписи (см.
+    wal): после сбоя посреди продажи, отмены или смены VIN операция при
+    следующем запуске доводится до конца, а не остается наполовину.
+    wal_sync=False отключает fsync журнала, если потеря последних операций
+    при отключении питания допустима.
+
+    Результаты get_car_info кэшируются (info_cache_size записей, каждая
+    живет не дольше info_cache_ttl секунд); продажа, отмена продажи и смена
+    VIN сбрасывают записи своих VIN, а изменения из другого процесса - весь
+    кэш. info_cache_size=0 отключает кэш.
+
+    Полные просмотры файлов (построение индексов, пересчет счетчиков,
+    уплотнение, снимки) для файлов от parallel_scan_bytes байт идут в пуле
+    из scan_workers процессов (по умолчанию по числу процессоров).
+
+    index_backend выбирает вид индексов по ключам (VIN, номерам и датам
+    продаж): 'sorted' - отсортированные в памяти индексы с журналом (см.
+    indexes), 'btree' - B+-деревья на диске (см. btree), которые не
+    загружаются в память целиком. Если в каталоге есть только индексы
+    другого вида, B+-деревья строятся по ним при открытии. Индекс моделей
+    меняется вне журнала предзаписи и всегда остается отсортированным.
+
+    pause_gc=True приостанавливает сборщик мусора на время пакетного
+    разбора записей (get_cars, отчеты, просмотры файлов): это быстрее на
+    больших выборках, но пауза действует на весь процесс, и пока она идет,
+    циклический мусор других потоков не собирается.
+
+    metrics=True включает метрики (см. metrics): время операций и этапов
+    записи и счетчики ввода-вывода с момента открытия сервиса, их отдают
+    metrics() и metrics_prometheus(). Без них методы не обертываются, а
+    файлы лишь проверяют, что счетчиков нет.
+    '''
+
+    def __init__(self, root_directory_path: str, validate_reads: bool = False,
+                 storage_format: str = 'text', shared: bool = True, wal_sync: bool = True,
+                 info_cache_size: int = INFO_CACHE_SIZE, info_cache_ttl: float | None = None,
+                 parallel_scan_bytes: int = PARALLEL_SCAN_MIN_BYTES, scan_workers: int | None = None,
+                 metrics: bool = False, index_backend: str = 'sorted', pause_gc: bool = False) -> None:
+        if index_backend not in INDEX_BACKENDS:
+            raise ValueError(f'Неизвестный вид индексов {index_backend}, доступны: {", ".join(INDEX_BACKENDS)}')
         self.root_directory_path = root_directory_path
-        self.models_file = os.path.join(root_directory_path, 'models.txt')
+        self._metrics = Metrics() if metrics else None
+        self._scan = ScanEngine(parallel_scan_bytes, scan_workers)
+        # VIN -> CarFullInfo и id модели -> Model; модели не меняются, поэтому их кэш не сбрасывается
+        self._info_cache = LRUCache(info_cache_size, info_cache_ttl)
+        self._model_cache = LRUCache(MODEL_CACHE_SIZE)
+        # Строки, переписанные на месте, для инкрементального обновления снимков
+        self._row_changes = RowChanges(STATUS_CHANGES_MAX)
+        # Блокировки по файлам данных; порядок имен - порядок захвата
+        self._locks = FileLocks(('models', 'cars', 'sales'), root_directory_path if shared else None)
+        # Полная валидация pydantic при чтении записей нужна только для чужих файлов
+        self.validate_reads = validate_reads
+        # Пауза сборщика мусора на время пакетного разбора записей (см. codec.gc_paused)
+        self.pause_gc = pause_gc
+        # Формат файлов данных: исходный текстовый или компактный бинарный
+        self.format = get_format(storage_format)
+        ext = self.format.extension
+        self.index_backend = index_backend
+        index_ext = INDEX_BACKENDS[index_backend]
+        self.models_file = os.path.join(root_directory_path, 'models' + ext)
+        # Модели пишутся мимо журнала предзаписи, а дописывание в журнал
+        # SortedIndex переживает сбой, поэтому их индекс всегда отсортированный
         self.models_index_file = os.path.join(root_directory_path, 'models_index.txt')
-        self.cars_file = os.path.join(root_directory_path, 'cars.txt')
-        self.cars_index_file = os.path.join(root_directory_path, 'cars_index.txt')
-        self.sales_file = os.path.join(root_directory_path, 'sales.txt')
-        self.sales_index_file = os.path.join(root_directory_path, 'sales_index.txt')
-
-        # Создаем все необходимые файлы
-        for file_path in [self.models_file, self.models_index_file,
-                self.cars_file, self.cars_index_file, self.sales_file, self.sales_index_file]:
+        self.cars_file = os.path.join(root_directory_path, 'cars' + ext)
+        self.cars_index_file = os.path.join(root_directory_path, 'cars_index' + index_ext)
+        self.sales_file = os.path.join(root_directory_path, 'sales' + ext)
+        self.sales_index_file = os.path.join(root_directory_path, 'sales_index' + index_ext)
+        self.sales_number_index_file = os.path.join(root_directory_path, 'sales_number_index' + index_ext)
+        self.sales_date_index_file = os.path.join(root_directory_path, 'sales_date_index' + index_ext)
+        self.model_sales_file = os.path.join(root_directory_path, 'model_sales.txt')
+        self.wal_file = os.path.join(root_directory_path, 'wal.log')
+
+        # Индексы и счетчики общие для форматов, поэтому нельзя молча начать
+        # бинарную базу рядом с заполненной текстовой. Если перенос прервался
+        # посреди подмены файлов, бинарные файлы появятся при ее завершении
+        if (self.format.name != 'text' and not os.path.exists(self.cars_file)
+                and not os.path.exists(os.path.join(root_directory_path, REPLACE_MANIFEST))):
+            text_cars_file = os.path.join(root_directory_path, 'cars.txt')
+            if os.path.exists(text_cars_file) and os.path.getsize(text_cars_file) > 0:
+                raise ValueError(
+                    f'В {root_directory_path} есть данные в текстовом формате, '
+                    'сначала перенесите их утилитой migrate'
+                )
+        # И наоборот: после переноса текстовые файлы остаются, но индексы и счетчики описывают бинарные
+        if self.format.name == 'text':
+            binary = get_format('binary')
+            binary_cars_file = os.path.join(root_directory_path, 'cars' + binary.extension)
+            if os.path.exists(binary_cars_file) and os.path.getsize(binary_cars_file) > len(binary.car_header):
+                raise ValueError(
+                    f'Данные {root_directory_path} перенесены в бинарный формат, '
+                    "откройте каталог с storage_format='binary'"
+                )
+
+        # После перехода на B+-деревья текстовые индексы больше не обновляются:
+        # открыть каталог с ними значит потерять записи, сделанные после перехода
+        if index_backend == 'sorted':
+            index_files = (self.cars_index_file, self.sales_index_file, self.sales_number_index_file,
+                           self.sales_date_index_file)
+            if any(os.path.exists(os.path.splitext(path)[0] + INDEX_BACKENDS['btree']) for path in index_files):
+                raise ValueError(
+                    f'Индексы {root_directory_path} ведутся B+-деревьями, '
+                    "откройте каталог с index_backend='btree'"
+                )
+
+        # Индексы по номерам и датам продаж появились позже остальных: в старом каталоге их строим по продажам
+        sales_key_indexes_missing = [
+            path for path in (self.sales_number_index_file, self.sales_date_index_file)
+            if not os.path.exists(path) and not os.path.exists(self._text_index_path(path))
+        ]
+
+        # Создаем все необходимые файлы; B+-деревья создает сам BTreeIndex
+        files = [self.models_file, self.models_index_file, self.cars_file, self.sales_file]
+        if index_backend == 'sorted':
+            files += [self.cars_index_file, self.sales_index_file,
+                      self.sales_number_index_file, self.sales_date_index_file]
+        for file_path in files:
             if not os.path.exists(file_path):
-                with open(file_path, 'w', encoding='utf-8') as f:
+                with open(file_path, 'a', encoding='utf-8') as f:
                     pass
 
+        # Фильтры Блума по ключам: имя файла данных -> фильтр (создаются последними)
+        self._filters: dict[str, BloomFilter] = {}
+
+        # Доводим до конца операции, прерванные сбоем, до загрузки индексов
+        self.wal = WriteAheadLog(self.wal_file, sync=wal_sync)
+        with self._locks.hold(write=('cars', 'sales')):
+            finish_replace(root_directory_path)
+            self.wal.replay(root_directory_path)
+        self._group_commit = GroupCommit(self._commit_batch)
+
+        # Состояние читается под блокировками: другой процесс может как раз писать
+        with self._locks.hold(read=self._locks.names):
+            # Загружаем индексы в память один раз, дальше только поддерживаем их при записи
+            self.models_index = SortedIndex(self.models_index_file, line_size=self.format.index_line_size)
+            self.cars_index = self._open_index(self.cars_index_file)
+            self.sales_index = self._open_index(self.sales_index_file)
+            # Номер действующей продажи -> номер строки продажи
+            self.sales_number_index = self._open_index(self.sales_number_index_file)
+            # Дата продажи и номер (см. sales_date_key) -> номер строки действующей продажи
+            self.sales_date_index = self._open_index(self.sales_date_index_file)
+
+            # Файлы данных отображаются в память на все время жизни сервиса
+            self.models_store = RecordStore(self.models_file, self.format.model_size, self.format.model_header)
+            self.cars_store = RecordStore(self.cars_file, self.format.car_size, self.format.car_header)
+            self.sales_store = RecordStore(self.sales_file, self.format.sale_size, self.format.sale_header)
+
+            # Вторичный индекс по статусу строится одним проходом по автомобилям.
+            # Смены статуса на месте другим процессам видны только через журнал
+            self.cars_changes = None
+            if self._locks.shared:
+                self.cars_changes = ChangeLog(os.path.join(root_directory_path, 'cars_changes.txt'))
+                self.cars_changes.read_new()
+            self.status_index = self._build_status_index()
+
+            # Счетчики продаж по моделям
+            counters_missing = not os.path.exists(self.model_sales_file)
+            self.model_sales = ModelSalesCounter(self.model_sales_file)
+        self._locks.on_change = self._refresh
+
+        # Если файла счетчиков еще не было, пересчитываем их по продажам
+        if counters_missing:
+            self.rebuild_model_sales()
+        if sales_key_indexes_missing:
+            self._build_sales_key_indexes(sales_key_indexes_missing)
+
+        # Фильтры Блума для проверки новых ключей: модели, VIN и номера продаж
+        self.models_filter = self._open_filter('models', self.models_index)
+        self.cars_filter = self._open_filter('cars', self.cars_index)
+        self.sales_number_filter = self._open_filter('sales', self.sales_number_index)
+
+        if self._metrics is not None:
+            self._instrument()
+
+    def _instrument(self) -> None:
+        '''Подключает счетчики к файлам и обертывает операции замером времени'''
+        indexes = (self.models_index, self.cars_index, self.sales_index, self.sales_number_index,
+                   self.sales_date_index)
+        files = [self.models_store, self.cars_store, self.sales_store, self.model_sales.store, self.wal,
+                 *indexes, *(index.journal for index in indexes), *self._filters.values()]
+        if self.cars_changes is not None:
+            files.append(self.cars_changes)
+        for file in files:
+            file.metrics = self._metrics
+
+        timed = self._metrics.timed
+        for name in TIMED_OPERATIONS + TIMED_PHASES:
+            setattr(self, name, timed(name.lstrip('_'), getattr(self, name)))
+        # Группа фиксации запомнила метод до обертки
+        self._group_commit = GroupCommit(self._commit_batch)
+        self.wal.commit = timed('wal_commit', self.wal.commit)
+        for index in indexes:
+            index.compact = timed('index_compact', index.compact)
+
+    def metrics(self) -> dict:
+        '''Метрики обычным словарем (см. Metrics.snapshot); пустой словарь, если они выключены'''
+        return {} if self._metrics is None else self._metrics.snapshot()
+
+    def metrics_prometheus(self) -> str:
+        '''Метрики в текстовом формате Prometheus; пустая строка, если они выключены'''
+        return '' if self._metrics is None else self._metrics.prometheus()
+
+    @staticmethod
+    def _text_index_path(path: str) -> str:
+        return os.path.splitext(path)[0] + INDEX_BACKENDS['sorted']
+
+    def _open_index(self, path: str) -> Index:
+        '''Открывает индекс выбранного вида; B+-дерево в каталоге с текстовыми индексами строится по ним'''
+        if self.index_backend == 'sorted':
+            return SortedIndex(path, line_size=self.format.index_line_size)
+        text_path = self._text_index_path(path)
+        if not os.path.exists(path) and os.path.exists(text_path):
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            BTreeIndex.create(tmp_path, SortedIndex(text_path, line_size=self.format.index_line_size).items())
+            os.replace(tmp_path, path)
+        return BTreeIndex(path)
+
+    def _open_filter(self, name: str, index: Index) -> BloomFilter:
+        '''Открывает фильтр Блума ключей индекса, а если его нет - строит по индексу'''
+        stem = os.path.splitext(os.path.basename(index.path))[0].removesuffix('_index')
+        path = os.path.join(self.root_directory_path, stem + '_bloom.bin')
+        # Построение фильтра очищает журнал предзаписи: на это время нужны и
+        # блокировки автомобилей и продаж, под которыми идут все транзакции
+        with self._locks.hold(write=(name, 'cars', 'sales')):
+            try:
+                key_filter = BloomFilter(path)
+            except (FileNotFoundError, ValueError):
+                # Файл создается в обход журнала предзаписи, поэтому журнал очищается заранее
+                self._checkpoint()
+                BloomFilter.create(path, iter(index), 2 * len(index))
+                key_filter = BloomFilter(path)
+            self._filters[name] = key_filter
+        return key_filter
+
+    def _rebuild_filter(self, name: str, index: Index) -> None:
+        '''Перестраивает переполненный фильтр с запасом в два раза'''
+        self._filters[name].rebuild(iter(index), 2 * len(index))
+
+    @locked(write=('cars', 'sales'))
+    def _build_sales_key_indexes(self, paths: list[str]) -> None:
+        '''Строит индексы номеров и дат продаж из paths одним проходом по файлу продаж'''
+        # Индексы пишутся в обход журнала предзаписи, поэтому журнал очищается заранее
+        self._checkpoint()
+        indexes = [index for index in (self.sales_number_index, self.sales_date_index) if index.path in paths]
+        items: dict[str, list[tuple[str, int]]] = {index.path: [] for index in indexes}
+        for line_number, sale, deleted in self._scan_rows(self.sales_store, _scan_sales):
+            if deleted:
+                continue
+            if self.sales_number_index.path in items:
+                items[self.sales_number_index.path].append((sale.sales_number, line_number))
+            if self.sales_date_index.path in items:
+                items[self.sales_date_index.path].append(
+                    (sales_date_key(sale.sales_date, sale.sales_number), line_number))
+        for index in indexes:
+            index.insert_many(items[index.path])
+            index.compact()
+
+    def _scan_rows(self, store: RecordStore, task) -> Iterator:
+        '''Результаты задачи просмотра по всем записям store в порядке строк'''
+        return itertools.chain.from_iterable(self._scan.map(store, task, self.format.name, self.pause_gc))
+
+    def _build_status_index(self) -> StatusIndex:
+        status_index = StatusIndex()
+        for line_number, status in self._scan_rows(self.cars_store, _scan_car_statuses):
+            status_index.add(line_number, status)
+        return status_index
+
+    def _refresh(self, name: str) -> None:
+        '''Подхватывает изменения файла name и его индексов, сделанные другим процессом'''
+        if name in self._filters:
+            self._filters[name].refresh()
+        if name == 'models':
+            self.models_store.refresh()
+            self.models_index.refresh()
+            return
+        # Какие VIN изменил другой процесс, неизвестно
+        self._info_cache.clear()
+        if name == 'cars':
+            known = len(self.cars_store)
+            self.cars_store.refresh()
+            self.cars_index.refresh()
+            changed = self.cars_changes.read_new()
+            if changed is None:
+                # Журнал смен статуса очищен: строим индекс статусов заново
+                self.status_index = self._build_status_index()
+                self._row_changes.reset()
+                return
+            for line_number in map(int, changed):
+                if line_number < known:
+                    self._row_changes.add('cars', line_number)
+                    status = self.format.car_status(self.cars_store.read(line_number))
+                    self.status_index.move(line_number, self.status_index.status_of(line_number), status)
+            for line_number in range(known, len(self.cars_store)):
+                self.status_index.add(line_number, self.format.car_status(self.cars_store.read(line_number)))
+        elif name == 'sales':
+            # Отмены продаж другим процессом не журналируются: снимки строятся заново
+            self._row_changes.reset()
+            self.sales_store.refresh()
+            self.sales_index.refresh()
+            self.sales_number_index.refresh()
+            self.sales_date_index.refresh()
+            self.model_sales.refresh()
+
+    def _reload(self, name: str) -> None:
+        '''Перечитывает с диска целиком состояние файла name и его индексов.
+
+        В отличие от _refresh не полагается на состояние в памяти: оно может
+        содержать изменения незафиксированной транзакции.
+        '''
+        self._info_cache.clear()
+        self._row_changes.reset()
+        if name in self._filters:
+            self._filters[name].refresh()
+        if name == 'cars':
+            self.cars_store.refresh()
+            self.cars_index.load()
+            if self.cars_changes is not None:
+                self.cars_changes.rewind()
+                self.cars_changes.read_new()
+            self.status_index = self._build_status_index()
+        else:
+            self.sales_store.refresh()
+            for index in (self.sales_index, self.sales_number_index, self.sales_date_index):
+                index.load()
+            self.model_sales.refresh()
+
+    def _recover(self, held: tuple[str, ...]) -> None:
+        '''Доводит до конца операцию из журнала предзаписи и перечитывает состояние с диска.
+
+        Запись журнала без отметки о применении оставил процесс, упавший
+        посреди операции (или эта же транзакция, не дописавшая файлы). Ее
+        нужно применить раньше новых записей: иначе новые операции займут те
+        же места в файлах, а очистка журнала потеряет зафиксированную
+        операцию. held - файлы, уже захваченные на запись; блокировки
+        остальных файлов, которые меняют транзакции, берутся здесь.
+        '''
+        with self._locks.hold(write=tuple(name for name in ('cars', 'sales') if name not in held)):
+            self.wal.recover(self.root_directory_path)
+            for name in ('cars', 'sales'):
+                self._reload(name)
+
+    def _set_car_status(self, line_number: int, car: Car, status: CarStatus) -> None:
+        '''Меняет статус автомобиля в файле и во вторичном индексе'''
+        self.status_index.move(line_number, car.status.value, status.value)
+        self._row_changes.add('cars', line_number)
+        car.status = status
+        self.cars_store.write(line_number, self.format.encode_car(car))
+        if self.cars_changes is not None:
+            self.cars_changes.append([str(line_number)])
+
+    def _journaled(self, name: str) -> list:
+        '''Файлы, изменения которых в транзакции идут через журнал предзаписи'''
+        if name == 'cars':
+            files = [self.cars_store, self.cars_index.journal]
+            if self.cars_changes is not None:
+                files.append(self.cars_changes)
+        else:
+            files = [self.sales_store, self.sales_index.journal, self.sales_number_index.journal,
+                     self.sales_date_index.journal, self.model_sales.store]
+        if name in self._filters:
+            files.append(self._filters[name])
+        return files
+
+    def _transact(self, files: tuple[str, ...], operation, *args):
+        '''Выполняет операцию в транзакции в составе ближайшей группы фиксации.
+
+        Операция должна проверить все условия до первого изменения: тогда
+        ошибка одной операции не затрагивает остальные операции группы.
+        '''
+        return self._group_commit.submit(functools.partial(operation, *args), files)
+
+    def _commit_batch(self, batch: list) -> None:
+        '''Выполняет группу операций и фиксирует их одной записью журнала предзаписи'''
+        files = tuple(name for name in ('cars', 'sales') if any(name in request.files for request in batch))
+        with self._locks.hold(write=files):
+            if self.wal.unapplied():
+                self._recover(files)
+            journaled = [file for name in files for file in self._journaled(name)]
+            for file in journaled:
+                file.begin()
+            try:
+                for request in batch:
+                    request.run()
+                writes = [
+                    (os.path.basename(file.path), offset, data)
+                    for file in journaled
+                    for offset, data in file.pending_writes()
+                ]
+                if writes:
+                    self.wal.commit(writes)
+                # Журнал на диске: теперь изменения можно писать в сами файлы
+                for file in journaled:
+                    file.apply()
+                if writes:
+                    self.wal.mark_applied()
+            except BaseException:
+                for file in journaled:
+                    file.discard()
+                # Индексы, счетчики и кэши в памяти уже изменены операциями группы:
+                # перечитываем их с диска, доведя до конца запись журнала, если она успела сохраниться
+                self._recover(files)
+                raise
+            self._after_commit(files)
+
+    def _after_commit(self, files: tuple[str, ...]) -> None:
+        '''Уплотняет разросшиеся журналы; перед перезаписью файлов очищается журнал предзаписи'''
+        indexes = [
+            index for name, index in (
+                ('cars', self.cars_index), ('sales', self.sales_index), ('sales', self.sales_number_index),
+                ('sales', self.sales_date_index)
+            )
+            if name in files and index.compaction_due()
+        ]
+        reset_changes = ('cars' in files and self.cars_changes is not None
+                         and self.cars_changes.entries >= STATUS_CHANGES_MAX)
+        saturated = [
+            (name, index) for name, index in (('cars', self.cars_index), ('sales', self.sales_number_index))
+            if name in files and self._filters[name].saturated()
+        ]
+        if indexes or reset_changes or saturated or self.wal.size() >= WAL_CHECKPOINT_BYTES:
+            self._checkpoint()
+            for index in indexes:
+                index.compact()
+            if reset_changes:
+                self.cars_changes.reset()
+            for name, index in saturated:
+                self._rebuild_filter(name, index)
+
+    def _checkpoint(self) -> None:
+        '''Сохраняет файлы на диск и очищает журнал предзаписи.
+
+        Вызывается под исключительными блокировками автомобилей и продаж
+        (транзакция после фиксации - под своими: ее запись уже применена).
+        Операция упавшего процесса сначала доводится до конца.
+        '''
+        if self.wal.unapplied():
+            self._recover(('cars', 'sales'))
+        for name in ('cars', 'sales'):
+            for file in self._journaled(name):
+                file.sync()
+        self.wal.truncate()
+
+    def close(self) -> None:
+        '''Закрывает отображения файлов данных и счетчиков'''
+        with self._locks.hold(write=self._locks.names):
+            self._checkpoint()
+            for store in (self.models_store, self.cars_store, self.sales_store):
+                store.close()
+            self.model_sales.close()
+            for index in (self.models_index, self.cars_index, self.sales_index, self.sales_number_index,
+                          self.sales_date_index):
+                index.close()
+            for key_filter in self._filters.values():
+                key_filter.close()
+            self.wal.close()
+        self._scan.close()
+        self._locks.close()
+
+    def __enter__(self) -> 'CarService':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
     # Задание 1. Сохранение автомобилей и моделей
     # Добавляем модель
+    @locked(write=('models',))
     def add_model(self, model: Model) -> Model:
-        # проверяем существование модели в файле
-        existings_id = set()
-        if os.path.exists(self.models_file):
-            with open(self.models_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = line.strip()
-                    if data:
-                        parts = data.split(';')
-                        existings_id.add(parts[0])
-        if str(model.id) in existings_id:
+        # проверяем существование модели по фильтру и индексу
+        if self._key_exists(str(model.id), self.models_index, self.models_filter):
             raise ValueError(f'Модель {model.name} бренд {model.brand} уже существует')
+        record = self.format.encode_model(model)
+        # Ключ попадает в фильтр раньше, чем в индекс: лишний ключ в фильтре безопасен
+        self.models_filter.add(str(model.id))
         # Добавляем модель в файл
-        with open(self.models_file, 'a', encoding='utf-8') as f:
-            # вычисляем номер строки перед вставкой данных
-            line_number = os.path.getsize(self.models_file) // 501
-            model_str = f'{model.id};{model.name};{model.brand}'.ljust(500) + '\n'
-            f.write(model_str)
+        line_number = self.models_store.append([record])
         # Обновляем индекс
-        self._update_model_index(str(model.id), line_number)
+        self.models_index.insert(str(model.id), line_number)
+        if self.models_filter.saturated():
+            self._rebuild_filter('models', self.models_index)
         return model
-    
+
     # Добавляем автомобиль
     def add_car(self, car: Car) -> Car:
-        # Проверяем существование автомобиля в файле по vin
-        existing_vin = set()
-        if os.path.exists(self.cars_file):
-            with open(self.cars_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = line.strip()
-                    if data:
-                        parts = data.split(';')
-                        existing_vin.add(parts[0])
-        if car.vin in existing_vin:
+        return self._transact(('cars',), self._add_car, car)
+
+    def _add_car(self, car: Car) -> Car:
+        # Проверяем существование автомобиля по фильтру и индексу vin
+        if self._key_exists(car.vin, self.cars_index, self.cars_filter):
             raise ValueError(f'Автомобиль {car.model} vin {car.vin} уже существует')
+        record = self.format.encode_car(car)
         # Добавляем автомобиль в файл
-        with open(self.cars_file, 'a', encoding='utf-8') as f:
-            # вычисляем номер строки на которую будет вставка
-            line_number = os.path.getsize(self.cars_file) // 501
-            car_str = f"{car.vin};{car.model};{car.price};{car.date_start};{car.status.value}".ljust(500) + '\n'
-            f.write(car_str)
-        # Обновляем индекс
-        self._update_car_index(str(car.vin), line_number)
+        line_number = self.cars_store.append([record])
+        # Обновляем фильтр и индексы
+        self.cars_filter.add(car.vin)
+        self.cars_index.insert(car.vin, line_number)
+        self.status_index.add(line_number, car.status.value)
         return car
-    
-    def _update_model_index(self, model_id: str, line_number: int):
-        '''Обновляет индексы моделей'''
-        index_list = []
-        # Читаем существующий файл с индексами
-        if os.path.exists(self.models_index_file):
-            with open(self.models_index_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = line.strip()
-                    if data:
-                        parts = data.split(';')
-                        index_list.append((parts[0], parts[1]))
-        # Вычисляем позицию для вставки индекса
-        keys = [item[0] for item in index_list]
-        insert_pos = bisect.bisect_left(keys, model_id)
-        # Делаем вставку в список на нужное место с учетом сортировки бинарным поиском
-        index_list.insert(insert_pos, (model_id, str(line_number)))
-
-        # Делаем замену файла с индексами
-        with open(self.models_index_file, 'w', encoding='utf-8') as f:
-            for key, line_num in index_list:
-                line = f'{key};{line_num}'.ljust(500) + '\n'
-                f.write(line)
-
-    def _update_car_index(self, vin_num: str, line_number: int):
-        '''Обновляет индексы моделей'''
-        index_list = []
-        # Читаем файл с существующими индексами
-        if os.path.exists(self.cars_index_file):
-            with open(self.cars_index_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = line.strip()
-                    if data:
-                        parts = data.split(';')
-                        index_list.append((parts[0], parts[1]))
-        # Вычисляем позицию для вставки индекса
-        keys = [item[0] for item in index_list]
-        insert_pos = bisect.bisect_left(keys, vin_num)
-        index_list.insert(insert_pos, (vin_num, str(line_number)))
-
-        # пересохраняем файл с новыми индексами
-        with open(self.cars_index_file, 'w', encoding='utf-8') as f:
-            for key, line_num in index_list:
-                line = f'{key};{line_num}'.ljust(500) + '\n'
-                f.write(line)
-
-        
+
+    # Пакетная загрузка: дубликаты проверяются один раз, записи пишутся одним блоком
+    @locked(write=('models',))
+    def add_models_bulk(self, models: Iterable[Model]) -> list[Model]:
+        '''Добавляет пачку моделей одной записью в файл'''
+        models = list(models)
+        keys = [str(model.id) for model in models]
+        self._check_new_keys(keys, self.models_index, self.models_filter, 'Модель')
+        records = [self.format.encode_model(model) for model in models]
+        self.models_filter.add_many(keys)
+        first_line = self.models_store.append(records)
+        self.models_index.insert_many([(key, first_line + i) for i, key in enumerate(keys)])
+        if self.models_filter.saturated():
+            self._rebuild_filter('models', self.models_index)
+        return models
+
+    def add_cars_bulk(self, cars: Iterable[Car]) -> list[Car]:
+        '''Добавляет пачку автомобилей одной записью в файл'''
+        return self._transact(('cars',), self._add_cars_bulk, list(cars))
+
+    def _add_cars_bulk(self, cars: list[Car]) -> list[Car]:
+        self._check_new_keys([car.vin for car in cars], self.cars_index, self.cars_filter, 'Автомобиль с VIN')
+        records = [self.format.encode_car(car) for car in cars]
+        first_line = self.cars_store.append(records)
+        self.cars_filter.add_many([car.vin for car in cars])
+        self.cars_index.insert_many([(car.vin, first_line + i) for i, car in enumerate(cars)])
+        for i, car in enumerate(cars):
+            self.status_index.add(first_line + i, car.status.value)
+        return cars
+
+    def sell_cars_bulk(self, sales: Iterable[Sale]) -> list[Car]:
+        '''Проводит пачку продаж: обновляет статусы и дописывает продажи одним блоком'''
+        return self._transact(('cars', 'sales'), self._sell_cars_bulk, list(sales))
+
+    def _sell_cars_bulk(self, sales: list[Sale]) -> list[Car]:
+        vins = [sale.car_vin for sale in sales]
+        if len(set(vins)) != len(vins):
+            raise ValueError('В пачке есть несколько продаж одного автомобиля')
+        car_lines = []
+        for vin in vins:
+            car_line_number = self.cars_index.get(vin)
+            if car_line_number is None:
+                raise ValueError(f'Автомобиль с VIN {vin} не найден')
+            car_lines.append(car_line_number)
+        records = [self.format.encode_sale(sale) for sale in sales]
+        self._info_cache.invalidate(*vins)
+
+        # Обновляем статусы в порядке номеров строк, чтобы запись шла последовательно
+        cars = {}
+        for car_line_number in sorted(car_lines):
+            car = self._read_car(car_line_number)
+            self._set_car_status(car_line_number, car, CarStatus.sold)
+            cars[car_line_number] = car
+
+        first_line = self.sales_store.append(records)
+        self.sales_index.insert_many([(vin, first_line + i) for i, vin in enumerate(vins)])
+        self.sales_number_index.insert_many(
+            [(sale.sales_number, first_line + i) for i, sale in enumerate(sales)])
+        self.sales_date_index.insert_many(
+            [(sales_date_key(sale.sales_date, sale.sales_number), first_line + i) for i, sale in enumerate(sales)])
+        self.sales_number_filter.add_many([sale.sales_number for sale in sales])
+        sold = [cars[car_line_number] for car_line_number in car_lines]
+        for car in sold:
+            self.model_sales.increment(car.model)
+        return sold
+
+    @staticmethod
+    def _key_exists(key: str, index: Index, key_filter: BloomFilter) -> bool:
+        '''Проверяет ключ: промах фильтра Блума точен, индекс проверяется только при совпадении'''
+        return key in key_filter and key in index
+
+    @classmethod
+    def _check_new_keys(cls, keys: list[str], index: Index, key_filter: BloomFilter, title: str) -> None:
+        '''Проверяет, что ключи пачки уникальны и еще не встречаются в индексе'''
+        seen = set()
+        for key in keys:
+            if key in seen or cls._key_exists(key, index, key_filter):
+                raise ValueError(f'{title} {key} уже существует')
+            seen.add(key)
+
+    def _read_car(self, line_number: int) -> Car:
+        return self.format.decode_car(self.cars_store.read_bytes(line_number), self.validate_reads)
+
     # Задание 2. Сохранение продаж.
     def sell_car(self, sale: Sale) -> Car:
-        # Находим номер строки в файле индексов по vin
-        car_line_number = None
-        with open(self.cars_index_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                data = line.strip()
-                parts = data.split(';')
-                if parts[0] == sale.car_vin:
-                    car_line_number = parts[1]
-                    break
+        return self._transact(('cars', 'sales'), self._sell_car, sale)
+
+    def _sell_car(self, sale: Sale) -> Car:
+        # Находим номер строки автомобиля по индексу vin
+        car_line_number = self.cars_index.get(sale.car_vin)
+        if car_line_number is None:
+            raise ValueError(f'Автомобиль с VIN {sale.car_vin} не найден')
+        record = self.format.encode_sale(sale)
+        self._info_cache.invalidate(sale.car_vin)
         # Находим машину в списке машин и меняем статус
-        with open(self.cars_file, 'r+', encoding='utf-8') as f:
-            if car_line_number:
-                f.seek(int(car_line_number) * 501)
-                current_line = f.read(501).rstrip()
-                parts = current_line.split(';')
-                vin, model, price_str, date_start, current_status = parts[:5]
-                car = Car(
-                    vin=vin,
-                    model=int(model.strip()),
-                    price=Decimal(price_str),
-                    date_start=datetime.strptime(date_start.strip(), '%Y-%m-%d %H:%M:%S'),
-                    status=CarStatus(current_status)
-                )
-            # Обновляем статус
-            car.status = CarStatus.sold
-            # Формируем строку с новым статусом
-            updated_line = f"{car.vin};{car.model};{car.price};{car.date_start};{car.status}".ljust(500) + '\n'
-            f.seek(int(car_line_number) * 501)
-            f.write(updated_line)
+        car = self._read_car(car_line_number)
+        self._set_car_status(car_line_number, car, CarStatus.sold)
         # Сохраняем информацию о продаже
-        self._save_sale_info(sale)
+        self._save_sale_info(sale, record)
+        self.model_sales.increment(car.model)
         return car
-            
-    def _save_sale_info(self, sale: Sale):
+
+    def _save_sale_info(self, sale: Sale, record: bytes):
         '''Сохраняет информацию о продаже в файл и обновляет индекс'''
         # Добавляем продажу в файл
-        with open(self.sales_file, 'a', encoding='utf-8') as f:
-            # вычисляем номер строки перед вставкой данных
-            line_number = os.path.getsize(self.sales_file) // 501
-            # Форматируем дату в строку
-            date_str = sale.sales_date.strftime('%Y-%m-%d %H:%M:%S')
-            # Формируем строку для записи
-            sale_str = f"{sale.sales_number};{sale.car_vin};{date_str};{sale.cost}".ljust(500) + '\n'
-            f.write(sale_str)
-        
+        line_number = self.sales_store.append([record])
         # Обновляем индекс продаж
-        index_list = []
-        # Читаем существующий файл с индексами
-        if os.path.exists(self.sales_index_file):
-            with open(self.sales_index_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = line.strip()
-                    if data:
-                        parts = data.split(';')
-                        index_list.append((parts[0], parts[1]))
-        
-        # Вычисляем позицию для вставки индекса
-        keys = [item[0] for item in index_list]
-        insert_pos = bisect.bisect_left(keys, sale.car_vin)
-        # Делаем вставку в список на нужное место с учетом сортировки
-        index_list.insert(insert_pos, (sale.car_vin, str(line_number)))
-
-        # Сохраняем обновленный индекс
-        with open(self.sales_index_file, 'w', encoding='utf-8') as f:
-            for key, line_num in index_list:
-                line = f'{key};{line_num}'.ljust(500) + '\n'
-                f.write(line)
+        self.sales_index.insert(sale.car_vin, line_number)
+        self.sales_number_index.insert(sale.sales_number, line_number)
+        self.sales_date_index.insert(sales_date_key(sale.sales_date, sale.sales_number), line_number)
+        self.sales_number_filter.add(sale.sales_number)
 
     # Задание 3. Доступные к продаже
+    @locked(read=('cars',))
     def get_cars(self, status: CarStatus) -> list[Car]:
-        '''Возвращает список автомобилей с указанным статусом, отсортированный по VIN'''
+        '''Возвращает список автомобилей с указанным статусом в порядке добавления'''
+        # Читаем только строки, которые вторичный индекс относит к статусу
+        read = self.cars_store.read_bytes
+        with gc_paused(self.pause_gc):
+            return self.format.decode_cars(map(read, self.status_index.lines(status.value)), self.validate_reads)
+
+    def iter_cars(self, status: CarStatus | None = None, after_vin: str | None = None,
+                  limit: int | None = None) -> Iterator[Car]:
+        '''Постранично отдает автомобили в порядке VIN, начиная после after_vin.
+
+        Записи читаются лениво небольшими порциями, фильтр по статусу
+        проверяется по индексу в памяти, поэтому страница не требует чтения
+        лишних строк. Блокировка держится только на время чтения порции, а
+        следующая порция продолжается с последнего отданного VIN.
+        '''
+        remaining = limit
+        while remaining is None or remaining > 0:
+            chunk_size = ITER_CHUNK_SIZE if remaining is None else min(remaining, ITER_CHUNK_SIZE)
+            chunk = self._cars_chunk(status, after_vin, chunk_size)
+            yield from chunk
+            if len(chunk) < chunk_size:
+                return
+            after_vin = chunk[-1].vin
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    @locked(read=('cars',))
+    def _cars_chunk(self, status: CarStatus | None, after_vin: str | None, size: int) -> list[Car]:
+        '''Читает до size автомобилей в порядке VIN после after_vin'''
         cars = []
-        # Читаем все автомобили из файла
-        with open(self.cars_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                data = line.strip()
-                if not data:
-                    continue
-                parts = data.split(';')
-                vin, model, price_str, date_start, current_status = parts[:5]
-                # Если статус совпадает, добавляем автомобиль в список
-                if current_status == status.value:
-                    car = Car(
-                        vin=vin,
-                        model=int(model.strip()),
-                        price=Decimal(price_str),
-                        date_start=datetime.strptime(date_start.strip(), '%Y-%m-%d %H:%M:%S'),
-                        status=CarStatus(current_status)
-                    )
-                    cars.append(car)
-        
-        # Сортируем список по VIN
-        # cars.sort(key=lambda x: x.vin)
-        
+        for vin in self.cars_index.keys_after(after_vin):
+            car_line_number = self.cars_index.get(vin)
+            if car_line_number is None:
+                continue
+            if status is not None and self.status_index.status_of(car_line_number) != status.value:
+                continue
+            cars.append(self._read_car(car_line_number))
+            if len(cars) >= size:
+                break
         return cars
 
     # Задание 4. Детальная информация
+    @locked(read=('models', 'cars', 'sales'))
     def get_car_info(self, vin: str) -> CarFullInfo | None:
         '''Получает полную информацию об автомобиле по VIN'''
-        # Находим номер строки в файле индексов по vin
-        car_line_number = None
-        with open(self.cars_index_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                data = line.strip()
-                parts = data.split(';')
-                if parts[0] == vin:
-                    car_line_number = parts[1]
-                    break
-        
-        if not car_line_number:
+        info = self._info_cache.get(vin)
+        if info is not MISSING:
+            # Каждый вызывающий получает свою копию, кэш не меняется снаружи
+            return info.model_copy()
+        if vin not in self.cars_filter:
+            return None
+        car_line_number = self.cars_index.get(vin)
+        if car_line_number is None:
             return None
-            
+
         # Читаем информацию об автомобиле
-        with open(self.cars_file, 'r', encoding='utf-8') as f:
-            f.seek(int(car_line_number) * 501)
-            current_line = f.read(501).rstrip()
-            parts = current_line.split(';')
-            vin, model_id, price_str, date_start, status = parts[:5]
-            
-            # Читаем информацию о модели
-            model_line_number = None
-            with open(self.models_index_file, 'r', encoding='utf-8') as f_model:
-                for line in f_model:
-                    data = line.strip()
-                    parts = data.split(';')
-                    if parts[0] == model_id:
-                        model_line_number = parts[1]
-                        break
-            
-            if not model_line_number:
-                return None
-                
-            # Читаем данные модели
-            with open(self.models_file, 'r', encoding='utf-8') as f_model:
-                f_model.seek(int(model_line_number) * 501)
-                model_line = f_model.read(501).rstrip()
-                model_parts = model_line.split(';')
-                _, model_name, model_brand = model_parts[:3]
-            
-            # Ищем информацию о продаже
-            sales_date = None
-            sales_cost = None
-            with open(self.sales_index_file, 'r', encoding='utf-8') as f_sales:
-                for line in f_sales:
-                    data = line.strip()
-                    parts = data.split(';')
-                    if parts[0] == vin:
-                        sale_line_number = parts[1]
-                        with open(self.sales_file, 'r', encoding='utf-8') as f_sale:
-                            f_sale.seek(int(sale_line_number) * 501)
-                            sale_line = f_sale.read(501).rstrip()
-                            sale_parts = sale_line.split(';')
-                            sales_date = datetime.strptime(sale_parts[2], '%Y-%m-%d %H:%M:%S')
-                            sales_cost = Decimal(sale_parts[3])
-                        break
-            
-            return CarFullInfo(
-                vin=vin,
-                car_model_name=model_name,
-                car_model_brand=model_brand,
-                price=Decimal(price_str),
-                date_start=datetime.strptime(date_start.strip(), '%Y-%m-%d %H:%M:%S'),
-                status=CarStatus(status),
-                sales_date=sales_date,
-                sales_cost=sales_cost
+        car = self._read_car(car_line_number)
+
+        # Читаем информацию о модели
+        model = self._get_model(car.model)
+        if model is None:
+            return None
+
+        # Ищем информацию о продаже
+        sale = None
+        sale_line_number = self.sales_index.get(vin)
+        if sale_line_number is not None:
+            sale = self.format.decode_sale(self.sales_store.read_bytes(sale_line_number), self.validate_reads)
+
+        info = build_full_info(car, model, sale, self.validate_reads)
+        # Запись идет под блокировкой чтения: изменить автомобиль сейчас никто не может
+        self._info_cache.put(vin, info)
+        return info.model_copy()
+
+    @locked(read=('models', 'cars', 'sales'))
+    def get_car_info_many(self, vins: Iterable[str]) -> list[CarFullInfo | None]:
+        '''Получает полную информацию по пачке VIN; результаты в порядке запроса.
+
+        Вся пачка читается под одним захватом блокировок. Индексы уже в
+        памяти, поэтому номера строк находятся по ним, а записи автомобилей
+        и продаж читаются по возрастанию номеров строк, то есть
+        последовательно по файлу. Каждая модель читается один раз.
+        '''
+        vins = list(vins)
+        found: dict[str, CarFullInfo | None] = {}
+        car_lines = []
+        for vin in dict.fromkeys(vins):
+            info = self._info_cache.get(vin)
+            if info is not MISSING:
+                found[vin] = info
+                continue
+            car_line_number = self.cars_index.get(vin) if vin in self.cars_filter else None
+            if car_line_number is None:
+                found[vin] = None
+            else:
+                car_lines.append((car_line_number, vin))
+
+        with gc_paused(self.pause_gc):
+            cars = {vin: self._read_car(line_number) for line_number, vin in sorted(car_lines)}
+            sale_lines = sorted(
+                (sale_line_number, vin) for vin in cars
+                if (sale_line_number := self.sales_index.get(vin)) is not None
             )
+            sales = {
+                vin: self.format.decode_sale(self.sales_store.read_bytes(line_number), self.validate_reads)
+                for line_number, vin in sale_lines
+            }
+            models: dict[int, Model | None] = {}
+            for vin, car in cars.items():
+                if car.model not in models:
+                    models[car.model] = self._get_model(car.model)
+                model = models[car.model]
+                info = None
+                if model is not None:
+                    info = build_full_info(car, model, sales.get(vin), self.validate_reads)
+                    self._info_cache.put(vin, info)
+                found[vin] = info
+
+        return [None if found[vin] is None else found[vin].model_copy() for vin in vins]
+
+    def _get_model(self, model_id: int) -> Model | None:
+        '''Читает модель по id через кэш моделей'''
+        model = self._model_cache.get(model_id)
+        if model is MISSING:
+            model_line_number = self.models_index.get(str(model_id))
+            if model_line_number is None:
+                return None
+            model = self.format.decode_model(self.models_store.read_bytes(model_line_number), self.validate_reads)
+            self._model_cache.put(model_id, model)
+        return model
+
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        '''Попадания, промахи и размер кэшей get_car_info и моделей'''
+        return {'car_info': self._info_cache.stats(), 'models': self._model_cache.stats()}
 
     # Задание 5. Обновление ключевого поля
     def update_vin(self, vin: str, new_vin: str) -> Car:
         '''Обновляет VIN номер автомобиля и все связанные записи'''
-        # Находим номер строки в файле индексов по vin
-        car_line_number = None
-        with open(self.cars_index_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                data = line.strip()
-                parts = data.split(';')
-                if parts[0] == vin:
-                    car_line_number = parts[1]
-                    break
-        
-        if not car_line_number:
+        return self._transact(('cars', 'sales'), self._update_vin, vin, new_vin)
+
+    def _update_vin(self, vin: str, new_vin: str) -> Car:
+        car_line_number = self.cars_index.get(vin)
+        if car_line_number is None:
             raise ValueError(f'Автомобиль с VIN {vin} не найден')
-            
-        # Читаем информацию об автомобиле
-        with open(self.cars_file, 'r+', encoding='utf-8') as f:
-            f.seek(int(car_line_number) * 501)
-            current_line = f.read(501).rstrip()
-            parts = current_line.split(';')
-            _, model, price_str, date_start, status = parts[:5]
-            
-            # Создаем обновленный объект Car
-            car = Car(
-                vin=new_vin,
-                model=int(model.strip()),
-                price=Decimal(price_str),
-                date_start=datetime.strptime(date_start.strip(), '%Y-%m-%d %H:%M:%S'),
-                status=CarStatus(status)
-            )
-            
-            # Обновляем запись в файле cars.txt
-            updated_line = f"{new_vin};{model};{price_str};{date_start};{status}".ljust(500) + '\n'
-            f.seek(int(car_line_number) * 501)
-            f.write(updated_line)
-        
-        # Обновляем индекс автомобилей
-        index_list = []
-        with open(self.cars_index_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                data = line.strip()
-                if data:
-                    parts = data.split(';')
-                    if parts[0] != vin:  # Пропускаем старый VIN
-                        index_list.append((parts[0], parts[1]))
-        
-        # Добавляем новый VIN в индекс с тем же номером строки
-        keys = [item[0] for item in index_list]
-        insert_pos = bisect.bisect_left(keys, new_vin)
-        index_list.insert(insert_pos, (new_vin, car_line_number))
-        
-        # Сохраняем обновленный индекс
-        with open(self.cars_index_file, 'w', encoding='utf-8') as f:
-            for key, line_num in index_list:
-                line = f'{key};{line_num}'.ljust(500) + '\n'
-                f.write(line)
-        
-        # Обновляем VIN в файле продаж, если есть
-        if os.path.exists(self.sales_file):
-            with open(self.sales_file, 'r+', encoding='utf-8') as f:
-                lines = f.readlines()
-                f.seek(0)
-                for line in lines:
-                    if line.strip():
-                        parts = line.split(';')
-                        if parts[1] == vin:  # Если это продажа нашего автомобиля
-                            # Обновляем VIN в номере продажи и в записи
-                            sales_number = parts[0]
-                            new_sales_number = sales_number.replace(vin, new_vin)
-                            updated_line = f"{new_sales_number};{new_vin};{parts[2]};{parts[3]}".ljust(500) + '\n'
-                            f.write(updated_line)
-                        else:
-                            f.write(line)
-                f.truncate()
-        
-        # Обновляем индекс продаж
-        if os.path.exists(self.sales_index_file):
-            index_list = []
-            with open(self.sales_index_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = line.strip()
-                    if data:
-                        parts = data.split(';')
-                        if parts[0] != vin:  # Пропускаем старый VIN
-                            index_list.append((parts[0], parts[1]))
-            
-            # Добавляем новый VIN в индекс продаж с сохранением номера строки из файла продаж
-            if os.path.exists(self.sales_file):
-                with open(self.sales_file, 'r', encoding='utf-8') as f:
-                    for i, line in enumerate(f):
-                        if line.strip():
-                            parts = line.split(';')
-                            if parts[1] == new_vin:  # Если это продажа нашего автомобиля
-                                keys = [item[0] for item in index_list]
-                                insert_pos = bisect.bisect_left(keys, new_vin)
-                                index_list.insert(insert_pos, (new_vin, str(i)))
-                                break
-            
-            # Сохраняем обновленный индекс продаж
-            with open(self.sales_index_file, 'w', encoding='utf-8') as f:
-                for key, line_num in index_list:
-                    line = f'{key};{line_num}'.ljust(500) + '\n'
-                    f.write(line)
-        
+        if self._key_exists(new_vin, self.cars_index, self.cars_filter):
+            raise ValueError(f'Автомобиль с VIN {new_vin} уже существует')
+
+        # Готовим новые записи автомобиля и его продажи до первого изменения
+        car = self._read_car(car_line_number)
+        car.vin = new_vin
+        car_record = self.format.encode_car(car)
+        # Действующая продажа находится по индексу, файл продаж не просматривается.
+        # Отмененные продажи остаются в истории под тем VIN, с которым их провели
+        sale_line_number = self.sales_index.get(vin)
+        sale_record = None
+        if sale_line_number is not None:
+            # Обновляем VIN в номере продажи и в записи
+            sale = self.format.decode_sale(self.sales_store.read_bytes(sale_line_number))
+            old_sales_number = sale.sales_number
+            sale.sales_number = sale.sales_number.replace(vin, new_vin)
+            sale.car_vin = new_vin
+            sale_record = self.format.encode_sale(sale)
+
+        # Обновляем запись автомобиля; новый VIN в индексе указывает на ту же строку
+        self._info_cache.invalidate(vin, new_vin)
+        self.cars_store.write(car_line_number, car_record)
+        self._row_changes.add('cars', car_line_number)
+        self.cars_filter.add(new_vin)
+        self.cars_index.rename(vin, new_vin)
+
+        # Обновляем продажу на месте и индекс продаж: номер строки продажи не меняется
+        if sale_record is not None:
+            self.sales_store.write(sale_line_number, sale_record)
+            self._row_changes.add('sales', sale_line_number)
+            self.sales_index.rename(vin, new_vin)
+            if sale.sales_number != old_sales_number:
+                self.sales_number_filter.add(sale.sales_number)
+                self.sales_number_index.rename(old_sales_number, sale.sales_number)
+                self.sales_date_index.rename(
+                    sales_date_key(sale.sales_date, old_sales_number),
+                    sales_date_key(sale.sales_date, sale.sales_number))
+
         return car
 
     # Задание 6. Удаление продажи
     def revert_sale(self, sales_number: str) -> Car:
         '''Отменяет продажу автомобиля и удаляет запись о продаже'''
-        # Находим запись о продаже
-        car_vin = None
+        return self._transact(('cars', 'sales'), self._revert_sale, sales_number)
+
+    def _revert_sale(self, sales_number: str) -> Car:
+        # Находим запись о продаже по индексу номеров продаж
         sale_line_number = None
-        with open(self.sales_file, 'r', encoding='utf-8') as f:
-            for i, line in enumerate(f):
-                data = line.strip()
-                if data:
-                    parts = data.split(';')
-                    if parts[0] == sales_number:
-                        car_vin = parts[1]
-                        sale_line_number = i
-                        break
-        
-        if not car_vin:
+        if sales_number in self.sales_number_filter:
+            sale_line_number = self.sales_number_index.get(sales_number)
+        if sale_line_number is None:
             raise ValueError(f'Продажа с номером {sales_number} не найдена')
-        
-        # Находим номер строки в файле индексов по vin
-        car_line_number = None
-        with open(self.cars_index_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                data = line.strip()
-                parts = data.split(';')
-                if parts[0] == car_vin:
-                    car_line_number = parts[1]
-                    break
-        
-        if not car_line_number:
+        sale = self.format.decode_sale(self.sales_store.read_bytes(sale_line_number))
+        car_vin = sale.car_vin
+        self._info_cache.invalidate(car_vin)
+
+        car_line_number = self.cars_index.get(car_vin)
+        if car_line_number is None:
             raise ValueError(f'Автомобиль с VIN {car_vin} не найден')
-        
-        # Читаем информацию об автомобиле
-        with open(self.cars_file, 'r+', encoding='utf-8') as f:
-            f.seek(int(car_line_number) * 501)
-            current_line = f.read(501).rstrip()
-            parts = current_line.split(';')
-            vin, model, price_str, date_start, _ = parts[:5]
-            
-            # Создаем обновленный объект Car
-            car = Car(
-                vin=vin,
-                model=int(model.strip()),
-                price=Decimal(price_str),
-                date_start=datetime.strptime(date_start.strip(), '%Y-%m-%d %H:%M:%S'),
-                status=CarStatus.available
-            )
-            
-            # Обновляем запись в файле cars.txt
-            updated_line = f"{car.vin};{car.model};{car.price};{car.date_start};{car.status.value}".ljust(500) + '\n'
-            f.seek(int(car_line_number) * 501)
-            f.write(updated_line)
-        
+
+        sale_record = self.format.encode_sale(sale, deleted=True)
+
+        # Возвращаем автомобилю статус доступного к продаже
+        car = self._read_car(car_line_number)
+        self._set_car_status(car_line_number, car, CarStatus.available)
+
         # Помечаем запись о продаже как удаленную
-        with open(self.sales_file, 'r+', encoding='utf-8') as f:
-            f.seek(sale_line_number * 501)
-            current_line = f.read(501).rstrip()
-            parts = current_line.split(';')
-            # Добавляем флаг is_deleted в конец строки
-            updated_line = f"{parts[0]};{parts[1]};{parts[2]};{parts[3]};is_deleted".ljust(500) + '\n'
-            f.seek(sale_line_number * 501)
-            f.write(updated_line)
-        
-        # Обновляем индекс продаж
-        if os.path.exists(self.sales_index_file):
-            index_list = []
-            with open(self.sales_index_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = line.strip()
-                    if data:
-                        parts = data.split(';')
-                        if parts[0] != car_vin:  # Пропускаем удаляемую запись
-                            index_list.append((parts[0], parts[1]))
-            
-            # Сохраняем обновленный индекс продаж
-            with open(self.sales_index_file, 'w', encoding='utf-8') as f:
-                for key, line_num in index_list:
-                    line = f'{key};{line_num}'.ljust(500) + '\n'
-                    f.write(line)
-        
+        self.sales_store.write(sale_line_number, sale_record)
+        self._row_changes.add('sales', sale_line_number)
+
+        # Обновляем индексы продаж и счетчик продаж модели
+        if self.sales_index.get(car_vin) == sale_line_number:
+            self.sales_index.delete(car_vin)
+        self.sales_number_index.delete(sales_number)
+        self.sales_date_index.delete(sales_date_key(sale.sales_date, sales_number))
+        self.model_sales.increment(car.model, -1)
+
         return car
 
+    @locked(read=('sales',))
+    def get_sale(self, sales_number: str) -> Sale | None:
+        '''Возвращает действующую продажу по номеру или None'''
+        if sales_number not in self.sales_number_filter:
+            return None
+        sale_line_number = self.sales_number_index.get(sales_number)
+        if sale_line_number is None:
+            return None
+        return self.format.decode_sale(self.sales_store.read_bytes(sale_line_number), self.validate_reads)
+
+    def _sales_between(self, start: datetime | None, end: datetime | None) -> Iterator[Sale]:
+        '''Действующие продажи с start включительно до end не включая, по возрастанию дат.
+
+        По индексу дат читаются только строки нужного интервала; ключи точны
+        до секунды, поэтому на границах даты сверяются с самими продажами.
+        None вместо границы - без ограничения с этой стороны.
+        '''
+        low = '' if start is None else sales_date_key(start)
+        # Все ключи начинаются с цифры, поэтому "~" больше любого из них
+        high = '~' if end is None else sales_date_key(end + timedelta(seconds=1))
+        for key in self.sales_date_index.keys_between(low, high):
+            line_number = self.sales_date_index.get(key)
+            sale = self.format.decode_sale(self.sales_store.read_bytes(line_number), self.validate_reads)
+            if (start is None or sale.sales_date >= start) and (end is None or sale.sales_date < end):
+                yield sale
+
+    @locked(read=('sales',))
+    def sales_between(self, start: datetime, end: datetime) -> list[Sale]:
+        '''Возвращает действующие продажи с start включительно до end не включая'''
+        with gc_paused(self.pause_gc):
+            return list(self._sales_between(start, end))
+
+    @locked(read=('sales',))
+    def sales_revenue(self, start: datetime, end: datetime) -> Decimal:
+        '''Сумма продаж за период'''
+        return sum((sale.cost for sale in self._sales_between(start, end)), Decimal(0))
+
+    @locked(read=('sales',))
+    def sales_by_day(self, start: datetime, end: datetime) -> dict[date, tuple[int, Decimal]]:
+        '''Число продаж и выручка по дням периода; дни без продаж не попадают в ответ'''
+        days: dict[date, tuple[int, Decimal]] = {}
+        for sale in self._sales_between(start, end):
+            count, revenue = days.get(sale.sales_date.date(), (0, Decimal(0)))
+            days[sale.sales_date.date()] = (count + 1, revenue + sale.cost)
+        return days
+
+    def _model_sales_between(self, start: datetime | None, end: datetime | None) -> dict[int, int]:
+        '''Число продаж по id модели за период в порядке первой продажи модели'''
+        model_sales: dict[int, int] = {}
+        for sale in self._sales_between(start, end):
+            car_line_number = self.cars_index.get(sale.car_vin)
+            if car_line_number is not None:
+                model_id = self.format.car_model_id(self.cars_store.read(car_line_number))
+                model_sales[model_id] = model_sales.get(model_id, 0) + 1
+        return model_sales
+
+    @locked(read=('cars', 'sales'))
+    def sales_count_by_model(self, start: datetime, end: datetime) -> dict[int, int]:
+        '''Число продаж по id модели за период'''
+        return self._model_sales_between(start, end)
+
+    @locked(read=('models', 'cars', 'sales'))
+    def sales_count_by_brand(self, start: datetime, end: datetime) -> dict[str, int]:
+        '''Число продаж по бренду за период'''
+        brands: dict[str, int] = {}
+        for model_id, count in self._model_sales_between(start, end).items():
+            model = self._get_model(model_id)
+            if model is not None:
+                brands[model.brand] = brands.get(model.brand, 0) + count
+        return brands
+
+    @locked(write=('cars', 'sales'))
+    def compact(self) -> dict[str, int | float]:
+        '''Вычищает отмененные продажи из файла продаж.
+
+        Действующие продажи переписываются в новый файл одним
+        последовательным проходом с перенумерацией строк, по ходу строятся
+        базы индексов продаж, и новые файлы подменяют старые разом. Другие
+        потоки на это время ждут блокировок автомобилей и продаж (перед
+        подменой файлов может понадобиться довести до конца операцию из
+        журнала предзаписи, см. _recover), другие процессы
+        подхватывают новые файлы при следующем обращении. Возвращает число
+        удаленных строк, освобожденные в файле продаж байты и время работы в
+        секундах. Базы индексов при этом собираются из журналов целиком и
+        могут вырасти, поэтому в освобожденные байты они не входят.
+        '''
+        started = time.perf_counter()
+        # Файлы подменяются в обход журнала предзаписи, поэтому он очищается
+        # заранее: до просмотра, чтобы довести до конца операции упавших процессов
+        self._checkpoint()
+        indexes = (self.sales_index, self.sales_number_index, self.sales_date_index)
+        files = [self.sales_file]
+        for index in indexes:
+            files += index.files
+        size_before = os.path.getsize(self.sales_file)
+
+        # Старый номер строки -> новый для действующих продаж
+        new_lines: dict[int, int] = {}
+        tmp_path = self.sales_file + '.tmp'
+        with open(tmp_path, 'wb'):
+            pass
+        target = RecordStore(tmp_path, self.format.sale_size, self.format.sale_header)
+        target.metrics = self.sales_store.metrics
+        batch = []
+        # Отмененные продажи находятся просмотром (в пуле для больших файлов), а записи копируются подряд
+        for line_number, _, _, deleted in self._scan_rows(self.sales_store, _scan_sale_keys):
+            if deleted:
+                continue
+            new_lines[line_number] = len(new_lines)
+            batch.append(self.sales_store.read_bytes(line_number))
+            if len(batch) >= 10000:
+                target.append(batch)
+                batch = []
+        target.append(batch)
+        target.sync()
+        target.close()
+        rows_removed = len(self.sales_store) - len(new_lines)
+        if not rows_removed:
+            os.remove(tmp_path)
+            return {'rows_removed': 0, 'bytes_reclaimed': 0, 'elapsed_seconds': time.perf_counter() - started}
+
+        for index in indexes:
+            index.write_replacement(
+                (key, new_lines[line_number]) for key, line_number in index.items()
+                if line_number in new_lines
+            )
+        replace_files(self.root_directory_path, [os.path.basename(path) for path in files])
+
+        self.sales_store.refresh()
+        # Строки продаж перенумерованы
+        self._row_changes.reset()
+        for index in indexes:
+            index.load()
+        # Номера удаленных продаж больше не нужны и в фильтре
+        self._rebuild_filter('sales', self.sales_number_index)
+        size_after = os.path.getsize(self.sales_file)
+        return {
+            'rows_removed': rows_removed,
+            'bytes_reclaimed': size_before - size_after,
+            'elapsed_seconds': time.perf_counter() - started,
+        }
+
+    def inventory_snapshot(self) -> InventorySnapshot:
+        '''Строит колоночный снимок автомобилей и продаж для отчетов (нужен numpy)'''
+        snapshot = InventorySnapshot()
+        self.refresh_snapshot(snapshot)
+        return snapshot
+
+    @locked(read=('cars', 'sales'))
+    def refresh_snapshot(self, snapshot: InventorySnapshot) -> None:
+        '''Дочитывает в снимок новые и переписанные на месте строки'''
+        changes = self._row_changes
+        if snapshot.epoch != changes.epoch:
+            snapshot.reset(changes.epoch)
+        car_lines = set(changes.since('cars', snapshot.positions['cars']))
+        car_lines.update(range(snapshot.car_count, len(self.cars_store)))
+        sale_lines = set(changes.since('sales', snapshot.positions['sales']))
+        sale_lines.update(range(snapshot.sale_count, len(self.sales_store)))
+
+        with gc_paused(self.pause_gc):
+            if not snapshot.car_count:
+                # Снимок строится заново: полный просмотр файла
+                cars = dict(self._scan_rows(self.cars_store, _scan_car_columns))
+            else:
+                cars = {}
+                for line_number in sorted(car_lines):
+                    car = self._read_car(line_number)
+                    cars[line_number] = (car.model, car.price, car.date_start, car.status.value)
+            snapshot.update_cars(cars)
+
+            if not snapshot.sale_count:
+                sale_rows = self._scan_rows(self.sales_store, _scan_sales)
+            else:
+                sale_rows = []
+                for line_number in sorted(sale_lines):
+                    record = self.sales_store.read_bytes(line_number)
+                    sale_rows.append((line_number, self.format.decode_sale(record), self.format.sale_key(record)[2]))
+            sales = {}
+            car_models = snapshot.cars['model']
+            for line_number, sale, deleted in sale_rows:
+                car_line_number = self.cars_index.get(sale.car_vin)
+                # Модель берется из только что обновленного столбца автомобилей
+                model_id = int(car_models[car_line_number]) if car_line_number is not None else 0
+                sales[line_number] = (model_id, sale.cost, sale.sales_date, not deleted)
+            snapshot.update_sales(sales)
+        snapshot.positions = {name: changes.position(name) for name in ('cars', 'sales')}
+
     # Задание 7. Самые продаваемые модели
-    def top_models_by_sales(self) -> list[ModelSaleStats]:
-        '''Возвращает топ-3 самых продаваемых моделей'''
-        # Словарь для подсчета продаж по id модели
-        model_sales = {}
-        
-        # Читаем файл продаж и считаем количество продаж для каждой модели
-        with open(self.sales_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    parts = line.split(';')
-                    car_vin = parts[1]
-                    
-                    # Находим id модели по VIN
-                    car_line_number = None
-                    with open(self.cars_index_file, 'r', encoding='utf-8') as f_cars:
-                        for line in f_cars:
-                            data = line.strip()
-                            if data:
-                                parts = data.split(';')
-                                if parts[0] == car_vin:
-                                    car_line_number = parts[1]
-                                    break
-                    
-                    if car_line_number:
-                        # Читаем информацию об автомобиле
-                        with open(self.cars_file, 'r', encoding='utf-8') as f_cars:
-                            f_cars.seek(int(car_line_number) * 501)
-                            car_line = f_cars.read(501).rstrip()
-                            parts = car_line.split(';')
-                            model_id = int(parts[1].strip())
-                            
-                            # Увеличиваем счетчик продаж для модели
-                            model_sales[model_id] = model_sales.get(model_id, 0) + 1
-        
-        # Сортируем модели по количеству продаж
-        sorted_models = sorted(model_sales.items(), key=lambda x: x[1], reverse=True)
-        
-        # Берем топ-3 модели
+    @locked(read=('models', 'cars', 'sales'))
+    def top_models_by_sales(self, n: int = 3, start: datetime | None = None,
+                            end: datetime | None = None) -> list[ModelSaleStats]:
+        '''Возвращает топ-n самых продаваемых моделей.
+
+        Без периода ответ берется из материализованных счетчиков, а с периодом
+        (start включительно, end не включая; любую границу можно опустить)
+        продажи считаются по индексу дат. При равном числе продаж выше
+        модель, которую в периоде продали раньше.
+        '''
+        if start is None and end is None:
+            top = self.model_sales.top(n)
+        else:
+            model_sales = self._model_sales_between(start, end)
+            top = sorted(model_sales.items(), key=lambda item: -item[1])[:n]
         top_models = []
-        for model_id, sales_count in sorted_models[:3]:
-            # Находим номер строки модели в индексе
-            model_line_number = None
-            with open(self.models_index_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = line.strip()
-                    if data:
-                        parts = data.split(';')
-                        if parts[0] == str(model_id):
-                            model_line_number = parts[1]
-                            break
-            
-            if model_line_number:
-                # Читаем информацию о модели
-                with open(self.models_file, 'r', encoding='utf-8') as f:
-                    f.seek(int(model_line_number) * 501)
-                    model_line = f.read(501).rstrip()
-                    parts = model_line.split(';')
-                    model_name = parts[1].strip()
-                    model_brand = parts[2].strip()
-                    
-                    # Создаем объект ModelSaleStats
-                    top_models.append(ModelSaleStats(
-                        car_model_name=model_name,
-                        brand=model_brand,
-                        sales_number=sales_count
-                    ))
-        
+        for model_id, sales_count in top:
+            # Читаем информацию о модели
+            model = self._get_model(model_id)
+            if model is not None:
+                top_models.append(ModelSaleStats(
+                    car_model_name=model.name,
+                    brand=model.brand,
+                    sales_number=sales_count
+                ))
+
         return top_models
+
+    @locked(write=('cars', 'sales'))
+    def rebuild_model_sales(self) -> dict[int, tuple[int, int]]:
+        '''Пересчитывает счетчики продаж по моделям с нуля по файлу продаж.
+
+        Отмененные продажи не учитываются. Возвращает расхождения между
+        сохраненными и пересчитанными значениями: id модели -> (было, стало).
+        '''
+        # Файл счетчиков подменяется целиком, поэтому журнал предзаписи очищается заранее
+        self._checkpoint()
+        # Словарь для подсчета продаж по id модели
+        model_sales: dict[int, int] = {}
+        for _, _, car_vin, deleted in self._scan_rows(self.sales_store, _scan_sale_keys):
+            if deleted:  # Продажа отменена
+                continue
+            # Находим id модели по VIN
+            car_line_number = self.cars_index.get(car_vin)
+            if car_line_number is not None:
+                model_id = self.format.car_model_id(self.cars_store.read(car_line_number))
+                model_sales[model_id] = model_sales.get(model_id, 0) + 1
+
+        stored = self.model_sales.items()
+        mismatches = {
+            model_id: (stored.get(model_id, 0), model_sales.get(model_id, 0))
+            for model_id in stored.keys() | model_sales.keys()
+            if stored.get(model_id, 0) != model_sales.get(model_id, 0)
+        }
+        self.model_sales.rebuild(model_sales)
+        return mismatches
@@ -0,0 +1,174 @@
+import hashlib
+import mmap
+import os
+import struct
+from collections.abc import Iterable, Iterator
+
+from metrics import Metrics
+
+# Заголовок файла: сигнатура, число хеш-функций, число бит, число добавленных ключей
+_HEADER = struct.Struct('<8sIQQ')
+BLOOM_MAGIC = b'BIBIPBLM'
+
+# 10 бит на ключ и 7 хешей дают около 1% ложных срабатываний
+BITS_PER_KEY = 10
+HASHES = 7
+MIN_CAPACITY = 1024
+
+# Наибольший разрыв между измененными байтами внутри одного отрезка записи
+_RUN_GAP = 32
+
+
+class BloomFilter:
+    '''Фильтр Блума для проверки "ключа точно нет" без обращения к индексу.
+
+    Фильтр хранится в файле и отображен в память, поэтому его видят и
+    другие процессы. Биты только устанавливаются, и лишний бит дает лишь
+    ложное срабатывание, поэтому биты пишутся в отображение сразу, даже
+    внутри транзакции. В транзакции измененные байты дополнительно попадают
+    в запись журнала предзаписи, чтобы ключи подтвержденных операций не
+    потерялись при отключении питания.
+
+    Удалять ключи фильтр не умеет: удаленный или переименованный ключ
+    остается в нем ложным срабатыванием до следующего перестроения.
+    '''
+
+    # Счетчики ввода-вывода (см. metrics); None - не считать
+    metrics: Metrics | None = None
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._open()
+        # Смещения байтов, измененных в текущей транзакции
+        self._dirty: set[int] | None = None
+
+    def _open(self) -> None:
+        self._file = open(self.path, 'r+b')
+        if self.metrics is not None:
+            self.metrics.count('file_opens')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.hashes, self.bits, _ = _HEADER.unpack_from(self._map, 0)
+        if magic != BLOOM_MAGIC:
+            self.close()
+            raise ValueError(f'Файл {self.path} не является фильтром Блума')
+
+    @staticmethod
+    def create(path: str, keys: Iterable[str], capacity: int) -> None:
+        '''Пишет в path новый фильтр, рассчитанный на capacity ключей, и заполняет его keys'''
+        bits = max(capacity, MIN_CAPACITY) * BITS_PER_KEY
+        bits += -bits % 8
+        data = bytearray(_HEADER.size + bits // 8)
+        count = 0
+        for key in keys:
+            for position in _positions(key, bits, HASHES):
+                data[_HEADER.size + (position >> 3)] |= 1 << (position & 7)
+            count += 1
+        _HEADER.pack_into(data, 0, BLOOM_MAGIC, HASHES, bits, count)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @property
+    def count(self) -> int:
+        '''Число добавленных ключей, включая повторы и удаленные'''
+        return _HEADER.unpack_from(self._map, 0)[3]
+
+    @property
+    def capacity(self) -> int:
+        return self.bits // BITS_PER_KEY
+
+    def saturated(self) -> bool:
+        '''Ключей больше расчетного: доля ложных срабатываний растет, пора перестроить'''
+        return self.count > self.capacity
+
+    def __contains__(self, key: str) -> bool:
+        mapped = self._map
+        for position in _positions(key, self.bits, self.hashes):
+            if not mapped[_HEADER.size + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key: str) -> None:
+        self.add_many([key])
+
+    def add_many(self, keys: Iterable[str]) -> None:
+        mapped = self._map
+        dirty = self._dirty
+        added = 0
+        for key in keys:
+            for position in _positions(key, self.bits, self.hashes):
+                offset = _HEADER.size + (position >> 3)
+                mapped[offset] |= 1 << (position & 7)
+                if dirty is not None:
+                    dirty.add(offset)
+            added += 1
+        magic, hashes, bits, count = _HEADER.unpack_from(mapped, 0)
+        _HEADER.pack_into(mapped, 0, magic, hashes, bits, count + added)
+        if dirty is not None:
+            dirty.add(-1)
+
+    def rebuild(self, keys: Iterable[str], capacity: int) -> None:
+        '''Перестраивает фильтр по полному набору ключей'''
+        self.create(self.path, keys, capacity)
+        self.close()
+        self._open()
+
+    def refresh(self) -> None:
+        '''Открывает фильтр заново, если другой процесс его перестроил'''
+        if os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino:
+            self.close()
+            self._open()
+
+    # Участие в транзакции журнала предзаписи, как у RecordStore
+    def begin(self) -> None:
+        self._dirty = set()
+
+    def pending_writes(self) -> list[tuple[int, bytes]]:
+        '''Измененные байты фильтра (и заголовок со счетчиком) со смещениями в файле'''
+        if not self._dirty:
+            return []
+        writes = []
+        if -1 in self._dirty:
+            writes.append((0, self._map[:_HEADER.size]))
+        # Близкие байты объединяются в один отрезок: при большой пачке ключей
+        # это почти сплошные куски вместо тысяч однобайтовых записей
+        start = end = None
+        for offset in sorted(offset for offset in self._dirty if offset >= 0):
+            if start is not None and offset - end <= _RUN_GAP:
+                end = offset
+                continue
+            if start is not None:
+                writes.append((start, self._map[start:end + 1]))
+            start = end = offset
+        if start is not None:
+            writes.append((start, self._map[start:end + 1]))
+        return writes
+
+    def apply(self) -> None:
+        # Биты уже в отображении
+        self._dirty = None
+
+    def discard(self) -> None:
+        self._dirty = None
+
+    def sync(self) -> None:
+        self._map.flush()
+        os.fsync(self._file.fileno())
+        if self.metrics is not None:
+            self.metrics.count('fsyncs')
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+
+def _positions(key: str, bits: int, hashes: int) -> Iterator[int]:
+    '''Позиции бит ключа: двойное хеширование по двум половинам одного blake2b'''
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    for i in range(hashes):
+        yield (h1 + i * h2) % bits
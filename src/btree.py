@@ -0,0 +1,571 @@
+'''Индекс "ключ -> номер строки" на диске в виде B+-дерева из страниц.
+
+Файл делится на страницы фиксированного размера. Нулевая страница -
+заголовок (корень, число страниц и ключей, список свободных страниц,
+счетчик изменений), остальные - узлы дерева. Ключи и номера строк лежат
+в листьях, листья связаны в цепочку по возрастанию ключей, а внутренние
+узлы хранят разделители и номера дочерних страниц. Поиск, вставка и
+удаление читают и пишут O(log N) страниц, переполненный узел делится
+пополам на месте, опустевший сливается с соседом или занимает у него
+ключи, а освобожденные страницы переиспользуются.
+'''
+import bisect
+import os
+import struct
+from collections.abc import Iterable, Iterator
+
+from cache import MISSING, LRUCache
+from metrics import Metrics
+
+PAGE_SIZE = 4096
+# Сколько разобранных страниц держит кэш (по умолчанию 4 МБ страниц)
+CACHE_PAGES = 1024
+BTREE_MAGIC = b'BIBIPBT1'
+
+# Заголовок файла: сигнатура, размер страницы, корень, число страниц,
+# первая свободная страница, число ключей, счетчик изменений
+_HEADER = struct.Struct('<8sIIIIQQ')
+# Заголовок узла: вид, число ключей, следующий лист (у листа),
+# первый потомок (у внутреннего узла) или следующая свободная страница
+_NODE = struct.Struct('<BHI')
+_KEY_SIZE = struct.Struct('<H')
+_LINE = struct.Struct('<Q')
+_CHILD = struct.Struct('<I')
+
+FREE, LEAF, INNER = 0, 1, 2
+_OVERHEAD = {LEAF: _KEY_SIZE.size + _LINE.size, INNER: _KEY_SIZE.size + _CHILD.size}
+
+# Заполнение страниц при построении дерева целиком: запас под вставки
+BUILD_FILL = 0.75
+
+
+class _Node:
+    '''Разобранная страница. У внутреннего узла values - номера дочерних
+    страниц (на одну больше, чем ключей), у листа - номера строк.'''
+
+    __slots__ = ('kind', 'keys', 'values', 'next', 'size')
+
+    def __init__(self, kind: int, keys: list[str] | None = None, values: list[int] | None = None,
+                 next_page: int = 0) -> None:
+        self.kind = kind
+        self.keys = keys if keys is not None else []
+        self.values = values if values is not None else []
+        self.next = next_page
+        self.size = _measure(kind, self.keys)
+
+    @property
+    def leaf(self) -> bool:
+        return self.kind == LEAF
+
+    def encode(self, page_size: int) -> bytes:
+        if self.kind == INNER:
+            parts = [_NODE.pack(INNER, len(self.keys), self.values[0])]
+            values, value_format = self.values[1:], _CHILD
+        else:
+            parts = [_NODE.pack(self.kind, len(self.keys), self.next)]
+            values, value_format = self.values, _LINE
+        for key, value in zip(self.keys, values):
+            raw = key.encode('utf-8')
+            parts += (_KEY_SIZE.pack(len(raw)), raw, value_format.pack(value))
+        return b''.join(parts).ljust(page_size, b'\0')
+
+    @classmethod
+    def decode(cls, data: bytes) -> '_Node':
+        kind, count, link = _NODE.unpack_from(data, 0)
+        value_format = _CHILD if kind == INNER else _LINE
+        keys, values = [], [link] if kind == INNER else []
+        pos = _NODE.size
+        for _ in range(count):
+            (key_size,) = _KEY_SIZE.unpack_from(data, pos)
+            pos += _KEY_SIZE.size
+            keys.append(data[pos:pos + key_size].decode('utf-8'))
+            pos += key_size
+            values.append(value_format.unpack_from(data, pos)[0])
+            pos += value_format.size
+        return cls(kind, keys, values, 0 if kind == INNER else link)
+
+
+def _entry_size(kind: int, key: str) -> int:
+    return _OVERHEAD[kind] + len(key.encode('utf-8'))
+
+
+def _measure(kind: int, keys: list[str]) -> int:
+    '''Размер узла на странице в байтах'''
+    if kind == FREE:
+        return _NODE.size
+    return _NODE.size + sum(_entry_size(kind, key) for key in keys)
+
+
+def _split_point(kind: int, keys: list[str], low: int, high: int) -> int:
+    '''Позиция в [low, high], делящая ключи примерно пополам по байтам'''
+    sizes = [_entry_size(kind, key) for key in keys]
+    half = sum(sizes) // 2
+    total = 0
+    for pos, size in enumerate(sizes):
+        total += size
+        if total >= half:
+            return min(max(pos, low), high)
+    return high
+
+
+class BTreeIndex:
+    '''B+-дерево "ключ -> номер строки" с кэшем страниц.
+
+    Интерфейс тот же, что у indexes.SortedIndex, поэтому сервис может
+    держать индексы в любом из двух видов. Разобранные страницы хранятся
+    в LRU-кэше; измененные страницы до записи в файл лежат отдельно и
+    кэшем не вытесняются.
+
+    Файл дерева сам участвует в транзакции журнала предзаписи (у
+    SortedIndex это делает его журнал, поэтому journal здесь - сам индекс):
+    внутри транзакции измененные страницы и заголовок копятся в памяти, а
+    в файл пишутся после фиксации журнала. Вне транзакции страницы пишутся
+    сразу после каждого изменения, заголовок - последним; сбой посреди
+    такой записи может оставить дерево несогласованным, поэтому индексы,
+    которые меняются вне журнала, надежнее держать в SortedIndex.
+
+    Изменения из другого процесса подхватывает refresh: по счетчику
+    изменений в заголовке он сбрасывает кэш страниц, а подмененный файл
+    открывает заново.
+    '''
+
+    # Счетчики ввода-вывода (см. metrics); None - не считать
+    metrics: Metrics | None = None
+
+    def __init__(self, path: str, page_size: int = PAGE_SIZE, cache_pages: int = CACHE_PAGES) -> None:
+        self.path = path
+        self.page_size = page_size
+        if not os.path.exists(path):
+            # Свое имя временного файла: пустое дерево может создавать и другой процесс
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            self.create(tmp_path, (), page_size)
+            os.replace(tmp_path, path)
+        self._cache = LRUCache(cache_pages)
+        # Измененные, но еще не записанные страницы
+        self._dirty: dict[int, _Node] = {}
+        # Записи транзакции, если она идет: None - запись сразу в файл
+        self._writes: list[tuple[int, bytes]] | None = None
+        self._in_transaction = False
+        self._fd = -1
+        self.load()
+
+    @property
+    def max_key_bytes(self) -> int:
+        '''Наибольшая длина ключа: в любой узел должно помещаться не меньше четырех ключей'''
+        return (self.page_size - _NODE.size) // 4 - max(_OVERHEAD.values())
+
+    @property
+    def journal(self) -> 'BTreeIndex':
+        return self
+
+    @property
+    def files(self) -> list[str]:
+        '''Файлы индекса на диске'''
+        return [self.path]
+
+    def load(self) -> None:
+        '''Открывает файл дерева заново и читает заголовок'''
+        if self._fd >= 0:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_RDWR)
+        if self.metrics is not None:
+            self.metrics.count('file_opens')
+        self._cache.clear()
+        self._dirty = {}
+        self._read_header()
+
+    def _read_header(self) -> None:
+        data = os.pread(self._fd, _HEADER.size, 0)
+        if self.metrics is not None:
+            self.metrics.count('bytes_read', len(data))
+        if len(data) < _HEADER.size or data[:len(BTREE_MAGIC)] != BTREE_MAGIC:
+            raise ValueError(f'Файл {self.path} не является индексом B+-дерева')
+        (_, page_size, self._root, self._page_count, self._free_head,
+         self._count, self._generation) = _HEADER.unpack(data)
+        if page_size != self.page_size:
+            raise ValueError(f'Размер страницы {self.path} - {page_size}, а не {self.page_size}')
+
+    def _header(self) -> bytes:
+        return _HEADER.pack(BTREE_MAGIC, self.page_size, self._root, self._page_count, self._free_head,
+                            self._count, self._generation).ljust(self.page_size, b'\0')
+
+    def refresh(self) -> None:
+        '''Подхватывает изменения, которые записал другой процесс'''
+        if os.stat(self.path).st_ino != os.fstat(self._fd).st_ino:
+            self.load()
+            return
+        generation = self._generation
+        self._read_header()
+        if self._generation != generation:
+            self._cache.clear()
+
+    # Страницы
+
+    def _node(self, page: int) -> _Node:
+        node = self._dirty.get(page)
+        if node is not None:
+            return node
+        node = self._cache.get(page)
+        if node is MISSING:
+            data = os.pread(self._fd, self.page_size, page * self.page_size)
+            if self.metrics is not None:
+                self.metrics.count('bytes_read', len(data))
+            node = _Node.decode(data)
+            self._cache.put(page, node)
+        return node
+
+    def _mark(self, page: int, node: _Node) -> None:
+        self._dirty[page] = node
+
+    def _allocate(self, node: _Node) -> int:
+        '''Страница для нового узла: из списка свободных или в конце файла'''
+        if self._free_head:
+            page = self._free_head
+            self._free_head = self._node(page).next
+        else:
+            page = self._page_count
+            self._page_count += 1
+        self._mark(page, node)
+        return page
+
+    def _free(self, page: int) -> None:
+        self._mark(page, _Node(FREE, next_page=self._free_head))
+        self._free_head = page
+
+    def _flush(self) -> None:
+        '''Закрывает изменение: вне транзакции пишет страницы в файл'''
+        if not self._in_transaction:
+            self._write(self._collect())
+
+    def _collect(self) -> list[tuple[int, bytes]]:
+        '''Измененные страницы и новый заголовок (последним) со смещениями в файле'''
+        if not self._dirty:
+            return []
+        self._generation += 1
+        writes = [(page * self.page_size, node.encode(self.page_size)) for page, node in sorted(self._dirty.items())]
+        writes.append((0, self._header()))
+        return writes
+
+    def _write(self, writes: list[tuple[int, bytes]]) -> None:
+        for offset, data in writes:
+            os.pwrite(self._fd, data, offset)
+        if self.metrics is not None:
+            self.metrics.count('bytes_written', sum(len(data) for _, data in writes))
+        for page, node in self._dirty.items():
+            self._cache.put(page, node)
+        self._dirty = {}
+
+    # Участие в транзакции журнала предзаписи, как у RecordStore
+    @property
+    def in_transaction(self) -> bool:
+        return self._in_transaction
+
+    def begin(self) -> None:
+        self._in_transaction = True
+        self._writes = None
+
+    def pending_writes(self) -> list[tuple[int, bytes]]:
+        if self._writes is None:
+            self._writes = self._collect()
+        return self._writes
+
+    def apply(self) -> None:
+        self._write(self.pending_writes())
+        self._in_transaction = False
+        self._writes = None
+
+    def discard(self) -> None:
+        '''Отбрасывает изменения транзакции: узлы меняются на месте, поэтому они уходят и из кэша'''
+        self._cache.invalidate(*self._dirty)
+        self._dirty = {}
+        self._writes = None
+        self._in_transaction = False
+        self._read_header()
+
+    def sync(self) -> None:
+        os.fsync(self._fd)
+        if self.metrics is not None:
+            self.metrics.count('fsyncs')
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    # Чтение
+
+    def _leaf_for(self, key: str | None) -> _Node:
+        '''Лист, в котором лежит (или лег бы) key; None - самый левый лист'''
+        node = self._node(self._root)
+        while not node.leaf:
+            node = self._node(node.values[0 if key is None else bisect.bisect_right(node.keys, key)])
+        return node
+
+    def get(self, key: str) -> int | None:
+        '''Возвращает номер строки по ключу или None'''
+        node = self._leaf_for(key)
+        pos = bisect.bisect_left(node.keys, key)
+        if pos < len(node.keys) and node.keys[pos] == key:
+            return node.values[pos]
+        return None
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key, _ in self._scan(None, False, None))
+
+    def items(self) -> Iterator[tuple[str, int]]:
+        '''Пары (ключ, номер строки) в порядке сортировки ключей'''
+        return self._scan(None, False, None)
+
+    def keys_after(self, key: str | None = None) -> Iterator[str]:
+        '''Ключи по возрастанию, строго большие key (все ключи, если key не задан)'''
+        return (found for found, _ in self._scan(key, False, None))
+
+    def keys_between(self, low: str, high: str) -> Iterator[str]:
+        '''Ключи по возрастанию от low включительно до high не включая'''
+        return (found for found, _ in self._scan(low, True, high))
+
+    def _scan(self, start: str | None, inclusive: bool, stop: str | None) -> Iterator[tuple[str, int]]:
+        '''Обход цепочки листов от start до stop (не включая)'''
+        node = self._leaf_for(start)
+        if start is None:
+            pos = 0
+        elif inclusive:
+            pos = bisect.bisect_left(node.keys, start)
+        else:
+            pos = bisect.bisect_right(node.keys, start)
+        scanned = 0
+        try:
+            while True:
+                keys, values = node.keys, node.values
+                for i in range(pos, len(keys)):
+                    if stop is not None and keys[i] >= stop:
+                        return
+                    scanned += 1
+                    yield keys[i], values[i]
+                if not node.next:
+                    return
+                node = self._node(node.next)
+                pos = 0
+        finally:
+            if self.metrics is not None:
+                self.metrics.count('index_entries_scanned', scanned)
+
+    # Изменение
+
+    def insert(self, key: str, line_number: int) -> None:
+        '''Добавляет ключ или обновляет номер строки существующего ключа'''
+        self._put(key, line_number)
+        self._flush()
+
+    def insert_many(self, items: list[tuple[str, int]]) -> None:
+        '''Добавляет пачку ключей; соседние ключи попадают в уже прочитанные страницы'''
+        for key, line_number in sorted(items):
+            self._put(key, line_number)
+        self._flush()
+
+    def delete(self, key: str) -> None:
+        '''Удаляет ключ из индекса, если он есть'''
+        if self._remove(key):
+            self._flush()
+
+    def rename(self, key: str, new_key: str) -> None:
+        '''Переносит номер строки со старого ключа на новый'''
+        line_number = self.get(key)
+        if line_number is None:
+            raise KeyError(key)
+        self._remove(key)
+        self._put(new_key, line_number)
+        self._flush()
+
+    def _path_to(self, key: str) -> tuple[list[tuple[int, _Node, int]], int, _Node]:
+        '''Путь от корня до листа key: (страница, узел, номер потомка) и сам лист'''
+        path = []
+        page = self._root
+        node = self._node(page)
+        while not node.leaf:
+            pos = bisect.bisect_right(node.keys, key)
+            path.append((page, node, pos))
+            page = node.values[pos]
+            node = self._node(page)
+        return path, page, node
+
+    def _put(self, key: str, line_number: int) -> None:
+        if len(key.encode('utf-8')) > self.max_key_bytes:
+            raise ValueError(f'Ключ индекса {self.path} длиннее {self.max_key_bytes} байт')
+        path, page, node = self._path_to(key)
+        pos = bisect.bisect_left(node.keys, key)
+        if pos < len(node.keys) and node.keys[pos] == key:
+            node.values[pos] = line_number
+            self._mark(page, node)
+            return
+        node.keys.insert(pos, key)
+        node.values.insert(pos, line_number)
+        node.size += _entry_size(LEAF, key)
+        self._mark(page, node)
+        self._count += 1
+        self._split_overflowing(path, page, node)
+
+    def _split_overflowing(self, path: list[tuple[int, _Node, int]], page: int, node: _Node) -> None:
+        '''Делит переполненный узел пополам и вставляет разделитель в родителя, пока нужно'''
+        while node.size > self.page_size:
+            if node.leaf:
+                mid = _split_point(LEAF, node.keys, 1, len(node.keys) - 1)
+                right = _Node(LEAF, node.keys[mid:], node.values[mid:], node.next)
+                separator = right.keys[0]
+                del node.keys[mid:], node.values[mid:]
+                right_page = self._allocate(right)
+                node.next = right_page
+            else:
+                mid = _split_point(INNER, node.keys, 1, len(node.keys) - 2)
+                separator = node.keys[mid]
+                right = _Node(INNER, node.keys[mid + 1:], node.values[mid + 1:])
+                del node.keys[mid:], node.values[mid + 1:]
+                right_page = self._allocate(right)
+            node.size = _measure(node.kind, node.keys)
+            self._mark(page, node)
+            if not path:
+                # Делится корень: дерево вырастает на уровень
+                self._root = self._allocate(_Node(INNER, [separator], [page, right_page]))
+                return
+            page, node, pos = path.pop()
+            node.keys.insert(pos, separator)
+            node.values.insert(pos + 1, right_page)
+            node.size += _entry_size(INNER, separator)
+            self._mark(page, node)
+
+    def _remove(self, key: str) -> bool:
+        path, page, node = self._path_to(key)
+        pos = bisect.bisect_left(node.keys, key)
+        if pos == len(node.keys) or node.keys[pos] != key:
+            return False
+        del node.keys[pos], node.values[pos]
+        node.size -= _entry_size(LEAF, key)
+        self._mark(page, node)
+        self._count -= 1
+        self._rebalance(path, page, node)
+        return True
+
+    def _rebalance(self, path: list[tuple[int, _Node, int]], page: int, node: _Node) -> None:
+        '''Сливает заполненный меньше чем на четверть узел с соседом или занимает у соседа ключи'''
+        while path and node.size < self.page_size // 4:
+            parent_page, parent, pos = path.pop()
+            # Сосед слева, а у крайнего левого потомка - справа
+            at = pos - 1 if pos > 0 else 0
+            left_page, right_page = parent.values[at], parent.values[at + 1]
+            left, right = self._node(left_page), self._node(right_page)
+            separator = parent.keys[at]
+            if node.leaf:
+                keys, values = left.keys + right.keys, left.values + right.values
+            else:
+                keys, values = left.keys + [separator] + right.keys, left.values + right.values
+            merged = _Node(node.kind, keys, values, right.next)
+            if merged.size <= self.page_size:
+                self._mark(left_page, merged)
+                self._free(right_page)
+                del parent.keys[at], parent.values[at + 1]
+                parent.size -= _entry_size(INNER, separator)
+                self._mark(parent_page, parent)
+                node = parent
+                continue
+            # Вместе не помещаются: ключи делятся между соседями поровну
+            if node.leaf:
+                mid = _split_point(LEAF, keys, 1, len(keys) - 1)
+                new_separator = keys[mid]
+                self._mark(left_page, _Node(LEAF, keys[:mid], values[:mid], right_page))
+                self._mark(right_page, _Node(LEAF, keys[mid:], values[mid:], right.next))
+            else:
+                mid = _split_point(INNER, keys, 1, len(keys) - 2)
+                new_separator = keys[mid]
+                self._mark(left_page, _Node(INNER, keys[:mid], values[:mid + 1]))
+                self._mark(right_page, _Node(INNER, keys[mid + 1:], values[mid + 1:]))
+            parent.keys[at] = new_separator
+            parent.size += _entry_size(INNER, new_separator) - _entry_size(INNER, separator)
+            self._mark(parent_page, parent)
+            # Новый разделитель может оказаться длиннее старого
+            self._split_overflowing(path, parent_page, parent)
+            return
+        root = self._node(self._root)
+        if not path and not root.leaf and not root.keys:
+            # У корня остался один потомок: дерево становится ниже
+            old_root, self._root = self._root, root.values[0]
+            self._free(old_root)
+
+    # Уплотнение и построение целиком
+
+    def compaction_due(self) -> bool:
+        '''Свободные страницы переиспользуются, поэтому уплотнять дерево по ходу работы не нужно'''
+        return False
+
+    def compact(self) -> None:
+        '''Перестраивает дерево в плотно заполненный файл без свободных страниц'''
+        tmp_path = self.path + '.tmp'
+        self.create(tmp_path, self.items(), self.page_size)
+        os.replace(tmp_path, self.path)
+        self.load()
+
+    def write_replacement(self, items: Iterable[tuple[str, int]]) -> None:
+        '''Строит рядом с файлом индекса замену "<файл>.tmp" из упорядоченных пар'''
+        self.create(self.path + '.tmp', items, self.page_size)
+
+    @classmethod
+    def create(cls, path: str, items: Iterable[tuple[str, int]], page_size: int = PAGE_SIZE) -> None:
+        '''Пишет в path дерево из пар, уже упорядоченных по ключу.
+
+        Листья заполняются на BUILD_FILL и идут в файле подряд, за ними
+        уровни внутренних узлов снизу вверх.
+        '''
+        fill = int(page_size * BUILD_FILL)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * page_size)
+            pages = 1
+            count = 0
+
+            # Первый ключ и страница каждого узла текущего уровня
+            level: list[tuple[str, int]] = []
+            leaf = _Node(LEAF)
+            for key, line_number in items:
+                size = _entry_size(LEAF, key)
+                if leaf.keys and leaf.size + size > fill:
+                    leaf.next = pages + 1
+                    level.append((leaf.keys[0], pages))
+                    f.write(leaf.encode(page_size))
+                    pages += 1
+                    leaf = _Node(LEAF)
+                leaf.keys.append(key)
+                leaf.values.append(line_number)
+                leaf.size += size
+                count += 1
+            level.append((leaf.keys[0] if leaf.keys else '', pages))
+            f.write(leaf.encode(page_size))
+            pages += 1
+
+            while len(level) > 1:
+                groups: list[list[tuple[str, int]]] = [[]]
+                size = _NODE.size
+                for first_key, page in level:
+                    entry = _entry_size(INNER, first_key)
+                    if len(groups[-1]) > 1 and size + entry > fill:
+                        groups.append([])
+                        size = _NODE.size
+                    groups[-1].append((first_key, page))
+                    size += entry
+                if len(groups) > 1 and len(groups[-1]) == 1:
+                    # Узел с одним потомком не нужен: он уходит к соседу слева
+                    groups[-2] += groups.pop()
+                level = []
+                for group in groups:
+                    node = _Node(INNER, [key for key, _ in group[1:]], [page for _, page in group])
+                    level.append((group[0][0], pages))
+                    f.write(node.encode(page_size))
+                    pages += 1
+
+            f.seek(0)
+            f.write(_HEADER.pack(BTREE_MAGIC, page_size, level[0][1], pages, 0, count, 0))
+            f.flush()
+            os.fsync(f.fileno())
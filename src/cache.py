@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+
+# Признак промаха: None - допустимое закэшированное значение
+MISSING = object()
+
+
+class LRUCache:
+    '''Ограниченный кэш с вытеснением давно не использованных значений.
+
+    Значение живет не дольше ttl секунд (None - без ограничения по времени).
+    Кэш читают параллельные читатели сервиса, поэтому все обращения идут
+    под собственной блокировкой кэша. Счетчики попаданий и промахов
+    показывают, окупается ли кэш на реальной нагрузке.
+    '''
+
+    def __init__(self, max_size: int, ttl: float | None = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        # Ключ -> (значение, момент устаревания или None)
+        self._items: OrderedDict[Hashable, tuple[object, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> object:
+        '''Возвращает значение по ключу или MISSING'''
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+            self.misses += 1
+            return MISSING
+
+    def put(self, key: Hashable, value: object) -> None:
+        if self.max_size <= 0:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable) -> None:
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items)}
@@ -0,0 +1,83 @@
+import heapq
+import os
+
+from storage import RecordStore, decode_fields, encode_record
+
+
+class ModelSalesCounter:
+    '''Материализованный счетчик продаж по моделям.
+
+    Счетчики хранятся в файле строками фиксированной длины "id модели;число
+    продаж" в порядке первой продажи модели и обновляются на месте. Порядок
+    строк важен: при равном числе продаж выше оказывается модель, которую
+    продали раньше, как и при подсчете по файлу продаж.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, 'a', encoding='utf-8'):
+                pass
+        self.store = RecordStore(path)
+        # id модели -> (номер строки, число продаж), порядок ключей - порядок строк
+        self._counts: dict[int, tuple[int, int]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        self._counts = {}
+        for line_number, record in self.store.scan():
+            model_id, count = decode_fields(record)
+            self._counts[int(model_id)] = (line_number, int(count))
+
+    def refresh(self) -> None:
+        '''Перечитывает счетчики, измененные другим процессом; строк по числу моделей, это дешево'''
+        self.store.refresh()
+        self._load()
+
+    def increment(self, model_id: int, delta: int = 1) -> None:
+        '''Изменяет счетчик модели на delta'''
+        line_number, count = self._counts.get(model_id, (None, 0))
+        count += delta
+        if line_number is None:
+            line_number = self.store.append([encode_record(f'{model_id};{count}')])
+        else:
+            self.store.write(line_number, encode_record(f'{model_id};{count}'))
+        self._counts[model_id] = (line_number, count)
+
+    def get(self, model_id: int) -> int:
+        return self._counts.get(model_id, (None, 0))[1]
+
+    def items(self) -> dict[int, int]:
+        '''Текущие счетчики в порядке первой продажи'''
+        return {model_id: count for model_id, (_, count) in self._counts.items()}
+
+    def top(self, n: int) -> list[tuple[int, int]]:
+        '''n моделей с наибольшим числом продаж за O(M log n)'''
+        return heapq.nlargest(
+            n,
+            ((model_id, count) for model_id, (_, count) in self._counts.items() if count > 0),
+            key=lambda item: item[1]
+        )
+
+    def rebuild(self, counts: dict[int, int]) -> None:
+        '''Перезаписывает файл счетчиков заново'''
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8'):
+            pass
+        tmp_store = RecordStore(tmp_path)
+        # Счетчики ввода-вывода (см. metrics) переходят и на новые файлы
+        tmp_store.metrics = self.store.metrics
+        tmp_store.append([encode_record(f'{model_id};{count}') for model_id, count in counts.items()])
+        tmp_store.close()
+        self.store.close()
+        os.replace(tmp_path, self.path)
+        metrics = self.store.metrics
+        self.store = RecordStore(self.path)
+        self.store.metrics = metrics
+        self._counts = {
+            model_id: (line_number, count)
+            for line_number, (model_id, count) in enumerate(counts.items())
+        }
+
+    def close(self) -> None:
+        self.store.close()
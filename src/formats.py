@@ -0,0 +1,228 @@
+import struct
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from codec import (
+    construct_trusted,
+    decode_car,
+    decode_cars,
+    decode_model,
+    decode_sale,
+    encode_car,
+    encode_model,
+    encode_sale,
+)
+from indexes import LINE_SIZE
+from models import Car, CarStatus, Model, Sale
+from storage import decode_fields, encode_record
+
+# Отметка отмененной продажи в текстовом формате
+DELETED_MARK = 'is_deleted'
+
+
+class TextFormat:
+    '''Исходный текстовый формат: поля через ";" в строках по 501 байту'''
+
+    name = 'text'
+    extension = '.txt'
+    car_size = model_size = sale_size = LINE_SIZE
+    car_header = model_header = sale_header = b''
+    index_line_size = LINE_SIZE
+
+    def encode_car(self, car: Car) -> bytes:
+        return encode_record(encode_car(car))
+
+    def decode_car(self, record: bytes | memoryview, validate: bool = False) -> Car:
+        return decode_car(decode_fields(record), validate)
+
+    def decode_cars(self, records: Iterable[bytes], validate: bool = False) -> list[Car]:
+        '''Разбирает пачку записей автомобилей (см. codec.decode_cars)'''
+        if validate:
+            return [self.decode_car(record, True) for record in records]
+        return decode_cars(record.rstrip().decode('utf-8').split(';', 4) for record in records)
+
+    def car_status(self, record: bytes | memoryview) -> str:
+        return decode_fields(record)[4]
+
+    def car_model_id(self, record: bytes | memoryview) -> int:
+        return int(decode_fields(record, 2)[1])
+
+    def encode_model(self, model: Model) -> bytes:
+        return encode_record(encode_model(model))
+
+    def decode_model(self, record: bytes | memoryview, validate: bool = False) -> Model:
+        return decode_model(decode_fields(record), validate)
+
+    def encode_sale(self, sale: Sale, deleted: bool = False) -> bytes:
+        data = encode_sale(sale)
+        if deleted:
+            data += f';{DELETED_MARK}'
+        return encode_record(data)
+
+    def decode_sale(self, record: bytes | memoryview, validate: bool = False) -> Sale:
+        return decode_sale(decode_fields(record), validate)
+
+    def sale_key(self, record: bytes | memoryview) -> tuple[str, str, bool]:
+        '''Номер продажи, VIN и признак отмены без разбора остальных полей'''
+        parts = decode_fields(record)
+        return parts[0], parts[1], len(parts) > 4
+
+
+# Заголовок бинарных файлов: сигнатура, версия формата и размер записи
+BINARY_MAGIC = b'BIBIPBIN'
+BINARY_VERSION = 1
+_HEADER = struct.Struct('<8sHH4x')
+
+# VIN, id модели, мантисса и порядок цены, дата в микросекундах от эпохи, статус
+_CAR = struct.Struct('<32sqqbqB')
+# id, название, бренд
+_MODEL = struct.Struct('<q64s64s')
+# номер продажи, VIN, дата в микросекундах, мантисса и порядок суммы, флаги
+_SALE = struct.Struct('<64s32sqqbB')
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_SALE_DELETED = 1
+
+# Коды статусов фиксированы, чтобы не зависеть от порядка членов CarStatus
+STATUS_CODES = {
+    CarStatus.available: 0,
+    CarStatus.reserve: 1,
+    CarStatus.sold: 2,
+    CarStatus.delivery: 3,
+}
+_STATUS_BY_CODE = {code: status for status, code in STATUS_CODES.items()}
+
+
+def _pack_str(value: str, size: int) -> bytes:
+    data = value.encode('utf-8')
+    if len(data) > size:
+        raise ValueError(f'Значение "{value}" длиннее {size} байт')
+    return data
+
+
+def _unpack_str(data: bytes) -> str:
+    return data.rstrip(b'\0').decode('utf-8')
+
+
+def _pack_decimal(value: Decimal) -> tuple[int, int]:
+    '''Мантисса и порядок: так сохраняется и значение, и число знаков после запятой'''
+    sign, digits, exponent = value.as_tuple()
+    if not isinstance(exponent, int):
+        raise ValueError(f'Значение {value} нельзя сохранить в бинарном формате')
+    mantissa = int(''.join(map(str, digits)))
+    return -mantissa if sign else mantissa, exponent
+
+
+def _unpack_decimal(mantissa: int, exponent: int) -> Decimal:
+    return Decimal(mantissa).scaleb(exponent)
+
+
+def _pack_datetime(value: datetime) -> int:
+    if value.tzinfo is not None:
+        raise ValueError('Бинарный формат хранит только даты без часового пояса')
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _unpack_datetime(micros: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+class BinaryFormat:
+    '''Компактный бинарный формат: записи struct фиксированного размера.
+
+    Каждый файл начинается с заголовка с сигнатурой, версией формата и
+    размером записи. Цены хранятся мантиссой и порядком, даты - целым числом
+    микросекунд от эпохи, статус - одним байтом.
+    '''
+
+    name = 'binary'
+    extension = '.bin'
+    car_size = _CAR.size
+    model_size = _MODEL.size
+    sale_size = _SALE.size
+    car_header = _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, _CAR.size)
+    model_header = _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, _MODEL.size)
+    sale_header = _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, _SALE.size)
+    # Базы индексов пишутся строками без выравнивания
+    index_line_size = 0
+
+    def encode_car(self, car: Car) -> bytes:
+        mantissa, exponent = _pack_decimal(car.price)
+        return _CAR.pack(
+            _pack_str(car.vin, 32), car.model, mantissa, exponent,
+            _pack_datetime(car.date_start), STATUS_CODES[car.status]
+        )
+
+    def decode_car(self, record: bytes | memoryview, validate: bool = False) -> Car:
+        vin, model, mantissa, exponent, date_start, status = _CAR.unpack(record)
+        values = {
+            'vin': _unpack_str(vin),
+            'model': model,
+            'price': _unpack_decimal(mantissa, exponent),
+            'date_start': _unpack_datetime(date_start),
+            'status': _STATUS_BY_CODE[status],
+        }
+        if validate:
+            return Car.model_validate(values)
+        return construct_trusted(Car, values)
+
+    def decode_cars(self, records: Iterable[bytes], validate: bool = False) -> list[Car]:
+        '''Разбирает пачку записей автомобилей'''
+        return [self.decode_car(record, validate) for record in records]
+
+    def car_status(self, record: bytes | memoryview) -> str:
+        return _STATUS_BY_CODE[record[_CAR.size - 1]].value
+
+    def car_model_id(self, record: bytes | memoryview) -> int:
+        return _CAR.unpack(record)[1]
+
+    def encode_model(self, model: Model) -> bytes:
+        return _MODEL.pack(model.id, _pack_str(model.name, 64), _pack_str(model.brand, 64))
+
+    def decode_model(self, record: bytes | memoryview, validate: bool = False) -> Model:
+        model_id, name, brand = _MODEL.unpack(record)
+        values = {'id': model_id, 'name': _unpack_str(name), 'brand': _unpack_str(brand)}
+        if validate:
+            return Model.model_validate(values)
+        return construct_trusted(Model, values)
+
+    def encode_sale(self, sale: Sale, deleted: bool = False) -> bytes:
+        mantissa, exponent = _pack_decimal(sale.cost)
+        return _SALE.pack(
+            _pack_str(sale.sales_number, 64), _pack_str(sale.car_vin, 32),
+            _pack_datetime(sale.sales_date), mantissa, exponent,
+            _SALE_DELETED if deleted else 0
+        )
+
+    def decode_sale(self, record: bytes | memoryview, validate: bool = False) -> Sale:
+        sales_number, car_vin, sales_date, mantissa, exponent, _ = _SALE.unpack(record)
+        values = {
+            'sales_number': _unpack_str(sales_number),
+            'car_vin': _unpack_str(car_vin),
+            'sales_date': _unpack_datetime(sales_date),
+            'cost': _unpack_decimal(mantissa, exponent),
+        }
+        if validate:
+            return Sale.model_validate(values)
+        return construct_trusted(Sale, values)
+
+    def sale_key(self, record: bytes | memoryview) -> tuple[str, str, bool]:
+        '''Номер продажи, VIN и признак отмены без разбора остальных полей'''
+        sales_number, car_vin, _, _, _, flags = _SALE.unpack(record)
+        return _unpack_str(sales_number), _unpack_str(car_vin), bool(flags & _SALE_DELETED)
+
+
+FORMATS = {
+    TextFormat.name: TextFormat(),
+    BinaryFormat.name: BinaryFormat(),
+}
+
+
+def get_format(name: str) -> TextFormat | BinaryFormat:
+    '''Возвращает формат хранения по имени'''
+    try:
+        return FORMATS[name]
+    except KeyError:
+        raise ValueError(f'Неизвестный формат хранения {name}, доступны: {", ".join(FORMATS)}')
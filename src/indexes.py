@@ -0,0 +1,407 @@
+import heapq
+import bisect
+import os
+import threading
+from collections.abc import Iterable, Iterator
+
+from metrics import Metrics
+
+# Размер строки в файлах данных и индексов: 500 символов + перевод строки
+LINE_SIZE = 501
+
+# Минимальное число записей в журнале, после которого индекс уплотняется
+COMPACT_MIN_ENTRIES = 1024
+
+
+class ChangeLog:
+    '''Журнал из коротких текстовых записей, который можно дочитывать с места.
+
+    Каждый читатель помнит смещение, до которого он дочитал журнал, и при
+    следующем чтении получает только новые записи. Очистка журнала - это
+    подмена файла новым, начинающимся с уникальной метки "#...": по смене
+    метки читатель понимает, что его смещение больше не действительно и
+    состояние нужно перечитать целиком.
+    '''
+
+    # Счетчики ввода-вывода (см. metrics); None - не считать
+    metrics: Metrics | None = None
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # Число записей, прочитанных или дописанных этим экземпляром
+        self.entries = 0
+        self._offset = 0
+        self._mark: bytes | None = None
+        # Отложенные записи транзакции, как в RecordStore
+        self._pending: list[tuple[int, bytes]] | None = None
+        if not os.path.exists(path):
+            with open(path, 'a', encoding='utf-8'):
+                pass
+
+    def rewind(self) -> None:
+        '''Забывает прочитанное: следующее чтение вернет журнал с начала'''
+        self.entries = 0
+        self._offset = 0
+        self._mark = None
+
+    def read_new(self) -> list[str] | None:
+        '''Возвращает записи, появившиеся после прошлого чтения.
+
+        None означает, что журнал был очищен после прошлого чтения.
+        '''
+        with open(self.path, 'rb') as f:
+            head = f.readline()
+            mark = head if head.startswith(b'#') else b''
+            if self._mark is not None and mark != self._mark:
+                return None
+            self._mark = mark
+            f.seek(self._offset)
+            data = f.read()
+        if self.metrics is not None:
+            self.metrics.count('file_opens')
+            self.metrics.count('bytes_read', len(head) + len(data))
+        # Недописанная конкурентным писателем строка будет прочитана в следующий раз
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        entries = [line for line in data[:end].decode('utf-8').split('\n') if line and line[0] != '#']
+        self.entries += len(entries)
+        return entries
+
+    def append(self, entries: list[str]) -> None:
+        '''Дописывает записи в конец журнала'''
+        data = ''.join(entry + '\n' for entry in entries).encode('utf-8')
+        if self._pending is not None:
+            self._pending.append((self._offset, data))
+        else:
+            # Пишем с конца последней целой записи: хвост, оборванный сбоем, затирается
+            with open(self.path, 'r+b') as f:
+                f.seek(self._offset)
+                f.write(data)
+                f.truncate()
+            if self.metrics is not None:
+                self.metrics.count('file_opens')
+                self.metrics.count('bytes_written', len(data))
+        self._offset += len(data)
+        self.entries += len(entries)
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._pending is not None
+
+    def begin(self) -> None:
+        '''Начинает копить дописываемые записи в памяти'''
+        self._pending = []
+
+    def pending_writes(self) -> list[tuple[int, bytes]]:
+        '''Накопленные записи транзакции: (смещение в файле, байты)'''
+        return self._pending or []
+
+    def apply(self) -> None:
+        '''Пишет накопленные записи в файл и заканчивает транзакцию'''
+        pending, self._pending = self._pending, None
+        if pending:
+            data = b''.join(data for _, data in pending)
+            with open(self.path, 'r+b') as f:
+                f.seek(pending[0][0])
+                f.write(data)
+            if self.metrics is not None:
+                self.metrics.count('file_opens')
+                self.metrics.count('bytes_written', len(data))
+
+    def discard(self) -> None:
+        self._pending = None
+
+    def sync(self) -> None:
+        '''Надежно сохраняет журнал на диск'''
+        with open(self.path, 'rb') as f:
+            os.fsync(f.fileno())
+        if self.metrics is not None:
+            self.metrics.count('file_opens')
+            self.metrics.count('fsyncs')
+
+    def reset(self) -> None:
+        '''Очищает журнал, подменяя его файлом с новой меткой'''
+        tmp_path = self.path + '.tmp'
+        mark = self.write_empty(tmp_path)
+        os.replace(tmp_path, self.path)
+        if self.metrics is not None:
+            self.metrics.count('file_opens')
+            self.metrics.count('bytes_written', len(mark))
+            self.metrics.count('fsyncs')
+        self._mark = mark
+        self._offset = len(mark)
+        self.entries = 0
+
+    @staticmethod
+    def write_empty(path: str) -> bytes:
+        '''Пишет в path пустой журнал с новой меткой и возвращает метку'''
+        mark = b'#' + os.urandom(8).hex().encode() + b'\n'
+        with open(path, 'wb') as f:
+            f.write(mark)
+            f.flush()
+            os.fsync(f.fileno())
+        return mark
+
+
+class SortedIndex:
+    '''Отсортированный индекс "ключ -> номер строки", загруженный в память.
+
+    На диске индекс хранится в двух файлах: отсортированная база
+    (строки "ключ;номер" по 500 символов) и журнал изменений, в который
+    только дописываются короткие записи "I;ключ;номер" и "D;ключ".
+    При загрузке журнал накладывается на базу. Когда журнал становится
+    сравним по размеру с базой, индекс уплотняется: база пересортировывается
+    и перезаписывается целиком, а журнал очищается. Так стоимость вставки
+    остается постоянной, а перезапись базы амортизируется.
+
+    Изменения, сделанные другим процессом, подхватываются методом refresh:
+    он дочитывает только хвост журнала, а базу перечитывает лишь после
+    уплотнения.
+    '''
+
+    # Счетчики ввода-вывода (см. metrics); None - не считать
+    metrics: Metrics | None = None
+
+    def __init__(self, path: str, compact_min_entries: int = COMPACT_MIN_ENTRIES,
+                 line_size: int = LINE_SIZE) -> None:
+        self.path = path
+        # Ширина строки базы; 0 - строки без выравнивания (компактный формат)
+        self.line_size = line_size
+        self.journal_path = os.path.splitext(path)[0] + '_journal.txt'
+        self.compact_min_entries = compact_min_entries
+        self._keys: list[str] = []
+        # Новые ключи, еще не влитые в отсортированный список
+        self._pending: list[str] = []
+        self._lines: dict[str, int] = {}
+        self.journal = ChangeLog(self.journal_path)
+        # Слияние новых ключей происходит и при чтении, поэтому защищено отдельно
+        self._merge_lock = threading.Lock()
+        self.load()
+
+    @property
+    def files(self) -> list[str]:
+        '''Файлы индекса на диске'''
+        return [self.path, self.journal_path]
+
+    def load(self) -> None:
+        '''Загружает базу индекса и накладывает на нее журнал'''
+        self._lines = {}
+        scanned = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    data = line.strip()
+                    if data:
+                        key, line_num = data.rsplit(';', 1)
+                        self._lines[key] = int(line_num)
+                        scanned += 1
+            if self.metrics is not None:
+                self.metrics.count('file_opens')
+                self.metrics.count('bytes_read', os.path.getsize(self.path))
+        self.journal.rewind()
+        entries = self.journal.read_new()
+        if self.metrics is not None:
+            self.metrics.count('index_entries_scanned', scanned + len(entries))
+        for data in entries:
+            op, payload = data.split(';', 1)
+            if op == 'I':
+                key, line_num = payload.rsplit(';', 1)
+                self._lines[key] = int(line_num)
+            elif op == 'D':
+                self._lines.pop(payload, None)
+        self._keys = sorted(self._lines)
+        self._pending = []
+
+    def refresh(self) -> None:
+        '''Подхватывает изменения, которые другой процесс записал в журнал'''
+        entries = self.journal.read_new()
+        if entries is None:
+            # Индекс уплотнили: база новая, перечитываем ее вместе с журналом
+            self.load()
+            return
+        for data in entries:
+            op, payload = data.split(';', 1)
+            if op == 'I':
+                key, line_num = payload.rsplit(';', 1)
+                self._set(key, int(line_num))
+            elif op == 'D' and payload in self._lines:
+                self._remove(payload)
+
+    def get(self, key: str) -> int | None:
+        '''Возвращает номер строки по ключу или None'''
+        return self._lines.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._lines
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._sorted_keys())
+
+    def items(self) -> Iterator[tuple[str, int]]:
+        '''Пары (ключ, номер строки) в порядке сортировки ключей'''
+        for key in self._scan_keys(self._sorted_keys()):
+            yield key, self._lines[key]
+
+    def keys_after(self, key: str | None = None) -> Iterator[str]:
+        '''Ключи по возрастанию, строго большие key (все ключи, если key не задан)'''
+        keys = self._sorted_keys()
+        start = 0 if key is None else bisect.bisect_right(keys, key)
+        return self._scan_keys(keys, start)
+
+    def keys_between(self, low: str, high: str) -> Iterator[str]:
+        '''Ключи по возрастанию от low включительно до high не включая'''
+        keys = self._sorted_keys()
+        return self._scan_keys(keys, bisect.bisect_left(keys, low), bisect.bisect_left(keys, high))
+
+    def _scan_keys(self, keys: list[str], start: int = 0, stop: int | None = None) -> Iterator[str]:
+        '''Ключи keys[start:stop] по одному; с метриками считает, сколько их перебрали'''
+        stop = len(keys) if stop is None else stop
+        if self.metrics is None:
+            for pos in range(start, stop):
+                yield keys[pos]
+            return
+        pos = start
+        try:
+            while pos < stop:
+                yield keys[pos]
+                pos += 1
+        finally:
+            self.metrics.count('index_entries_scanned', pos - start)
+
+    def _sorted_keys(self) -> list[str]:
+        '''Вливает новые ключи в отсортированный список перед упорядоченным обходом'''
+        if self._pending:
+            with self._merge_lock:
+                if self._pending:
+                    self._keys = list(heapq.merge(self._keys, sorted(self._pending)))
+                    self._pending = []
+        return self._keys
+
+    def insert(self, key: str, line_number: int) -> None:
+        '''Добавляет ключ или обновляет номер строки существующего ключа'''
+        self._set(key, line_number)
+        self._append_journal([f'I;{key};{line_number}'])
+
+    def insert_many(self, items: list[tuple[str, int]]) -> None:
+        '''Добавляет пачку ключей одной записью в журнал'''
+        for key, line_number in items:
+            self._set(key, line_number)
+        self._append_journal([f'I;{key};{line_number}' for key, line_number in items])
+
+    def delete(self, key: str) -> None:
+        '''Удаляет ключ из индекса, если он есть'''
+        if key not in self._lines:
+            return
+        self._remove(key)
+        self._append_journal([f'D;{key}'])
+
+    def rename(self, key: str, new_key: str) -> None:
+        '''Переносит номер строки со старого ключа на новый'''
+        line_number = self._lines[key]
+        self._remove(key)
+        self._set(new_key, line_number)
+        self._append_journal([f'D;{key}', f'I;{new_key};{line_number}'])
+
+    def _set(self, key: str, line_number: int) -> None:
+        if key not in self._lines:
+            self._pending.append(key)
+        self._lines[key] = line_number
+
+    def _remove(self, key: str) -> None:
+        del self._lines[key]
+        pos = bisect.bisect_left(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            del self._keys[pos]
+        else:
+            self._pending.remove(key)
+
+    def _append_journal(self, entries: list[str]) -> None:
+        '''Дописывает записи в журнал и, если журнал разросся, уплотняет индекс.
+
+        Внутри транзакции уплотнение откладывается: его выполнит владелец
+        транзакции, проверив compaction_due после ее фиксации.
+        '''
+        self.journal.append(entries)
+        if not self.journal.in_transaction and self.compaction_due():
+            self.compact()
+
+    def compaction_due(self) -> bool:
+        '''Журнал стал сравним по размеру с базой и пора уплотнять индекс'''
+        return self.journal.entries >= max(self.compact_min_entries, len(self._lines))
+
+    def compact(self) -> None:
+        '''Перезаписывает базу индекса в отсортированном виде и очищает журнал'''
+        tmp_path = self.path + '.tmp'
+        self.write_base(tmp_path, self.items())
+        # Подмена файла атомарна, а повторное наложение журнала на новую базу
+        # дает тот же результат, поэтому сбой между шагами не портит индекс
+        os.replace(tmp_path, self.path)
+        self.journal.reset()
+
+    def close(self) -> None:
+        '''Файлы индекса открываются только на время чтения и записи: закрывать нечего'''
+
+    def write_replacement(self, items: Iterable[tuple[str, int]]) -> None:
+        '''Пишет замены файлов индекса "<файл>.tmp": базу из упорядоченных пар и пустой журнал'''
+        self.write_base(self.path + '.tmp', items)
+        ChangeLog.write_empty(self.journal_path + '.tmp')
+
+    def write_base(self, path: str, items: Iterable[tuple[str, int]]) -> None:
+        '''Пишет в path базу индекса из пар, уже упорядоченных по ключу'''
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, line_num in items:
+                f.write(f'{key};{line_num}'.ljust(max(self.line_size - 1, 0)) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            if self.metrics is not None:
+                self.metrics.count('file_opens')
+                self.metrics.count('bytes_written', f.tell())
+                self.metrics.count('fsyncs')
+
+
+class StatusIndex:
+    '''Вторичный индекс "статус -> отсортированные номера строк автомобилей".
+
+    Индекс живет только в памяти: он строится одним проходом по файлу
+    автомобилей при запуске сервиса и поддерживается при каждой смене
+    статуса. Номера строк идут по возрастанию, то есть в порядке добавления.
+    '''
+
+    def __init__(self) -> None:
+        self._lines: dict[str, list[int]] = {}
+        self._status: dict[int, str] = {}
+
+    def add(self, line_number: int, status: str) -> None:
+        '''Регистрирует автомобиль с указанным статусом'''
+        self._status[line_number] = status
+        lines = self._lines.setdefault(status, [])
+        if not lines or lines[-1] < line_number:
+            # Новые автомобили дописываются в конец файла
+            lines.append(line_number)
+        else:
+            bisect.insort(lines, line_number)
+
+    def move(self, line_number: int, old_status: str, new_status: str) -> None:
+        '''Переносит автомобиль из одного статуса в другой'''
+        if old_status == new_status:
+            return
+        lines = self._lines.get(old_status, [])
+        pos = bisect.bisect_left(lines, line_number)
+        if pos < len(lines) and lines[pos] == line_number:
+            del lines[pos]
+        self.add(line_number, new_status)
+
+    def status_of(self, line_number: int) -> str | None:
+        '''Текущий статус автомобиля в строке line_number'''
+        return self._status.get(line_number)
+
+    def lines(self, status: str) -> list[int]:
+        '''Номера строк автомобилей со статусом в порядке возрастания'''
+        return self._lines.get(status, [])
+
+    def counts(self) -> dict[str, int]:
+        '''Количество автомобилей по статусам'''
+        return {status: len(lines) for status, lines in self._lines.items()}
@@ -0,0 +1,242 @@
+import functools
+import mmap
+import os
+import struct
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки между процессами недоступны
+    fcntl = None
+
+_GENERATION = struct.Struct('<Q')
+
+
+class RWLock:
+    '''Блокировка "много читателей или один писатель".
+
+    Писатели имеют приоритет: пока писатель ждет, новые читатели не
+    заходят, поэтому поток записей не голодает под постоянным чтением.
+    '''
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self) -> None:
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self) -> None:
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class ProcessLock:
+    '''Рекомендательная блокировка fcntl.flock на отдельном файле-замке.
+
+    flock действует на открытый файл целиком, а не на поток, поэтому
+    разделяемая блокировка берется первым читателем процесса и снимается
+    последним. Исключительную блокировку берет только единственный писатель
+    процесса, которого пропустила RWLock.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._mutex = threading.Lock()
+        self._readers = 0
+
+    def acquire_shared(self) -> None:
+        with self._mutex:
+            if not self._readers:
+                fcntl.flock(self._fd, fcntl.LOCK_SH)
+            self._readers += 1
+
+    def release_shared(self) -> None:
+        with self._mutex:
+            self._readers -= 1
+            if not self._readers:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def acquire_exclusive(self) -> None:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def release_exclusive(self) -> None:
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class Generations:
+    '''Счетчики поколений файлов данных, общие для всех процессов.
+
+    Файл из нескольких 8-байтовых счетчиков отображен в память, поэтому
+    проверка "изменился ли файл с прошлого раза" не требует системных
+    вызовов. Счетчик увеличивает писатель под исключительной блокировкой.
+    '''
+
+    def __init__(self, path: str, names: tuple[str, ...]) -> None:
+        self.path = path
+        self._slots = {name: i * _GENERATION.size for i, name in enumerate(names)}
+        size = len(names) * _GENERATION.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                # Дописываем нули: одновременное создание из двух процессов безопасно
+                os.truncate(path, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def get(self, name: str) -> int:
+        return _GENERATION.unpack_from(self._map, self._slots[name])[0]
+
+    def bump(self, name: str) -> int:
+        '''Увеличивает поколение файла и возвращает новое значение'''
+        generation = self.get(name) + 1
+        _GENERATION.pack_into(self._map, self._slots[name], generation)
+        return generation
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class FileLocks:
+    '''Набор блокировок по файлам данных.
+
+    Блокировки всегда берутся в одном и том же порядке (порядок имен в
+    конструкторе), поэтому операции над несколькими файлами не могут
+    взаимно заблокироваться.
+
+    Если задан каталог, потоки дополнительно согласуются с другими
+    процессами: у каждого файла данных есть файл-замок "<имя>.lock" и
+    счетчик поколения в "generations.bin". Писатель увеличивает поколение,
+    захватив файл, - еще до изменений, поэтому даже после его падения посреди
+    записи процесс, увидевший при захвате чужое поколение, сначала вызовет
+    on_change(имя), чтобы обновить свое состояние в памяти.
+    '''
+
+    def __init__(self, names: tuple[str, ...], directory: str | None = None) -> None:
+        self.names = names
+        self._locks = {name: RWLock() for name in names}
+        self._process_locks: dict[str, ProcessLock] = {}
+        self._generations: Generations | None = None
+        # Поколения, до которых этот процесс уже обновил свое состояние
+        self._seen: dict[str, int] = {}
+        self.on_change: Callable[[str], None] | None = None
+        if directory is not None and fcntl is not None:
+            self._process_locks = {
+                name: ProcessLock(os.path.join(directory, name + '.lock')) for name in names
+            }
+            self._generations = Generations(os.path.join(directory, 'generations.bin'), names)
+
+    @property
+    def shared(self) -> bool:
+        '''Согласуются ли блокировки с другими процессами'''
+        return self._generations is not None
+
+    @contextmanager
+    def hold(self, read: tuple[str, ...] = (), write: tuple[str, ...] = ()) -> Iterator[None]:
+        '''Берет блокировки на чтение и запись указанных файлов'''
+        acquired = []
+        try:
+            for name in self.names:
+                if name in write:
+                    self._acquire_write(name)
+                    acquired.append(functools.partial(self._release_write, name))
+                elif name in read:
+                    self._acquire_read(name)
+                    acquired.append(functools.partial(self._release_read, name))
+            yield
+        finally:
+            for release in reversed(acquired):
+                release()
+
+    def _acquire_write(self, name: str) -> None:
+        self._locks[name].acquire_write()
+        if self._generations is not None:
+            self._process_locks[name].acquire_exclusive()
+            self._sync(name)
+            self._seen[name] = self._generations.bump(name)
+
+    def _release_write(self, name: str) -> None:
+        if self._generations is not None:
+            self._process_locks[name].release_exclusive()
+        self._locks[name].release_write()
+
+    def _acquire_read(self, name: str) -> None:
+        lock = self._locks[name]
+        if self._generations is None:
+            lock.acquire_read()
+            return
+        process_lock = self._process_locks[name]
+        while True:
+            lock.acquire_read()
+            process_lock.acquire_shared()
+            if self._generations.get(name) == self._seen.get(name):
+                return
+            # Состояние устарело: обновляем его, не пуская других потоков процесса
+            process_lock.release_shared()
+            lock.release_read()
+            lock.acquire_write()
+            process_lock.acquire_shared()
+            try:
+                self._sync(name)
+            finally:
+                process_lock.release_shared()
+                lock.release_write()
+
+    def _release_read(self, name: str) -> None:
+        if self._generations is not None:
+            self._process_locks[name].release_shared()
+        self._locks[name].release_read()
+
+    def _sync(self, name: str) -> None:
+        generation = self._generations.get(name)
+        if generation != self._seen.get(name):
+            if self.on_change is not None:
+                self.on_change(name)
+            self._seen[name] = generation
+
+    def close(self) -> None:
+        '''Закрывает файлы-замки и отображение счетчиков поколений'''
+        for process_lock in self._process_locks.values():
+            process_lock.close()
+        if self._generations is not None:
+            self._generations.close()
+
+
+def locked(read: tuple[str, ...] = (), write: tuple[str, ...] = ()) -> Callable:
+    '''Декоратор метода сервиса: выполняет его под блокировками self._locks'''
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._locks.hold(read, write):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,106 @@
+'''Необязательные метрики сервиса: задержки операций и счетчики ввода-вывода.
+
+Метрики включаются при создании сервиса (CarService(..., metrics=True)).
+Выключенные метрики почти ничего не стоят: методы сервиса не обертываются,
+а файлы и индексы проверяют только, задан ли у них объект Metrics.
+'''
+import bisect
+import threading
+import time
+from collections.abc import Callable
+
+# Верхние границы корзин гистограммы задержек, в секундах
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Счетчики ввода-вывода и их описания для Prometheus
+IO_COUNTERS = {
+    'file_opens': 'Открытия файлов',
+    'bytes_read': 'Прочитанные байты файлов данных, индексов и журналов',
+    'bytes_written': 'Записанные байты файлов данных, индексов и журналов',
+    'fsyncs': 'Вызовы fsync',
+    'index_entries_scanned': 'Просмотренные записи индексов',
+}
+
+
+class Metrics:
+    '''Гистограммы задержек по операциям и счетчики ввода-вывода.
+
+    Счетчики обновляют параллельные читатели, поэтому все изменения идут
+    под собственной блокировкой.
+    '''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.io = dict.fromkeys(IO_COUNTERS, 0)
+        # Операция -> [число вызовов по корзинам (последняя - больше всех границ), сумма, ошибки]
+        self._operations: dict[str, list] = {}
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.io[name] += value
+
+    def observe(self, operation: str, seconds: float, failed: bool = False) -> None:
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            stats[0][bucket] += 1
+            stats[1] += seconds
+            stats[2] += failed
+
+    def timed(self, operation: str, function: Callable) -> Callable:
+        '''Обертка function, записывающая ее задержку в гистограмму operation'''
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.observe(operation, time.perf_counter() - started, failed)
+        wrapper.__wrapped__ = function
+        return wrapper
+
+    def snapshot(self) -> dict:
+        '''Все метрики обычным словарем; корзины гистограмм накопительные, как в Prometheus'''
+        with self._lock:
+            operations = {}
+            for operation, (buckets, total, errors) in sorted(self._operations.items()):
+                cumulative = 0
+                le = {}
+                for bound, count in zip((*LATENCY_BUCKETS, float('inf')), buckets):
+                    cumulative += count
+                    le[bound] = cumulative
+                operations[operation] = {
+                    'count': cumulative, 'errors': errors, 'sum_seconds': total, 'buckets': le,
+                }
+            return {'operations': operations, 'io': dict(self.io)}
+
+    def prometheus(self, prefix: str = 'bibip') -> str:
+        '''Метрики в текстовом формате Prometheus'''
+        data = self.snapshot()
+        lines = [
+            f'# HELP {prefix}_operation_seconds Время выполнения операций CarService',
+            f'# TYPE {prefix}_operation_seconds histogram',
+        ]
+        for operation, stats in data['operations'].items():
+            for bound, count in stats['buckets'].items():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_operation_seconds_bucket{{operation="{operation}",le="{le}"}} {count}')
+            lines.append(f'{prefix}_operation_seconds_sum{{operation="{operation}"}} {stats["sum_seconds"]!r}')
+            lines.append(f'{prefix}_operation_seconds_count{{operation="{operation}"}} {stats["count"]}')
+        lines += [
+            f'# HELP {prefix}_operation_errors_total Операции, завершившиеся исключением',
+            f'# TYPE {prefix}_operation_errors_total counter',
+        ]
+        for operation, stats in data['operations'].items():
+            lines.append(f'{prefix}_operation_errors_total{{operation="{operation}"}} {stats["errors"]}')
+        for name, description in IO_COUNTERS.items():
+            lines += [
+                f'# HELP {prefix}_{name}_total {description}',
+                f'# TYPE {prefix}_{name}_total counter',
+                f'{prefix}_{name}_total {data["io"][name]}',
+            ]
+        return '\n'.join(lines) + '\n'
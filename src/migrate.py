@@ -0,0 +1,118 @@
+'''Разовый перенос файлов данных из текстового формата в бинарный.
+
+Запуск: python migrate.py <каталог с данными>
+
+Записи переносятся в том же порядке, поэтому номера строк не меняются и
+индексы и счетчики остаются действительными без перестроения; базы
+индексов при этом переписываются без выравнивания строк до 501 байта.
+
+Перенос идет под блокировками всех файлов данных, а незавершенные
+операции из журнала предзаписи сначала доводятся до конца. Новые файлы
+готовятся рядом и подменяют старые разом (см. wal.replace_files): сбой
+до подмены оставляет каталог текстовым, и перенос можно повторить, а
+прерванную подмену доделает следующий запуск сервиса или переноса.
+Текстовые файлы данных не удаляются, но сервис в текстовом режиме
+после переноса каталог не откроет: индексы описывают уже бинарные файлы.
+'''
+import argparse
+import os
+
+from formats import get_format
+from indexes import LINE_SIZE, SortedIndex
+from locks import FileLocks
+from storage import RecordStore
+from wal import WriteAheadLog, finish_replace, replace_files
+
+# Имена файлов данных без расширения
+DATA_FILES = ('models', 'cars', 'sales')
+# Индексы, базы которых переписываются без выравнивания
+INDEX_FILES = ('models_index', 'cars_index', 'sales_index', 'sales_number_index', 'sales_date_index')
+
+
+def migrate_to_binary(root_directory_path: str) -> dict[str, int]:
+    '''Переносит файлы данных в бинарный формат и возвращает число записей по файлам'''
+    locks = FileLocks(DATA_FILES, root_directory_path)
+    try:
+        with locks.hold(write=locks.names):
+            # Доделываем прерванную подмену и операции из журнала предзаписи
+            finish_replace(root_directory_path)
+            wal = WriteAheadLog(os.path.join(root_directory_path, 'wal.log'))
+            try:
+                wal.replay(root_directory_path)
+            finally:
+                wal.close()
+            return _migrate(root_directory_path)
+    finally:
+        locks.close()
+
+
+def _migrate(root_directory_path: str) -> dict[str, int]:
+    text = get_format('text')
+    binary = get_format('binary')
+    converters = {
+        'models': (binary.model_size, binary.model_header,
+                   lambda record: binary.encode_model(text.decode_model(record))),
+        'cars': (binary.car_size, binary.car_header,
+                 lambda record: binary.encode_car(text.decode_car(record))),
+        'sales': (binary.sale_size, binary.sale_header,
+                  lambda record: binary.encode_sale(text.decode_sale(record),
+                                                    deleted=text.sale_key(record)[2])),
+    }
+
+    for name in DATA_FILES:
+        target = os.path.join(root_directory_path, name + binary.extension)
+        if os.path.exists(target) and os.path.getsize(target) > len(converters[name][1]):
+            raise ValueError(f'Файл {target} уже содержит данные')
+
+    migrated = {}
+    replaced = []
+    for name in DATA_FILES:
+        source = os.path.join(root_directory_path, name + text.extension)
+        target = os.path.join(root_directory_path, name + binary.extension)
+        record_size, header, convert = converters[name]
+        tmp_path = target + '.tmp'
+        with open(tmp_path, 'wb'):
+            pass
+        target_store = RecordStore(tmp_path, record_size, header)
+        count = 0
+        if os.path.exists(source):
+            source_store = RecordStore(source, LINE_SIZE)
+            # Пишем блоками, чтобы не держать весь файл в памяти
+            batch = []
+            for _, record in source_store.scan():
+                batch.append(convert(record))
+                if len(batch) >= 10000:
+                    target_store.append(batch)
+                    count += len(batch)
+                    batch = []
+            target_store.append(batch)
+            count += len(batch)
+            source_store.close()
+        target_store.sync()
+        target_store.close()
+        replaced.append(os.path.basename(target))
+        migrated[name] = count
+
+    for name in INDEX_FILES:
+        path = os.path.join(root_directory_path, name + text.extension)
+        if not os.path.exists(path):
+            continue
+        # База читается в любом виде, а пишется уже с шириной строк бинарного формата
+        index = SortedIndex(path, line_size=binary.index_line_size)
+        index.write_replacement(index.items())
+        replaced += [os.path.basename(file) for file in index.files]
+
+    replace_files(root_directory_path, replaced)
+    return migrated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Перенос данных bibip в бинарный формат')
+    parser.add_argument('root_directory_path', help='каталог с файлами данных')
+    args = parser.parse_args()
+    for name, count in migrate_to_binary(args.root_directory_path).items():
+        print(f'{name}: {count}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+'''Параллельный просмотр файлов записей пулом процессов.
+
+Записи в файлах данных фиксированной длины, поэтому файл делится на
+диапазоны строк точно по границам записей. Каждый процесс пула сам
+отображает свой диапазон в память и разбирает записи, а вызывающий
+объединяет частичные результаты в порядке диапазонов, то есть в порядке
+строк файла.
+'''
+import mmap
+import multiprocessing
+import os
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+
+from storage import RecordStore
+
+# Файлы меньше этого размера просматриваются в текущем процессе:
+# запуск задач в пуле и передача результатов обходятся дороже разбора
+PARALLEL_SCAN_MIN_BYTES = 64 * 1024 * 1024
+
+
+# Процесс, запустивший forkserver. Сервер один на процесс, и его копия,
+# снятая fork (например, предзагрузка приложения в gunicorn), им
+# пользоваться не может: там процессы пула запускаются через spawn
+_forkserver_pid: int | None = None
+
+
+def _pool_context() -> multiprocessing.context.BaseContext:
+    global _forkserver_pid
+    if 'forkserver' in multiprocessing.get_all_start_methods() and _forkserver_pid in (None, os.getpid()):
+        _forkserver_pid = os.getpid()
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def split_ranges(count: int, parts: int) -> list[tuple[int, int]]:
+    '''Делит строки 0..count на не более чем parts диапазонов [начало, конец)'''
+    step = max(-(-count // max(parts, 1)), 1)
+    return [(start, min(start + step, count)) for start in range(0, count, step)]
+
+
+def _records(mapped: mmap.mmap, header_size: int, record_size: int,
+             start: int, stop: int) -> Iterator[tuple[int, bytes]]:
+    offset = header_size + start * record_size
+    for line_number in range(start, stop):
+        yield line_number, mapped[offset:offset + record_size]
+        offset += record_size
+
+
+def _scan_range(path: str, header_size: int, record_size: int, start: int, stop: int,
+                task: Callable, args: tuple):
+    '''Выполняется в процессе пула: свое отображение файла и разбор диапазона строк'''
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), header_size + stop * record_size, access=mmap.ACCESS_READ) as mapped:
+            return task(_records(mapped, header_size, record_size, start, stop), *args)
+
+
+class ScanEngine:
+    '''Выполняет задачу разбора над всеми записями хранилища.
+
+    task(records, *args) получает итератор пар (номер строки, запись) и
+    возвращает частичный результат; map возвращает список частичных
+    результатов в порядке строк. Задача и ее результат передаются между
+    процессами, поэтому задача должна быть функцией уровня модуля.
+
+    Небольшие файлы (меньше min_bytes) и хранилища внутри транзакции, где
+    часть записей еще только в памяти, просматриваются в текущем процессе
+    одной задачей. Пул создается при первом параллельном просмотре.
+
+    Процессы пула запускаются через forkserver (где его нет - spawn), а не
+    fork: сервис многопоточный, и копия процесса, снятая в момент, когда
+    другой поток держит блокировку, зависла бы на ней. Поэтому процессы
+    пула ничего не наследуют и получают только путь к файлу и границы.
+    Пул, унаследованный копией процесса, снятой fork, не используется:
+    копия создает свой.
+    '''
+
+    def __init__(self, min_bytes: int = PARALLEL_SCAN_MIN_BYTES, workers: int | None = None) -> None:
+        self.min_bytes = min_bytes
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: ProcessPoolExecutor | None = None
+        # Процесс, создавший пул
+        self._pid = 0
+
+    def map(self, store: RecordStore, task: Callable, *args) -> list:
+        count = len(store)
+        if (self.workers < 2 or count < 2 or store.in_transaction
+                or count * store.record_size < self.min_bytes):
+            return [task(store.scan(), *args)]
+        if self._executor is None or self._pid != os.getpid():
+            # Процессы унаследованного пула - дети другого процесса: пул просто забываем
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=_pool_context())
+            self._pid = os.getpid()
+        # Записанное мимо отображения уже в файле, а отображение у процессов общее
+        futures = [
+            self._executor.submit(_scan_range, store.path, store.header_size, store.record_size,
+                                  start, stop, task, args)
+            for start, stop in split_ranges(count, self.workers)
+        ]
+        if store.metrics is not None:
+            store.metrics.count('file_opens', len(futures))
+            store.metrics.count('bytes_read', count * store.record_size)
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+            self._executor = None
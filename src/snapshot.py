@@ -0,0 +1,215 @@
+'''Колоночный снимок автомобилей и продаж для отчетов на numpy.
+
+Отчеты по всему складу (средняя цена по моделям, число автомобилей по
+статусам, возраст автомобилей) построчно разбирают весь файл автомобилей.
+Снимок один раз раскладывает автомобили и продажи по столбцам numpy, и
+группировки выполняются векторно. После записей снимок обновляется
+инкрементально: дочитываются только новые строки и строки, переписанные на
+месте (см. RowChanges).
+
+numpy - необязательная зависимость: без нее сервис работает, недоступны
+только снимки.
+'''
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+
+try:
+    import numpy as np
+except ImportError:  # снимки недоступны, остальной сервис работает
+    np = None
+
+from formats import STATUS_CODES
+from models import CarStatus
+
+# Цены и суммы хранятся целыми числами в сотых долях
+PRICE_SCALE = 100
+
+# Код статуса в столбце - тот же фиксированный код, что в бинарном формате
+_STATUS_CODES = {status.value: code for status, code in STATUS_CODES.items()}
+
+
+class RowChanges:
+    '''Номера строк, переписанных на месте, по файлам данных.
+
+    Новые строки снимок находит по числу строк в файле, а измененные на
+    месте - здесь. Список ограничен: при переполнении, а также когда
+    изменения неизвестны (строки перенумерованы уплотнением, чужой процесс
+    изменил продажи), увеличивается эпоха, и снимки строятся заново.
+    '''
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.epoch = 0
+        self._lines: dict[str, list[int]] = {'cars': [], 'sales': []}
+
+    def add(self, name: str, line_number: int) -> None:
+        lines = self._lines[name]
+        lines.append(line_number)
+        if len(lines) > self.limit:
+            self.reset()
+
+    def reset(self) -> None:
+        self.epoch += 1
+        for lines in self._lines.values():
+            lines.clear()
+
+    def position(self, name: str) -> int:
+        return len(self._lines[name])
+
+    def since(self, name: str, position: int) -> list[int]:
+        '''Строки, переписанные после позиции position'''
+        return self._lines[name][position:]
+
+
+def scale_amount(amount: Decimal) -> int:
+    return int((amount * PRICE_SCALE).to_integral_value())
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError('Для колоночных снимков нужен numpy: pip install numpy')
+
+
+class InventorySnapshot:
+    '''Столбцы автомобилей и продаж.
+
+    Автомобили (по номерам строк файла): model (int32), price (int64, в
+    сотых), date_start (datetime64[s]), status (int8, код из formats.STATUS_CODES).
+    Продажи (по номерам строк файла): model (int32), cost (int64, в сотых),
+    sales_date (datetime64[s]), active (bool - продажа не отменена).
+
+    Снимок строит и обновляет CarService (inventory_snapshot,
+    refresh_snapshot). Сохраненный через save снимок открывается load с
+    отображением файлов в память; такой снимок только для чтения и при
+    обновлении через сервис строится заново.
+    '''
+
+    CAR_COLUMNS = {'model': 'int32', 'price': 'int64', 'date_start': 'datetime64[s]', 'status': 'int8'}
+    SALE_COLUMNS = {'model': 'int32', 'cost': 'int64', 'sales_date': 'datetime64[s]', 'active': 'bool'}
+
+    def __init__(self) -> None:
+        _require_numpy()
+        # Эпоха RowChanges, по которой построен снимок, и позиции в ее списках
+        self.epoch: int | None = None
+        self.reset(None)
+
+    def reset(self, epoch: int | None) -> None:
+        '''Очищает снимок перед построением заново'''
+        self.epoch = epoch
+        self.positions = {'cars': 0, 'sales': 0}
+        self.cars = {name: np.empty(0, dtype) for name, dtype in self.CAR_COLUMNS.items()}
+        self.sales = {name: np.empty(0, dtype) for name, dtype in self.SALE_COLUMNS.items()}
+
+    @property
+    def car_count(self) -> int:
+        return len(self.cars['model'])
+
+    @property
+    def sale_count(self) -> int:
+        return len(self.sales['model'])
+
+    def update_cars(self, rows: dict[int, tuple[int, Decimal, datetime, str]]) -> None:
+        '''Записывает строки автомобилей: номер строки -> (модель, цена, дата, статус)'''
+        self._update(self.cars, self.CAR_COLUMNS, {
+            line_number: (model, scale_amount(price), _naive(date_start), _STATUS_CODES[status])
+            for line_number, (model, price, date_start, status) in rows.items()
+        })
+
+    def update_sales(self, rows: dict[int, tuple[int, Decimal, datetime, bool]]) -> None:
+        '''Записывает строки продаж: номер строки -> (модель, сумма, дата, действует ли)'''
+        self._update(self.sales, self.SALE_COLUMNS, {
+            line_number: (model, scale_amount(cost), _naive(sales_date), active)
+            for line_number, (model, cost, sales_date, active) in rows.items()
+        })
+
+    @staticmethod
+    def _update(columns: dict, dtypes: dict[str, str], rows: dict[int, tuple]) -> None:
+        if not rows:
+            return
+        size = len(next(iter(columns.values())))
+        new_size = max(size, max(rows) + 1)
+        lines = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        for i, name in enumerate(dtypes):
+            column = columns[name]
+            if new_size > size:
+                # Новые строки дописываются одним расширением столбца
+                column = np.concatenate([column, np.zeros(new_size - size, dtypes[name])])
+            elif not column.flags.writeable:
+                column = column.copy()
+            column[lines] = np.array([row[i] for row in rows.values()], dtype=dtypes[name])
+            columns[name] = column
+
+    # Векторные группировки
+    def count_by_status(self) -> dict[CarStatus, int]:
+        counts = np.bincount(self.cars['status'], minlength=max(STATUS_CODES.values()) + 1)
+        return {status: int(counts[code]) for status, code in STATUS_CODES.items()}
+
+    def average_price_by_model(self, status: CarStatus | None = None) -> dict[int, Decimal]:
+        '''Средняя цена автомобилей по id модели, при необходимости только с данным статусом'''
+        mask = None if status is None else self.cars['status'] == _STATUS_CODES[status.value]
+        totals = self._sum_by_model(self.cars['model'], self.cars['price'], mask)
+        return {
+            model_id: Decimal(total) / count / PRICE_SCALE
+            for model_id, (count, total) in totals.items()
+        }
+
+    def age_histogram(self, edges_days: list[int], now: datetime) -> list[int]:
+        '''Число автомобилей по возрасту в днях от date_start: интервалы между соседними edges_days'''
+        age = (np.datetime64(_naive(now), 's') - self.cars['date_start']).astype('timedelta64[D]').astype(np.int64)
+        counts, _ = np.histogram(age, bins=edges_days)
+        return [int(count) for count in counts]
+
+    def revenue_by_model(self, start: datetime | None = None,
+                         end: datetime | None = None) -> dict[int, tuple[int, Decimal]]:
+        '''Число действующих продаж и выручка по id модели за период (end не включая)'''
+        mask = self.sales['active'].copy()
+        if start is not None:
+            mask &= self.sales['sales_date'] >= np.datetime64(_naive(start), 's')
+        if end is not None:
+            mask &= self.sales['sales_date'] < np.datetime64(_naive(end), 's')
+        totals = self._sum_by_model(self.sales['model'], self.sales['cost'], mask)
+        return {
+            model_id: (count, Decimal(total) / PRICE_SCALE)
+            for model_id, (count, total) in totals.items()
+        }
+
+    @staticmethod
+    def _sum_by_model(models, amounts, mask=None) -> dict[int, tuple[int, int]]:
+        '''id модели -> (число строк, сумма) с точным целочисленным суммированием'''
+        if mask is not None:
+            models, amounts = models[mask], amounts[mask]
+        model_ids, inverse = np.unique(models, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(model_ids))
+        totals = np.zeros(len(model_ids), dtype=np.int64)
+        np.add.at(totals, inverse, amounts)
+        return {
+            int(model_id): (int(count), int(total))
+            for model_id, count, total in zip(model_ids, counts, totals)
+        }
+
+    # Сохранение в .npy
+    def save(self, directory: str) -> None:
+        '''Сохраняет столбцы в directory файлами "cars_<столбец>.npy" и "sales_<столбец>.npy"'''
+        os.makedirs(directory, exist_ok=True)
+        for prefix, columns in (('cars', self.cars), ('sales', self.sales)):
+            for name, column in columns.items():
+                path = os.path.join(directory, f'{prefix}_{name}.npy')
+                np.save(path + '.tmp.npy', column)
+                os.replace(path + '.tmp.npy', path)
+
+    @classmethod
+    def load(cls, directory: str) -> 'InventorySnapshot':
+        '''Открывает сохраненный снимок; столбцы отображаются в память только для чтения'''
+        snapshot = cls()
+        for prefix, columns in (('cars', snapshot.cars), ('sales', snapshot.sales)):
+            for name in columns:
+                columns[name] = np.load(os.path.join(directory, f'{prefix}_{name}.npy'), mmap_mode='r')
+        return snapshot
+
+
+def _naive(value: datetime) -> datetime:
+    '''datetime64 не хранит часовой пояс: дата с поясом приводится к UTC'''
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
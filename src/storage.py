@@ -0,0 +1,261 @@
+import mmap
+import os
+import threading
+from collections.abc import Iterator
+
+from indexes import LINE_SIZE
+from metrics import Metrics
+
+
+class RecordStore:
+    '''Файл записей фиксированной длины, отображенный в память через mmap.
+
+    Отображение держится открытым все время жизни объекта: чтение записи -
+    это срез memoryview без копирования и без системных вызовов. Запись на
+    месте идет прямо в отображение, а дописанные в конец файла записи
+    подхватываются переотображением при первом обращении к ним.
+
+    Хранилище работает с готовыми байтами записей, а их кодирование - забота
+    формата хранения (см. formats). Если задан header, он пишется в начало
+    нового файла и сверяется при открытии существующего.
+
+    Внутри транзакции (begin ... apply) записи не попадают в файл, а
+    копятся в памяти и видны чтениям этого же объекта; в файл они пишутся
+    только после того, как попали в журнал предзаписи (см. wal).
+    '''
+
+    # Счетчики ввода-вывода (см. metrics); None - не считать
+    metrics: Metrics | None = None
+
+    def __init__(self, path: str, record_size: int = LINE_SIZE, header: bytes = b'') -> None:
+        self.path = path
+        self.record_size = record_size
+        self.header_size = len(header)
+        self._file = open(path, 'r+b')
+        self._size = os.fstat(self._file.fileno()).st_size
+        if header:
+            self._check_header(header)
+        # Текущее отображение: (mmap, memoryview, размер). Кортеж подменяется
+        # целиком, поэтому читатель в другом потоке не увидит его наполовину
+        self._mapping: tuple[mmap.mmap | None, memoryview | None, int] = (None, None, 0)
+        self._remap_lock = threading.Lock()
+        # Отложенные записи транзакции: (смещение, байты); None - запись сразу в файл
+        self._pending: list[tuple[int, bytes]] | None = None
+        # Отложенные записи по номерам строк, чтобы чтения их видели
+        self._overlay: dict[int, bytes] = {}
+        self._appended = 0
+
+    def refresh(self) -> None:
+        '''Подхватывает изменения файла, сделанные другим процессом.
+
+        Дописанные записи видны по новому размеру файла, а записи, измененные
+        на месте, - через общее с другим процессом отображение. Если файл
+        подменили целиком, он открывается заново.
+        '''
+        stat = os.stat(self.path)
+        if stat.st_ino != os.fstat(self._file.fileno()).st_ino:
+            self._mapping = (None, None, 0)
+            self._file.close()
+            self._file = open(self.path, 'r+b')
+            if self.metrics is not None:
+                self.metrics.count('file_opens')
+        self._size = stat.st_size
+
+    def _check_header(self, header: bytes) -> None:
+        if self._size == 0:
+            self._pwrite(header, 0)
+            self._size = len(header)
+            return
+        self._file.seek(0)
+        if self._file.read(len(header)) != header:
+            self._file.close()
+            raise ValueError(f'Файл {self.path} записан в другом формате или другой версии формата')
+
+    def __len__(self) -> int:
+        '''Количество записей в файле'''
+        return (self._size - self.header_size) // self.record_size + self._appended
+
+    def _offset(self, line_number: int) -> int:
+        return self.header_size + line_number * self.record_size
+
+    def _mapped(self, end: int) -> tuple[mmap.mmap | None, memoryview | None, int]:
+        '''Возвращает отображение, покрывающее байты до end, при необходимости переотображая файл.
+
+        Старое отображение не закрывается явно: им еще могут пользоваться
+        параллельные читатели, его освободит сборщик мусора.
+        '''
+        mapping = self._mapping
+        if end > mapping[2]:
+            with self._remap_lock:
+                mapping = self._mapping
+                if end > mapping[2] and self._size:
+                    mapped = mmap.mmap(self._file.fileno(), self._size)
+                    mapping = (mapped, memoryview(mapped), self._size)
+                    self._mapping = mapping
+        return mapping
+
+    def read(self, line_number: int) -> memoryview:
+        '''Возвращает запись как срез отображения без копирования'''
+        if self._overlay and line_number in self._overlay:
+            return memoryview(self._overlay[line_number])
+        start = self._offset(line_number)
+        end = start + self.record_size
+        if end > self._size:
+            raise IndexError(f'Запись {line_number} за пределами файла {self.path}')
+        if self.metrics is not None:
+            self.metrics.count('bytes_read', self.record_size)
+        return self._mapped(end)[1][start:end]
+
+    def read_bytes(self, line_number: int) -> bytes:
+        '''Возвращает копию записи; срез mmap сразу дает bytes без промежуточного memoryview'''
+        if self._overlay and line_number in self._overlay:
+            return self._overlay[line_number]
+        start = self._offset(line_number)
+        end = start + self.record_size
+        mapped, _, mapped_size = self._mapping
+        if end > mapped_size:
+            # read проверит границы и переотобразит файл
+            return bytes(self.read(line_number))
+        if self.metrics is not None:
+            self.metrics.count('bytes_read', self.record_size)
+        return mapped[start:end]
+
+    def scan(self) -> Iterator[tuple[int, memoryview]]:
+        '''Последовательно перебирает все записи файла'''
+        count = (self._size - self.header_size) // self.record_size
+        if self.metrics is not None:
+            self.metrics.count('bytes_read', count * self.record_size)
+        _, view, _ = self._mapped(self._offset(count))
+        overlay = self._overlay
+        for line_number in range(count):
+            if overlay and line_number in overlay:
+                yield line_number, memoryview(overlay[line_number])
+                continue
+            start = self._offset(line_number)
+            yield line_number, view[start:start + self.record_size]
+        for line_number in range(count, count + self._appended):
+            yield line_number, memoryview(overlay[line_number])
+
+    def write(self, line_number: int, record: bytes) -> None:
+        '''Перезаписывает запись на месте'''
+        self._check_size(record)
+        start = self._offset(line_number)
+        if self._pending is not None:
+            self._pending.append((start, record))
+            self._overlay[line_number] = record
+            return
+        self._write_at(start, record)
+
+    def _write_at(self, start: int, data: bytes) -> None:
+        mapped, _, mapped_size = self._mapping
+        if start + len(data) <= mapped_size:
+            mapped[start:start + len(data)] = data
+            if self.metrics is not None:
+                self.metrics.count('bytes_written', len(data))
+        else:
+            self._pwrite(data, start)
+
+    def append(self, records: list[bytes]) -> int:
+        '''Дописывает записи одним блоком и возвращает номер первой из них'''
+        for record in records:
+            self._check_size(record)
+        line_number = len(self)
+        if self._pending is not None:
+            for i, record in enumerate(records):
+                self._pending.append((self._offset(line_number + i), record))
+                self._overlay[line_number + i] = record
+            self._appended += len(records)
+            return line_number
+        block = b''.join(records)
+        self._pwrite(block, self._offset(line_number))
+        self._size += len(block)
+        return line_number
+
+    def _check_size(self, record: bytes) -> None:
+        if len(record) != self.record_size:
+            raise ValueError(f'Размер записи {len(record)} байт вместо {self.record_size}')
+
+    def _pwrite(self, data: bytes, offset: int) -> None:
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.flush()
+        if self.metrics is not None:
+            self.metrics.count('bytes_written', len(data))
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._pending is not None
+
+    def begin(self) -> None:
+        '''Начинает копить записи в памяти вместо записи в файл'''
+        self._pending = []
+
+    def pending_writes(self) -> list[tuple[int, bytes]]:
+        '''Накопленные записи транзакции: (смещение в файле, байты)'''
+        return self._pending or []
+
+    def apply(self) -> None:
+        '''Пишет накопленные записи в файл и заканчивает транзакцию'''
+        pending = self._pending or []
+        self.discard()
+        # Дописанные подряд записи объединяются в один блок
+        runs: list[tuple[int, list[bytes]]] = []
+        for offset, record in pending:
+            if runs and runs[-1][0] + len(runs[-1][1]) * self.record_size == offset:
+                runs[-1][1].append(record)
+            else:
+                runs.append((offset, [record]))
+        for offset, records in runs:
+            block = b''.join(records)
+            if offset + len(block) <= self._size:
+                self._write_at(offset, block)
+            else:
+                self._pwrite(block, offset)
+                self._size = max(self._size, offset + len(block))
+
+    def discard(self) -> None:
+        '''Заканчивает транзакцию, отбрасывая накопленные записи'''
+        self._pending = None
+        self._overlay = {}
+        self._appended = 0
+
+    def flush(self) -> None:
+        '''Сбрасывает измененные страницы отображения на диск'''
+        mapped = self._mapping[0]
+        if mapped is not None:
+            mapped.flush()
+
+    def sync(self) -> None:
+        '''Надежно сохраняет файл на диск: и отображение, и записанное мимо него'''
+        self.flush()
+        os.fsync(self._file.fileno())
+        if self.metrics is not None:
+            self.metrics.count('fsyncs')
+
+    def close(self) -> None:
+        mapped, view, _ = self._mapping
+        self._mapping = (None, None, 0)
+        if view is not None:
+            view.release()
+        if mapped is not None:
+            try:
+                mapped.close()
+            except BufferError:
+                # На отображение еще ссылаются срезы: его закроет сборщик мусора
+                pass
+        self._file.close()
+
+
+def encode_record(data: str, record_size: int = LINE_SIZE) -> bytes:
+    '''Кодирует строку в запись фиксированной длины (в байтах, а не символах)'''
+    record = data.encode('utf-8')
+    if len(record) >= record_size:
+        raise ValueError(f'Запись длиннее {record_size - 1} байт: {data[:50]}...')
+    return record.ljust(record_size - 1) + b'\n'
+
+
+def decode_fields(record: memoryview | bytes, maxsplit: int = -1) -> list[str]:
+    '''Декодирует запись фиксированной длины в список полей'''
+    if not isinstance(record, bytes):
+        record = bytes(record)
+    return record.rstrip().decode('utf-8').split(';', maxsplit)
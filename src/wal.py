@@ -0,0 +1,310 @@
+'''Журнал предзаписи (WAL) для атомарных изменений нескольких файлов.
+
+Операция, меняющая несколько файлов (например, продажа: запись автомобиля,
+новая продажа, журнал индекса продаж и счетчик модели), сначала копит свои
+записи в памяти, затем одной записью журнала сохраняет их все и только
+после fsync журнала пишет в сами файлы. Записи журнала физические: имя
+файла, смещение и байты, поэтому повторное применение безопасно, и после
+сбоя на любом шаге запуск сервиса доводит операцию до конца.
+
+Журнал общий для всех процессов, работающих с каталогом. Записав изменения
+в файлы, процесс дописывает в журнал короткую отметку о применении записи.
+Запись без такой отметки в конце журнала оставил процесс, упавший посреди
+операции: следующий писатель применяет ее (см. WriteAheadLog.recover), прежде
+чем дописывать свои записи или очищать журнал.
+
+Чтобы при частых операциях не платить за fsync каждой из них, операции,
+пришедшие из разных потоков, пока идет фиксация предыдущей группы,
+выполняются следующей группой с одной общей записью журнала и одним fsync.
+'''
+import os
+import struct
+import threading
+import zlib
+from collections.abc import Callable
+
+from metrics import Metrics
+
+# Заголовок записи: сигнатура, длина тела, контрольная сумма тела
+_RECORD = struct.Struct('<4sII')
+_RECORD_MAGIC = b'WAL1'
+# Отметка о применении записи: тело - смещение записи в журнале
+_APPLIED_MAGIC = b'WALA'
+_APPLIED = struct.Struct('<Q')
+_APPLIED_SIZE = _RECORD.size + _APPLIED.size
+# Заголовок изменения: длина имени файла, смещение, длина данных
+_WRITE = struct.Struct('<HQI')
+
+# Список файлов, которые подменяются готовыми копиями "<имя>.tmp"
+REPLACE_MANIFEST = 'replace.pending'
+
+
+def replace_files(root_directory_path: str, names: list[str]) -> None:
+    '''Атомарно подменяет группу файлов их копиями "<имя>.tmp".
+
+    Копии к этому моменту должны быть сохранены на диск. Сначала надежно
+    записывается список подменяемых файлов, затем выполняются подмены.
+    Если сбой прервет их посередине, finish_replace при следующем запуске
+    доделает оставшиеся, поэтому файлы группы не окажутся из разных версий.
+    '''
+    manifest = os.path.join(root_directory_path, REPLACE_MANIFEST)
+    with open(manifest + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(''.join(name + '\n' for name in names))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest + '.tmp', manifest)
+    _fsync_directory(root_directory_path)
+    finish_replace(root_directory_path)
+
+
+def finish_replace(root_directory_path: str) -> None:
+    '''Доделывает подмену файлов, прерванную сбоем; без списка подмен ничего не делает'''
+    manifest = os.path.join(root_directory_path, REPLACE_MANIFEST)
+    if not os.path.exists(manifest):
+        return
+    with open(manifest, 'r', encoding='utf-8') as f:
+        names = f.read().split()
+    for name in names:
+        path = os.path.join(root_directory_path, name)
+        if os.path.exists(path + '.tmp'):
+            os.replace(path + '.tmp', path)
+    _fsync_directory(root_directory_path)
+    os.remove(manifest)
+
+
+def _fsync_directory(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    '''Файл журнала предзаписи.
+
+    Запись журнала пишется одним вызовом write в режиме дозаписи и
+    проверяется контрольной суммой, поэтому оборванная при сбое запись
+    распознается и отбрасывается вместе с операцией, которую она описывала.
+
+    Журнал можно безопасно повторно применить к файлам, только пока их не
+    переписывали в обход журнала. Поэтому перед уплотнением индексов и
+    подменой файлов целиком вызывается checkpoint: файлы данных сохраняются
+    на диск, и журнал очищается.
+    '''
+
+    # Счетчики ввода-вывода (см. metrics); None - не считать
+    metrics: Metrics | None = None
+
+    def __init__(self, path: str, sync: bool = True) -> None:
+        self.path = path
+        # Без fsync операции остаются атомарными при падении процесса,
+        # но последние из них могут пропасть при отключении питания
+        self.sync = sync
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        # Смещение последней записи, зафиксированной или примененной этим объектом
+        self._last = 0
+
+    def size(self) -> int:
+        return os.fstat(self._fd).st_size
+
+    def commit(self, writes: list[tuple[str, int, bytes]]) -> None:
+        '''Надежно сохраняет набор изменений (имя файла, смещение, байты) одной записью'''
+        parts = []
+        for name, offset, data in writes:
+            encoded_name = name.encode('utf-8')
+            parts.append(_WRITE.pack(len(encoded_name), offset, len(data)))
+            parts.append(encoded_name)
+            parts.append(data)
+        body = b''.join(parts)
+        record = _RECORD.pack(_RECORD_MAGIC, len(body), zlib.crc32(body)) + body
+        os.write(self._fd, record)
+        # В режиме дозаписи позиция после write - конец только что записанной записи
+        self._last = os.lseek(self._fd, 0, os.SEEK_CUR) - len(record)
+        if self.sync:
+            os.fsync(self._fd)
+        if self.metrics is not None:
+            self.metrics.count('bytes_written', len(record))
+            self.metrics.count('fsyncs', self.sync)
+
+    def mark_applied(self) -> None:
+        '''Отмечает, что последняя зафиксированная запись применена к файлам.
+
+        Отметка пишется без fsync: если она пропадет вместе с питанием,
+        запуск сервиса все равно применит журнал целиком.
+        '''
+        body = _APPLIED.pack(self._last)
+        os.write(self._fd, _RECORD.pack(_APPLIED_MAGIC, len(body), zlib.crc32(body)) + body)
+        if self.metrics is not None:
+            self.metrics.count('bytes_written', _APPLIED_SIZE)
+
+    def unapplied(self) -> bool:
+        '''Есть ли в конце журнала запись без отметки о применении или оборванный хвост.
+
+        Проверка дешевая (fstat и чтение отметки), ее делает каждая транзакция.
+        '''
+        size = self.size()
+        if not size:
+            return False
+        tail = os.pread(self._fd, _APPLIED_SIZE, max(size - _APPLIED_SIZE, 0))
+        if len(tail) != _APPLIED_SIZE:
+            return True
+        magic, length, checksum = _RECORD.unpack_from(tail)
+        return not (magic == _APPLIED_MAGIC and length == _APPLIED.size
+                    and zlib.crc32(tail[_RECORD.size:]) == checksum)
+
+    def _scan(self) -> tuple[list[tuple[int, bytes, bytes]], int]:
+        '''Целые записи журнала (смещение, сигнатура, тело) и конец последней из них'''
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if self.metrics is not None:
+            self.metrics.count('file_opens')
+            self.metrics.count('bytes_read', len(data))
+        records = []
+        pos = 0
+        while pos + _RECORD.size <= len(data):
+            magic, length, checksum = _RECORD.unpack_from(data, pos)
+            body = data[pos + _RECORD.size:pos + _RECORD.size + length]
+            if magic not in (_RECORD_MAGIC, _APPLIED_MAGIC) or len(body) != length or zlib.crc32(body) != checksum:
+                break
+            records.append((pos, magic, body))
+            pos += _RECORD.size + length
+        return records, pos
+
+    @staticmethod
+    def _decode(body: bytes) -> list[tuple[str, int, bytes]]:
+        writes = []
+        body_pos = 0
+        while body_pos < len(body):
+            name_size, offset, data_size = _WRITE.unpack_from(body, body_pos)
+            body_pos += _WRITE.size
+            name = body[body_pos:body_pos + name_size].decode('utf-8')
+            body_pos += name_size
+            writes.append((name, offset, body[body_pos:body_pos + data_size]))
+            body_pos += data_size
+        return writes
+
+    def records(self) -> list[list[tuple[str, int, bytes]]]:
+        '''Читает целые записи журнала без отметок о применении; оборванный хвост отбрасывается'''
+        return [self._decode(body) for _, magic, body in self._scan()[0] if magic == _RECORD_MAGIC]
+
+    @staticmethod
+    def _write_files(root_directory_path: str, records: list[list[tuple[str, int, bytes]]]) -> None:
+        '''Пишет изменения записей в файлы каталога и сохраняет файлы на диск'''
+        touched: dict[str, int] = {}
+        try:
+            for writes in records:
+                for name, offset, data in writes:
+                    fd = touched.get(name)
+                    if fd is None:
+                        fd = os.open(os.path.join(root_directory_path, name), os.O_RDWR | os.O_CREAT, 0o644)
+                        touched[name] = fd
+                    os.pwrite(fd, data, offset)
+            for fd in touched.values():
+                os.fsync(fd)
+        finally:
+            for fd in touched.values():
+                os.close(fd)
+
+    def replay(self, root_directory_path: str) -> int:
+        '''Применяет записи журнала к файлам каталога и очищает журнал.
+
+        Возвращает число примененных записей.
+        '''
+        records = self.records()
+        self._write_files(root_directory_path, records)
+        self.truncate()
+        return len(records)
+
+    def recover(self, root_directory_path: str) -> bool:
+        '''Применяет последнюю запись журнала, если у нее нет отметки о применении.
+
+        Такую запись оставил процесс, упавший между фиксацией операции и
+        записью в файлы; оборванный хвост журнала отрезается. Вызывается под
+        исключительными блокировками всех файлов, которые меняют транзакции.
+        Возвращает, была ли применена запись.
+        '''
+        records, end = self._scan()
+        if end < self.size():
+            os.ftruncate(self._fd, end)
+        if not records or records[-1][1] != _RECORD_MAGIC:
+            return False
+        self._last, _, body = records[-1]
+        self._write_files(root_directory_path, [self._decode(body)])
+        self.mark_applied()
+        return True
+
+    def truncate(self) -> None:
+        '''Очищает журнал; файлы данных к этому моменту должны быть на диске'''
+        os.ftruncate(self._fd, 0)
+        if self.sync:
+            os.fsync(self._fd)
+            if self.metrics is not None:
+                self.metrics.count('fsyncs')
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class _Request:
+    __slots__ = ('call', 'files', 'result', 'error', 'done')
+
+    def __init__(self, call: Callable[[], object], files: tuple[str, ...]) -> None:
+        self.call = call
+        # Файлы, которые меняет операция
+        self.files = files
+        self.result = None
+        self.error: BaseException | None = None
+        self.done = False
+
+    def run(self) -> None:
+        '''Выполняет операцию, запоминая ее результат или исключение'''
+        try:
+            self.result = self.call()
+        except Exception as error:
+            self.error = error
+
+
+class GroupCommit:
+    '''Группировка операций для общей фиксации (схема "ведущий - ведомые").
+
+    Поток, заставший очередь свободной, становится ведущим: забирает все
+    накопившиеся операции и передает их в execute, которая выполняет их
+    подряд и фиксирует одной записью журнала. Остальные потоки ждут, пока
+    их операцию выполнит ведущий, и получают ее результат или исключение.
+    '''
+
+    def __init__(self, execute: Callable[[list[_Request]], None]) -> None:
+        self._execute = execute
+        self._cond = threading.Condition(threading.Lock())
+        self._queue: list[_Request] = []
+        self._leader = False
+
+    def submit(self, call: Callable[[], object], files: tuple[str, ...] = ()):
+        '''Выполняет call в составе ближайшей группы и возвращает ее результат'''
+        request = _Request(call, files)
+        with self._cond:
+            self._queue.append(request)
+            while self._leader and not request.done:
+                self._cond.wait()
+            batch = None
+            if not request.done:
+                self._leader = True
+                batch, self._queue = self._queue, []
+        if batch is not None:
+            try:
+                self._execute(batch)
+            except BaseException as error:
+                # Группа не зафиксирована: ошибка достается всем ее операциям
+                for item in batch:
+                    item.error = error
+                raise
+            finally:
+                with self._cond:
+                    for item in batch:
+                        item.done = True
+                    self._leader = False
+                    self._cond.notify_all()
+        if request.error is not None:
+            raise request.error
+        return request.result
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+
+from async_car_service import AsyncCarService
+from models import Car, CarStatus, Model, Sale
+
+
+def _car(vin: str) -> Car:
+    return Car(vin=vin, model=1, price=Decimal('2000'), date_start=datetime(2024, 2, 8),
+               status=CarStatus.available)
+
+
+def test_async_service_operations(tmpdir: str) -> None:
+    async def scenario() -> None:
+        async with AsyncCarService(tmpdir) as service:
+            await service.add_model(Model(id=1, name='Optima', brand='Kia'))
+            await asyncio.gather(*(service.add_car(_car(f'KNAGM4A77D531653{i}')) for i in range(3)))
+            await service.sell_car(Sale(sales_number='20240903#KNAGM4A77D5316530',
+                                        car_vin='KNAGM4A77D5316530',
+                                        sales_date=datetime(2024, 9, 3), cost=Decimal('1999.09')))
+
+            available = await service.get_cars(CarStatus.available)
+            assert sorted(car.vin for car in available) == ['KNAGM4A77D5316531', 'KNAGM4A77D5316532']
+            info = await service.get_car_info('KNAGM4A77D5316530')
+            assert info.status == CarStatus.sold
+            assert [stats.sales_number for stats in await service.top_models_by_sales()] == [1]
+
+            await service.update_vin('KNAGM4A77D5316530', 'KNAGM4A77D5316539')
+            assert await service.get_car_info('KNAGM4A77D5316530') is None
+            await service.revert_sale('20240903#KNAGM4A77D5316539')
+            info = await service.get_car_info('KNAGM4A77D5316539')
+            assert info.status == CarStatus.available
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_lookups_are_coalesced(tmpdir: str) -> None:
+    async def scenario() -> None:
+        async with AsyncCarService(tmpdir) as service:
+            await service.add_model(Model(id=1, name='Optima', brand='Kia'))
+            for i in range(3):
+                await service.add_car(_car(f'KNAGM4A77D531653{i}'))
+
+            calls = []
+            batch = service._car_info_batch
+
+            def counting_batch(vins):
+                calls.append(list(vins))
+                return batch(vins)
+            service._car_info_batch = counting_batch
+
+            vins = ['KNAGM4A77D5316530'] * 5 + ['KNAGM4A77D5316531', 'KNAGM4A77D5316532', 'missing']
+            infos = await asyncio.gather(*(service.get_car_info(vin) for vin in vins))
+            # Все запросы ушли одним заданием, одинаковые VIN прочитаны один раз
+            assert calls == [['KNAGM4A77D5316530', 'KNAGM4A77D5316531', 'KNAGM4A77D5316532', 'missing']]
+            assert [info.vin if info else None for info in infos] == vins[:-1] + [None]
+
+    asyncio.run(scenario())
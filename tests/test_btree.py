@@ -0,0 +1,137 @@
+import os
+import random
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from bibip_car_service import CarService
+from btree import BTreeIndex
+from indexes import SortedIndex
+from models import Car, CarStatus, Model, Sale
+
+
+def test_matches_dict_through_splits_and_merges(tmpdir: str) -> None:
+    path = os.path.join(tmpdir, 'cars_index.btree')
+    # Маленькие страницы: дерево в несколько уровней уже на сотнях ключей
+    index = BTreeIndex(path, page_size=256)
+    rng = random.Random(7)
+    expected: dict[str, int] = {}
+    for step in range(3000):
+        key = f'K{rng.randrange(600):05d}'
+        if rng.random() < 0.6:
+            index.insert(key, step)
+            expected[key] = step
+        else:
+            index.delete(key)
+            expected.pop(key, None)
+    assert list(index.items()) == sorted(expected.items())
+    assert len(index) == len(expected)
+    assert all(index.get(key) == line for key, line in expected.items())
+    assert index.get('K99999') is None
+
+    # Все ключи удалены: освобожденные страницы переиспользуются новыми
+    for key in list(expected):
+        index.delete(key)
+    pages = os.path.getsize(path)
+    index.insert_many([(f'N{i:05d}', i) for i in range(100)])
+    assert os.path.getsize(path) <= pages
+    reopened = BTreeIndex(path, page_size=256)
+    assert list(reopened.items()) == [(f'N{i:05d}', i) for i in range(100)]
+
+
+def test_range_iteration(tmpdir: str) -> None:
+    path = os.path.join(tmpdir, 'sales_date_index.btree')
+    BTreeIndex.create(path, [(f'{i:04d}', i) for i in range(0, 1000, 2)], page_size=256)
+    index = BTreeIndex(path, page_size=256)
+    assert list(index.keys_between('0010', '0020')) == ['0010', '0012', '0014', '0016', '0018']
+    assert list(index.keys_after('0993'))[:2] == ['0994', '0996']
+    assert next(index.keys_after()) == '0000'
+    index.rename('0010', '0011')
+    assert list(index.keys_between('0009', '0013')) == ['0011', '0012']
+
+
+def test_transaction_discard_and_refresh(tmpdir: str) -> None:
+    path = os.path.join(tmpdir, 'cars_index.btree')
+    writer = BTreeIndex(path, page_size=256)
+    reader = BTreeIndex(path, page_size=256)
+    writer.insert_many([(f'A{i:03d}', i) for i in range(50)])
+
+    writer.begin()
+    writer.insert_many([(f'B{i:03d}', i) for i in range(50)])
+    assert len(writer) == 100 and writer.pending_writes()
+    writer.discard()
+    assert len(writer) == 50 and writer.get('B000') is None
+
+    writer.begin()
+    writer.delete('A000')
+    writer.apply()
+    reader.refresh()
+    assert reader.get('A000') is None and len(reader) == 49
+
+
+def test_service_with_btree_indexes(tmpdir: str) -> None:
+    # Каталог с текстовыми индексами: B+-деревья строятся по ним при открытии
+    with CarService(tmpdir) as service:
+        service.add_model(Model(id=1, name='Optima', brand='Kia'))
+        service.add_car(Car(vin='KNAGM4A77D5316538', model=1, price=Decimal('2000'),
+                            date_start=datetime(2024, 2, 8), status=CarStatus.available))
+
+    with CarService(tmpdir, index_backend='btree') as service:
+        assert os.path.exists(os.path.join(tmpdir, 'cars_index.btree'))
+        service.add_car(Car(vin='5XYPH4A10GG021831', model=1, price=Decimal('2500'),
+                            date_start=datetime(2024, 2, 9), status=CarStatus.available))
+        service.sell_car(Sale(sales_number='20240903#KNAGM4A77D5316538', car_vin='KNAGM4A77D5316538',
+                              sales_date=datetime(2024, 9, 3), cost=Decimal('1999.09')))
+        service.update_vin('5XYPH4A10GG021831', '5XYPH4A10GG021832')
+        assert [car.vin for car in service.iter_cars()] == ['5XYPH4A10GG021832', 'KNAGM4A77D5316538']
+        assert service.get_car_info('KNAGM4A77D5316538').sales_cost == Decimal('1999.09')
+        service.revert_sale('20240903#KNAGM4A77D5316538')
+        assert service.compact()['rows_removed'] == 1
+        assert service.sales_between(datetime(2024, 1, 1), datetime(2025, 1, 1)) == []
+
+    with CarService(tmpdir, index_backend='btree') as service:
+        assert service.get_car_info('5XYPH4A10GG021832').car_model_name == 'Optima'
+        assert service.get_car_info('5XYPH4A10GG021831') is None
+
+
+def test_interrupted_add_model_with_btree_backend(tmpdir: str) -> None:
+    service = CarService(tmpdir, index_backend='btree')
+    assert isinstance(service.models_index, SortedIndex)
+    service.add_model(Model(id=1, name='Optima', brand='Kia'))
+
+    # Сбой посреди записи в журнал индекса моделей: в файле остается оборванная строка
+    def torn_append(entries: list[str]) -> None:
+        with open(service.models_index.journal_path, 'ab') as f:
+            f.write(f'I;{entries[0]}'[:5].encode())
+        raise OSError('сбой записи')
+
+    service.models_index.journal.append = torn_append
+    with pytest.raises(OSError):
+        service.add_model(Model(id=2, name='Sorento', brand='Kia'))
+
+    reopened = CarService(tmpdir, index_backend='btree')
+    assert list(reopened.models_index.items()) == [('1', 0)]
+    reopened.add_model(Model(id=2, name='Sorento', brand='Kia'))
+    reopened.add_car(Car(vin='KNAGM4A77D5316538', model=2, price=Decimal('2000'),
+                         date_start=datetime(2024, 2, 8), status=CarStatus.available))
+    reopened.close()
+    with CarService(tmpdir, index_backend='btree') as service:
+        assert [key for key, _ in service.models_index.items()] == ['1', '2']
+        assert service.get_car_info('KNAGM4A77D5316538').car_model_name == 'Sorento'
+
+
+def test_switching_back_to_sorted_backend_is_refused(tmpdir: str) -> None:
+    with CarService(tmpdir) as service:
+        service.add_model(Model(id=1, name='Optima', brand='Kia'))
+        service.add_car(Car(vin='KNAGM4A77D5316538', model=1, price=Decimal('2000'),
+                            date_start=datetime(2024, 2, 8), status=CarStatus.available))
+    with CarService(tmpdir, index_backend='btree') as service:
+        service.add_car(Car(vin='5XYPH4A10GG021831', model=1, price=Decimal('2500'),
+                            date_start=datetime(2024, 2, 9), status=CarStatus.available))
+
+    # Текстовые индексы не знают о втором автомобиле
+    with pytest.raises(ValueError, match='B\\+-деревьями'):
+        CarService(tmpdir)
+    with CarService(tmpdir, index_backend='btree') as service:
+        assert [car.vin for car in service.iter_cars()] == ['5XYPH4A10GG021831', 'KNAGM4A77D5316538']
@@ -0,0 +1,23 @@
+import time
+
+from cache import MISSING, LRUCache
+
+
+def test_lru_evicts_least_recently_used() -> None:
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'size': 2}
+
+
+def test_ttl_expires_values() -> None:
+    cache = LRUCache(10, ttl=0.05)
+    cache.put('a', None)
+    assert cache.get('a') is None
+    time.sleep(0.06)
+    assert cache.get('a') is MISSING
@@ -0,0 +1,57 @@
+import gc
+from datetime import datetime
+from decimal import Decimal
+
+from codec import decode_car, decode_cars, encode_car, gc_paused, parse_timestamp
+from models import Car, CarStatus
+
+
+def test_trusted_decode_matches_validated() -> None:
+    car = Car(
+        vin="KNAGM4A77D5316538",
+        model=1,
+        price=Decimal("2000.10"),
+        date_start=datetime(2024, 2, 8, 13, 5, 7),
+        status=CarStatus.reserve,
+    )
+    parts = encode_car(car).split(';')
+
+    assert decode_car(parts) == car
+    assert decode_car(parts, validate=True) == car
+
+
+def test_batch_decode_shares_fields_set() -> None:
+    cars = [
+        Car(vin=f"KNAGM4A77D531653{i}", model=i, price=Decimal("2000.10"),
+            date_start=datetime(2024, 2, 8, 13, 5, 7), status=CarStatus.available)
+        for i in range(2)
+    ]
+    decoded = decode_cars(encode_car(car).split(';') for car in cars)
+    assert decoded == cars
+    assert decoded[0].model_fields_set is decoded[1].model_fields_set
+
+    # Присваивание поля и model_copy работают как у обычной модели и не задевают соседей
+    decoded[0].status = CarStatus.sold
+    copy = decoded[1].model_copy(update={"price": Decimal("1")})
+    assert decoded[0].status == CarStatus.sold and decoded[1].status == CarStatus.available
+    assert copy.price == Decimal("1") and decoded[1].price == Decimal("2000.10")
+    assert decoded[0].model_dump(exclude_unset=True) == cars[0].model_copy(update={"status": CarStatus.sold}).model_dump()
+
+
+def test_parse_timestamp_falls_back_to_isoformat() -> None:
+    assert parse_timestamp("2024-02-08 13:05:07") == datetime(2024, 2, 8, 13, 5, 7)
+    assert parse_timestamp("2024-02-08 13:05:07.250000") == datetime(2024, 2, 8, 13, 5, 7, 250000)
+
+
+def test_overlapping_gc_pauses_restore_collector_once() -> None:
+    assert gc.isenabled()
+    with gc_paused(False):
+        assert gc.isenabled()
+    first, second = gc_paused(), gc_paused()
+    first.__enter__()
+    second.__enter__()
+    # Пауза, закончившаяся первой (например, в другом потоке), не включает сборщик раньше времени
+    first.__exit__(None, None, None)
+    assert not gc.isenabled()
+    second.__exit__(None, None, None)
+    assert gc.isenabled()
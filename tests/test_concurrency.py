@@ -0,0 +1,98 @@
+import random
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+from bibip_car_service import CarService
+from models import Car, CarStatus, Model, Sale
+
+THREADS = 8
+CARS_PER_THREAD = 60
+
+
+def _worker(service: CarService, worker_id: int, errors: list[BaseException]) -> None:
+    rnd = random.Random(worker_id)
+    try:
+        vins = []
+        for i in range(CARS_PER_THREAD):
+            vin = f"W{worker_id:02d}{i:014d}"
+            service.add_car(Car(
+                vin=vin,
+                model=rnd.randint(1, 5),
+                price=Decimal("1000") + i,
+                date_start=datetime(2024, 1, 1 + i % 28),
+                status=CarStatus.available,
+            ))
+            vins.append(vin)
+
+        sold: dict[str, str] = {}
+        for step in range(200):
+            vin = rnd.choice(vins)
+            action = rnd.random()
+            if action < 0.3 and vin not in sold:
+                sales_number = f"{step}#{vin}"
+                service.sell_car(Sale(
+                    sales_number=sales_number,
+                    car_vin=vin,
+                    sales_date=datetime(2024, 9, 1 + step % 28),
+                    cost=Decimal("1500"),
+                ))
+                sold[vin] = sales_number
+            elif action < 0.45 and vin in sold:
+                service.revert_sale(sold.pop(vin))
+            elif action < 0.55:
+                new_vin = "U" + vin[1:] if vin[0] != "U" else "W" + vin[1:]
+                service.update_vin(vin, new_vin)
+                vins[vins.index(vin)] = new_vin
+                if vin in sold:
+                    sold[new_vin] = sold.pop(vin).replace(vin, new_vin)
+            elif action < 0.75:
+                info = service.get_car_info(vin)
+                assert info is not None and info.vin == vin
+                assert (info.status == CarStatus.sold) == (vin in sold)
+            elif action < 0.85:
+                service.get_cars(CarStatus.available)
+            elif action < 0.95:
+                list(service.iter_cars(CarStatus.sold, limit=20))
+            else:
+                service.top_models_by_sales()
+    except BaseException as exc:  # noqa: BLE001 - ошибку проверит основной поток
+        errors.append(exc)
+
+
+def _check_consistency(service: CarService) -> None:
+    assert len(service.cars_index) == len(service.cars_store) == THREADS * CARS_PER_THREAD
+    statuses: dict[str, list[int]] = {}
+    for vin, line_number in service.cars_index.items():
+        car = service._read_car(line_number)
+        assert car.vin == vin
+        statuses.setdefault(car.status.value, []).append(line_number)
+    for status, lines in statuses.items():
+        assert service.status_index.lines(status) == sorted(lines)
+    for vin, line_number in service.sales_index.items():
+        sale = service.format.decode_sale(service.sales_store.read(line_number))
+        assert sale.car_vin == vin
+        assert service.get_car_info(vin).status == CarStatus.sold
+    assert len(service.sales_index) == len(statuses.get(CarStatus.sold.value, []))
+    assert service.rebuild_model_sales() == {}
+
+
+def test_concurrent_mixed_operations(tmpdir: str) -> None:
+    service = CarService(tmpdir)
+    service.add_models_bulk(Model(id=i, name=f"M{i}", brand="B") for i in range(1, 6))
+
+    errors: list[BaseException] = []
+    threads = [threading.Thread(target=_worker, args=(service, i, errors)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    _check_consistency(service)
+    top = service.top_models_by_sales(n=5)
+    service.close()
+
+    reopened = CarService(tmpdir)
+    _check_consistency(reopened)
+    assert reopened.top_models_by_sales(n=5) == top
@@ -0,0 +1,106 @@
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import wal
+from bibip_car_service import CarService
+from formats import BinaryFormat
+from migrate import migrate_to_binary
+from models import Car, CarStatus, Model, ModelSaleStats, Sale
+
+MODELS = [Model(id=1, name="Optima", brand="Kia"), Model(id=2, name="Sorento", brand="Kia")]
+CARS = [
+    Car(vin="KNAGM4A77D5316538", model=1, price=Decimal("2000"),
+        date_start=datetime(2024, 2, 8), status=CarStatus.available),
+    Car(vin="5XYPH4A10GG021831", model=2, price=Decimal("2300.50"),
+        date_start=datetime(2024, 2, 20, 10, 30, 15, 250), status=CarStatus.reserve),
+]
+SALE = Sale(sales_number="20240903#KNAGM4A77D5316538", car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3), cost=Decimal("2999.99"))
+
+
+def _fill(service: CarService) -> None:
+    service.add_models_bulk(MODELS)
+    for car in CARS:
+        service.add_car(car)
+    service.sell_car(SALE)
+
+
+def test_binary_format_round_trip(tmpdir: str) -> None:
+    service = CarService(tmpdir, storage_format="binary")
+    _fill(service)
+    service.close()
+
+    service = CarService(tmpdir, storage_format="binary")
+    info = service.get_car_info("KNAGM4A77D5316538")
+    assert info is not None
+    assert info.status == CarStatus.sold
+    assert info.sales_cost == SALE.cost
+    assert service.get_cars(CarStatus.reserve) == [CARS[1]]
+    assert str(service.get_cars(CarStatus.reserve)[0].price) == "2300.50"
+    assert os.path.getsize(service.cars_file) < 2 * 100
+
+
+def test_migrate_text_to_binary(tmpdir: str) -> None:
+    service = CarService(tmpdir)
+    _fill(service)
+    service.revert_sale(SALE.sales_number)
+    service.close()
+
+    with pytest.raises(ValueError):
+        CarService(tmpdir, storage_format="binary")
+
+    assert migrate_to_binary(tmpdir) == {"models": 2, "cars": 2, "sales": 1}
+
+    service = CarService(tmpdir, storage_format="binary")
+    assert service.get_cars(CarStatus.available) == [CARS[0]]
+    assert service.top_models_by_sales() == []
+    service.sell_car(SALE)
+    assert service.top_models_by_sales() == [ModelSaleStats(car_model_name="Optima", brand="Kia", sales_number=1)]
+    service.close()
+
+    # Оставшиеся текстовые файлы устарели: открыть каталог по ним нельзя
+    with pytest.raises(ValueError, match="бинарный формат"):
+        CarService(tmpdir)
+
+
+def test_migrate_survives_failures_midway(tmpdir: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    service = CarService(tmpdir)
+    _fill(service)
+    service.close()
+
+    # Сбой при переносе продаж: ни один файл еще не подменен, каталог остается текстовым
+    def broken_encode_sale(*args, **kwargs):
+        raise RuntimeError("сбой")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(BinaryFormat, "encode_sale", broken_encode_sale)
+        with pytest.raises(RuntimeError):
+            migrate_to_binary(tmpdir)
+    assert not os.path.exists(os.path.join(tmpdir, "cars.bin"))
+    assert CarService(tmpdir).get_car_info(CARS[0].vin).sales_cost == SALE.cost
+
+    # Сбой посреди подмены файлов: ее доделывает следующий запуск
+    real_replace = os.replace
+    calls = []
+
+    def broken_replace(source: str, target: str) -> None:
+        calls.append(target)
+        if len(calls) == 3:
+            raise OSError("сбой")
+        real_replace(source, target)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(wal.os, "replace", broken_replace)
+        with pytest.raises(OSError):
+            migrate_to_binary(tmpdir)
+    assert os.path.exists(os.path.join(tmpdir, wal.REPLACE_MANIFEST))
+
+    service = CarService(tmpdir, storage_format="binary")
+    assert service.get_car_info(CARS[0].vin).sales_cost == SALE.cost
+    assert service.get_cars(CarStatus.reserve) == [CARS[1]]
+    # Базы индексов переписаны без выравнивания строк
+    with open(os.path.join(tmpdir, "models_index.txt"), "rb") as f:
+        assert f.read() == b"1;0\n2;1\n"
@@ -0,0 +1,55 @@
+import os
+
+from bloom import BloomFilter
+from indexes import ChangeLog, SortedIndex
+
+
+def test_journal_replay_and_compaction(tmpdir: str) -> None:
+    path = os.path.join(tmpdir, 'cars_index.txt')
+    index = SortedIndex(path, compact_min_entries=6)
+
+    index.insert('C', 0)
+    index.insert('A', 1)
+    index.rename('C', 'B')
+    # Индекс еще не уплотнялся: все изменения пока только в журнале
+    assert not os.path.exists(path)
+    assert list(SortedIndex(path).items()) == [('A', 1), ('B', 0)]
+
+    index.insert('D', 2)
+    index.delete('A')
+    # После уплотнения в журнале нет записей, а база отсортирована
+    assert index.journal.entries == 0
+    assert ChangeLog(index.journal_path).read_new() == []
+    assert list(index.items()) == [('B', 0), ('D', 2)]
+    assert list(SortedIndex(path).items()) == [('B', 0), ('D', 2)]
+
+
+def test_refresh_reads_journal_tail(tmpdir: str) -> None:
+    path = os.path.join(tmpdir, 'cars_index.txt')
+    writer = SortedIndex(path, compact_min_entries=4)
+    reader = SortedIndex(path, compact_min_entries=4)
+
+    writer.insert('B', 0)
+    writer.insert('A', 1)
+    reader.refresh()
+    assert list(reader.items()) == [('A', 1), ('B', 0)]
+
+    # Уплотнение подменяет журнал: читатель замечает это и перечитывает базу
+    writer.delete('B')
+    writer.insert('C', 2)
+    reader.refresh()
+    assert list(reader.items()) == [('A', 1), ('C', 2)]
+
+
+def test_bloom_filter_has_no_false_negatives(tmpdir: str) -> None:
+    path = os.path.join(tmpdir, 'cars_bloom.bin')
+    BloomFilter.create(path, (f'VIN{i}' for i in range(500)), 1000)
+    bloom = BloomFilter(path)
+    bloom.add_many(['NEW1', 'NEW2'])
+
+    reopened = BloomFilter(path)
+    assert all(f'VIN{i}' in reopened for i in range(500))
+    assert 'NEW1' in reopened and 'NEW2' in reopened
+    assert reopened.count == 502
+    # При 10 битах на ключ ложных срабатываний около процента
+    assert sum(f'OTHER{i}' in reopened for i in range(1000)) < 50
@@ -0,0 +1,95 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from bibip_car_service import CarService
+from metrics import LATENCY_BUCKETS, Metrics
+from models import Car, CarStatus, Model, Sale
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    metrics = Metrics()
+    metrics.observe('op', 0.00005)
+    metrics.observe('op', 0.003)
+    metrics.observe('op', 100.0, failed=True)
+
+    stats = metrics.snapshot()['operations']['op']
+    assert stats['count'] == 3 and stats['errors'] == 1
+    assert stats['buckets'][LATENCY_BUCKETS[0]] == 1
+    assert stats['buckets'][0.005] == 2
+    assert stats['buckets'][float('inf')] == 3
+
+
+def test_timed_records_failures() -> None:
+    metrics = Metrics()
+
+    def fail() -> None:
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        metrics.timed('fail', fail)()
+    assert metrics.timed('ok', lambda: 1)() == 1
+    operations = metrics.snapshot()['operations']
+    assert operations['fail']['errors'] == 1 and operations['ok']['errors'] == 0
+
+
+def test_service_metrics(tmpdir: str) -> None:
+    service = CarService(tmpdir, metrics=True)
+    service.add_model(Model(id=1, name='Optima', brand='Kia'))
+    service.add_car(Car(vin='KNAGM4A77D5316538', model=1, price=Decimal('2000'),
+                        date_start=datetime(2024, 2, 8), status=CarStatus.available))
+    service.sell_car(Sale(sales_number='20240903#KNAGM4A77D5316538', car_vin='KNAGM4A77D5316538',
+                          sales_date=datetime(2024, 9, 3), cost=Decimal('1999.09')))
+    assert service.get_car_info('KNAGM4A77D5316538').sales_cost == Decimal('1999.09')
+    assert [car.vin for car in service.get_cars(CarStatus.sold)] == ['KNAGM4A77D5316538']
+    assert len(service.sales_between(datetime(2024, 9, 1), datetime(2024, 10, 1))) == 1
+
+    data = service.metrics()
+    operations = data['operations']
+    for name in ('add_model', 'add_car', 'sell_car', 'get_car_info', 'get_cars', 'commit_batch', 'wal_commit'):
+        assert operations[name]['count'] >= 1, name
+    assert operations['sell_car']['errors'] == 0
+    io = data['io']
+    assert io['bytes_written'] > 0 and io['bytes_read'] > 0 and io['fsyncs'] > 0
+    assert io['index_entries_scanned'] >= 1
+
+    text = service.metrics_prometheus()
+    assert 'bibip_operation_seconds_bucket{operation="sell_car",le="+Inf"} 1' in text
+    assert '# TYPE bibip_fsyncs_total counter' in text
+    service.close()
+
+
+def test_io_counted_after_rebuilds(tmpdir: str) -> None:
+    service = CarService(tmpdir, metrics=True)
+    service.add_model(Model(id=1, name='Optima', brand='Kia'))
+    service.add_car(Car(vin='KNAGM4A77D5316538', model=1, price=Decimal('2000'),
+                        date_start=datetime(2024, 2, 8), status=CarStatus.available))
+    service.sell_car(Sale(sales_number='20240903#KNAGM4A77D5316538', car_vin='KNAGM4A77D5316538',
+                          sales_date=datetime(2024, 9, 3), cost=Decimal('1999.09')))
+    service.add_car(Car(vin='5XYPH4A10GG021831', model=1, price=Decimal('2500'),
+                        date_start=datetime(2024, 2, 9), status=CarStatus.available))
+    service.sell_car(Sale(sales_number='20240904#5XYPH4A10GG021831', car_vin='5XYPH4A10GG021831',
+                          sales_date=datetime(2024, 9, 4), cost=Decimal('2400')))
+    service.revert_sale('20240903#KNAGM4A77D5316538')
+
+    io = service.metrics()['io']
+    service.rebuild_model_sales()
+    assert service.compact()['rows_removed'] == 1
+    rebuilt = service.metrics()['io']
+    # Файлы, переписанные целиком, тоже посчитаны
+    assert rebuilt['bytes_written'] > io['bytes_written']
+
+    # Новый файл счетчиков считается дальше
+    service.model_sales.refresh()
+    assert service.metrics()['io']['bytes_read'] > rebuilt['bytes_read']
+    assert service.model_sales.store.metrics is not None
+    service.close()
+
+
+def test_metrics_disabled_by_default(tmpdir: str) -> None:
+    with CarService(tmpdir) as service:
+        assert 'add_car' not in vars(service)
+        service.add_model(Model(id=1, name='Optima', brand='Kia'))
+        assert service.metrics() == {}
+        assert service.metrics_prometheus() == ''
@@ -0,0 +1,141 @@
+import multiprocessing
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from bibip_car_service import CarService
+from locks import fcntl
+from models import Car, CarStatus, Model, Sale
+
+pytestmark = pytest.mark.skipif(fcntl is None, reason='нет fcntl')
+
+CARS_PER_PROCESS = 100
+
+
+def _add_cars(root: str, prefix: str) -> None:
+    with CarService(root) as service:
+        for i in range(CARS_PER_PROCESS):
+            service.add_car(Car(
+                vin=f'{prefix}{i:016d}',
+                model=1,
+                price=Decimal('1000'),
+                date_start=datetime(2024, 1, 1),
+                status=CarStatus.available,
+            ))
+
+
+def _sell_and_rename(root: str) -> None:
+    with CarService(root) as service:
+        service.sell_car(Sale(
+            sales_number='20240901#P0000000000000001',
+            car_vin='P0000000000000001',
+            sales_date=datetime(2024, 9, 1),
+            cost=Decimal('1500'),
+        ))
+        service.update_vin('P0000000000000002', 'R0000000000000002')
+
+
+def _run(target, *args) -> None:
+    process = multiprocessing.get_context('fork').Process(target=target, args=args)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+
+def test_concurrent_writers_do_not_overlap(tmpdir: str) -> None:
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_add_cars, args=(tmpdir, prefix)) for prefix in 'XY']
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    with CarService(tmpdir) as service:
+        assert len(service.cars_store) == 2 * CARS_PER_PROCESS
+        cars = service.get_cars(CarStatus.available)
+        assert {car.vin for car in cars} == {
+            f'{prefix}{i:016d}' for prefix in 'XY' for i in range(CARS_PER_PROCESS)
+        }
+
+
+def test_reader_sees_changes_of_other_process(tmpdir: str) -> None:
+    service = CarService(tmpdir)
+    service.add_model(Model(id=1, name='Optima', brand='Kia'))
+    for i in range(1, 4):
+        service.add_car(Car(
+            vin=f'P{i:016d}',
+            model=1,
+            price=Decimal('1000'),
+            date_start=datetime(2024, 1, 1),
+            status=CarStatus.available,
+        ))
+
+    # Продажу и смену VIN делает другой процесс
+    _run(_sell_and_rename, tmpdir)
+
+    assert [car.vin for car in service.get_cars(CarStatus.sold)] == ['P0000000000000001']
+    assert [car.vin for car in service.get_cars(CarStatus.available)] == [
+        'R0000000000000002', 'P0000000000000003'
+    ]
+    assert service.get_car_info('P0000000000000002') is None
+    info = service.get_car_info('P0000000000000001')
+    assert info is not None and info.sales_cost == Decimal('1500')
+    assert [stats.sales_number for stats in service.top_models_by_sales()] == [1]
+
+    # И наоборот: запись этого процесса видна новому экземпляру
+    service.revert_sale('20240901#P0000000000000001')
+    with CarService(tmpdir) as other:
+        assert other.get_car_info('P0000000000000001').status == CarStatus.available
+    assert service.top_models_by_sales() == []
+    service.close()
+
+
+def _sell_and_crash(root: str) -> None:
+    service = CarService(root)
+    # Процесс умирает после fsync журнала предзаписи, не записав ничего в файлы
+    service.cars_store.apply = lambda: os._exit(1)
+    service.sell_car(Sale(
+        sales_number='20240901#P0000000000000001',
+        car_vin='P0000000000000001',
+        sales_date=datetime(2024, 9, 1),
+        cost=Decimal('1500'),
+    ))
+
+
+def test_operation_of_dead_process_is_finished_before_next_commit(tmpdir: str) -> None:
+    service = CarService(tmpdir)
+    service.add_model(Model(id=1, name='Optima', brand='Kia'))
+    for i in range(1, 3):
+        service.add_car(Car(
+            vin=f'P{i:016d}',
+            model=1,
+            price=Decimal('1000'),
+            date_start=datetime(2024, 1, 1),
+            status=CarStatus.available,
+        ))
+
+    process = multiprocessing.get_context('fork').Process(target=_sell_and_crash, args=(tmpdir,))
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+
+    # Живой процесс продает другой автомобиль: его продажа не должна занять строку упавшей
+    service.sell_car(Sale(
+        sales_number='20240902#P0000000000000002',
+        car_vin='P0000000000000002',
+        sales_date=datetime(2024, 9, 2),
+        cost=Decimal('1600'),
+    ))
+    service.close()
+
+    with CarService(tmpdir) as reopened:
+        assert [car.vin for car in reopened.get_cars(CarStatus.sold)] == [
+            'P0000000000000001', 'P0000000000000002'
+        ]
+        assert reopened.get_car_info('P0000000000000001').sales_cost == Decimal('1500')
+        assert reopened.get_car_info('P0000000000000002').sales_cost == Decimal('1600')
+        assert len(reopened.sales_between(datetime(2024, 1, 1), datetime(2025, 1, 1))) == 2
+        assert reopened.model_sales.get(1) == 2
@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from bibip_car_service import CarService, _scan_car_statuses
+from models import Car, CarStatus, Model, Sale
+from parallel import ScanEngine, split_ranges
+
+
+def test_split_ranges_covers_all_lines() -> None:
+    assert split_ranges(10, 3) == [(0, 4), (4, 8), (8, 10)]
+    assert split_ranges(2, 8) == [(0, 1), (1, 2)]
+    assert split_ranges(0, 4) == []
+
+
+@pytest.mark.parametrize('storage_format', ['text', 'binary'])
+def test_parallel_scans_match_sequential(tmpdir: str, storage_format: str) -> None:
+    service = CarService(tmpdir, storage_format=storage_format)
+    service.add_models_bulk([Model(id=i, name=f'M{i}', brand='B') for i in range(1, 4)])
+    service.add_cars_bulk([
+        Car(vin=f'VIN{i:04d}', model=i % 3 + 1, price=Decimal(1000 + i), date_start=datetime(2024, 1, 1),
+            status=CarStatus.available)
+        for i in range(40)
+    ])
+    service.sell_cars_bulk([
+        Sale(sales_number=f'S{i}', car_vin=f'VIN{i:04d}', sales_date=datetime(2024, 2, 1 + i),
+             cost=Decimal(900))
+        for i in range(0, 20, 2)
+    ])
+    service.revert_sale('S4')
+    service.close()
+
+    # Порог 0: все просмотры идут в пуле из трех процессов
+    with CarService(tmpdir, storage_format=storage_format, parallel_scan_bytes=0, scan_workers=3) as parallel:
+        assert [car.vin for car in parallel.get_cars(CarStatus.sold)] == [
+            f'VIN{i:04d}' for i in range(0, 20, 2) if i != 4]
+        assert parallel.rebuild_model_sales() == {}
+        assert parallel.compact()['rows_removed'] == 1
+        assert parallel.get_sale('S18').car_vin == 'VIN0018'
+
+
+def _scan_after_fork(root: str, engine: ScanEngine) -> None:
+    # Унаследованный пул и forkserver родителя этому процессу не годятся
+    with CarService(root, parallel_scan_bytes=0, scan_workers=2) as service:
+        statuses = engine.map(service.cars_store, _scan_car_statuses, 'text', False)
+        ok = sum(statuses, []) == [(0, 'available'), (1, 'sold')]
+        ok = ok and [car.vin for car in service.get_cars(CarStatus.sold)] == ['VIN0001']
+    engine.close()
+    os._exit(0 if ok else 1)
+
+
+def test_parallel_scan_after_fork(tmpdir: str) -> None:
+    service = CarService(tmpdir, parallel_scan_bytes=0, scan_workers=2)
+    service.add_model(Model(id=1, name='M1', brand='B'))
+    service.add_cars_bulk([
+        Car(vin=f'VIN{i:04d}', model=1, price=Decimal(1000), date_start=datetime(2024, 1, 1),
+            status=CarStatus.available)
+        for i in range(2)
+    ])
+    service.sell_car(Sale(sales_number='S1', car_vin='VIN0001', sales_date=datetime(2024, 2, 1), cost=Decimal(900)))
+    engine = ScanEngine(0, 2)
+    assert sum(engine.map(service.cars_store, _scan_car_statuses, 'text', False), []) == [
+        (0, 'available'), (1, 'sold')]
+    assert [car.vin for car in service.get_cars(CarStatus.sold)] == ['VIN0001']
+
+    process = multiprocessing.get_context('fork').Process(target=_scan_after_fork, args=(tmpdir, engine))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    engine.close()
+    service.close()
@@ -1,3 +1,4 @@
+import os
 from datetime import datetime
 from decimal import Decimal
 
@@ -290,3 +291,313 @@ class TestCarServiceScenarios:
             ModelSaleStats(car_model_name="Pathfinder", brand="Nissan", sales_number=1),
         ]
         assert service.top_models_by_sales() == top_3_models
+
+    def test_reopen_service(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        service.update_vin("KNAGM4A77D5316538", "UPDGM4A77D5316538")
+
+        reopened = CarService(tmpdir)
+        assert reopened.get_car_info("KNAGM4A77D5316538") is None
+        info = reopened.get_car_info("UPDGM4A77D5316538")
+        assert info is not None
+        assert info.car_model_name == "Optima"
+
+        with pytest.raises(ValueError):
+            reopened.add_car(car_data[1])
+
+    def test_bulk_load_and_sell(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        service.add_models_bulk(model_data)
+        service.add_cars_bulk(car_data)
+
+        with pytest.raises(ValueError):
+            service.add_cars_bulk([car_data[0]])
+
+        sales = [
+            Sale(
+                sales_number="20240903#KNAGM4A77D5316538",
+                car_vin="KNAGM4A77D5316538",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1999.09"),
+            ),
+            Sale(
+                sales_number="20240903#JM1BL1M58C1614725",
+                car_vin="JM1BL1M58C1614725",
+                sales_date=datetime(2024, 9, 6),
+                cost=Decimal("2334"),
+            ),
+        ]
+        sold = service.sell_cars_bulk(sales)
+
+        assert [car.vin for car in sold] == ["KNAGM4A77D5316538", "JM1BL1M58C1614725"]
+        info = service.get_car_info("JM1BL1M58C1614725")
+        assert info is not None
+        assert info.status == CarStatus.sold
+        assert info.sales_cost == Decimal("2334")
+        assert service.get_cars(CarStatus.available) == [
+            car for car in car_data if car.status == CarStatus.available and car.vin != "KNAGM4A77D5316538"
+        ]
+
+    def test_status_index_follows_transitions(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        available_cars = [car for car in car_data if car.status == CarStatus.available]
+        sale = Sale(
+            sales_number="20240903#KNAGH4A48A5414970",
+            car_vin="KNAGH4A48A5414970",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("2100"),
+        )
+        service.sell_car(sale)
+
+        assert [car.vin for car in service.get_cars(CarStatus.sold)] == ["KNAGH4A48A5414970"]
+        assert "KNAGH4A48A5414970" not in [car.vin for car in service.get_cars(CarStatus.available)]
+        assert CarService(tmpdir).get_cars(CarStatus.sold) == service.get_cars(CarStatus.sold)
+
+        service.revert_sale(sale.sales_number)
+
+        assert service.get_cars(CarStatus.sold) == []
+        assert service.get_cars(CarStatus.available) == available_cars
+
+    def test_iter_cars_pages_in_vin_order(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        available_cars = sorted(
+            (car for car in car_data if car.status == CarStatus.available), key=lambda car: car.vin
+        )
+        pages = []
+        after_vin = None
+        while True:
+            page = list(service.iter_cars(CarStatus.available, after_vin=after_vin, limit=3))
+            if not page:
+                break
+            pages.append(page)
+            after_vin = page[-1].vin
+
+        assert [len(page) for page in pages] == [3, 3, 2]
+        assert [car for page in pages for car in page] == available_cars
+        assert len(list(service.iter_cars())) == len(car_data)
+
+    def test_top_models_skip_reverted_sales(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        sales = [
+            Sale(
+                sales_number="20240903#KNAGM4A77D5316538",
+                car_vin="KNAGM4A77D5316538",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1999.09"),
+            ),
+            Sale(
+                sales_number="20240903#JM1BL1M58C1614725",
+                car_vin="JM1BL1M58C1614725",
+                sales_date=datetime(2024, 9, 6),
+                cost=Decimal("2334"),
+            ),
+            Sale(
+                sales_number="20240903#JM1BL1L83C1660152",
+                car_vin="JM1BL1L83C1660152",
+                sales_date=datetime(2024, 9, 7),
+                cost=Decimal("451"),
+            ),
+        ]
+        for sale in sales:
+            service.sell_car(sale)
+        service.revert_sale("20240903#JM1BL1L83C1660152")
+
+        expected = [
+            ModelSaleStats(car_model_name="Optima", brand="Kia", sales_number=1),
+            ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=1),
+        ]
+        assert service.top_models_by_sales() == expected
+        assert service.rebuild_model_sales() == {}
+        assert CarService(tmpdir).top_models_by_sales(n=1) == expected[:1]
+
+    def test_update_vin_of_sold_car_patches_only_its_sale(
+        self, tmpdir: str, car_data: list[Car], model_data: list[Model]
+    ):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(
+            sales_number="20240903#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("1999.09"),
+        ))
+
+        # Смена VIN не должна просматривать файл продаж
+        def no_scan():
+            raise AssertionError("файл продаж просматривается целиком")
+        service.sales_store.scan = no_scan
+        service.update_vin("KNAGM4A77D5316538", "UPDGM4A77D5316538")
+
+        info = service.get_car_info("UPDGM4A77D5316538")
+        assert info is not None
+        assert info.sales_cost == Decimal("1999.09")
+        del service.sales_store.scan
+        service.revert_sale("20240903#UPDGM4A77D5316538")
+        assert service.get_car_info("UPDGM4A77D5316538").status == CarStatus.available
+
+    def test_get_sale_by_number(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        sale = Sale(
+            sales_number="20240903#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("1999.09"),
+        )
+        service.sell_car(sale)
+        assert service.get_sale("20240903#KNAGM4A77D5316538") == sale
+        assert service.get_sale("unknown") is None
+
+        service.update_vin("KNAGM4A77D5316538", "UPDGM4A77D5316538")
+        assert service.get_sale("20240903#KNAGM4A77D5316538") is None
+        assert service.get_sale("20240903#UPDGM4A77D5316538").car_vin == "UPDGM4A77D5316538"
+
+        # В каталоге без индекса номеров продаж он строится по файлу продаж
+        service.close()
+        os.remove(os.path.join(tmpdir, "sales_number_index.txt"))
+        reopened = CarService(tmpdir)
+        assert reopened.get_sale("20240903#UPDGM4A77D5316538").cost == Decimal("1999.09")
+        reopened.revert_sale("20240903#UPDGM4A77D5316538")
+        assert reopened.get_sale("20240903#UPDGM4A77D5316538") is None
+        with pytest.raises(ValueError):
+            reopened.revert_sale("20240903#UPDGM4A77D5316538")
+
+    def test_compact_removes_reverted_sales(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        vins = ["KNAGM4A77D5316538", "JM1BL1M58C1614725", "JM1BL1L83C1660152"]
+        for day, vin in enumerate(vins, start=3):
+            service.sell_car(Sale(
+                sales_number=f"202409{day:02d}#{vin}",
+                car_vin=vin,
+                sales_date=datetime(2024, 9, day),
+                cost=Decimal("1000"),
+            ))
+        service.revert_sale("20240903#KNAGM4A77D5316538")
+        service.revert_sale("20240905#JM1BL1L83C1660152")
+
+        report = service.compact()
+        assert report["rows_removed"] == 2
+        assert report["bytes_reclaimed"] > 0
+        assert os.path.getsize(service.sales_file) == 501
+        assert service.compact()["rows_removed"] == 0
+
+        # Индексы указывают на новые номера строк и после перезапуска
+        for checked in (service, CarService(tmpdir)):
+            assert checked.get_sale("20240904#JM1BL1M58C1614725").car_vin == "JM1BL1M58C1614725"
+            assert checked.get_car_info("JM1BL1M58C1614725").sales_cost == Decimal("1000")
+            assert checked.get_car_info("KNAGM4A77D5316538").sales_date is None
+        service.revert_sale("20240904#JM1BL1M58C1614725")
+        assert service.get_car_info("JM1BL1M58C1614725").status == CarStatus.available
+
+    def test_missing_bloom_filters_are_rebuilt(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.close()
+        os.remove(os.path.join(tmpdir, "cars_bloom.bin"))
+
+        reopened = CarService(tmpdir)
+        assert all(car.vin in reopened.cars_filter for car in car_data)
+        with pytest.raises(ValueError):
+            reopened.add_car(car_data[0])
+        # Промах фильтра - точный ответ, индекс не нужен
+        assert "NOSUCHSALE" not in reopened.sales_number_filter
+        assert reopened.get_sale("NOSUCHSALE") is None
+
+    def test_root_directory_name_with_index_suffix(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        root = os.path.join(tmpdir, "data_index_dir")
+        os.makedirs(root)
+        service = CarService(root)
+        self._fill_initial_data(service, car_data, model_data)
+        service.close()
+
+        assert sorted(name for name in os.listdir(root) if name.endswith("_bloom.bin")) == [
+            "cars_bloom.bin", "models_bloom.bin", "sales_number_bloom.bin"]
+        assert CarService(root).get_car_info("KNAGM4A77D5316538") is not None
+
+    def test_car_info_cache_is_invalidated_by_writes(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        vin = "JM1BL1M58C1614725"
+
+        assert service.get_car_info(vin).status == CarStatus.reserve
+        assert service.get_car_info(vin).status == CarStatus.reserve
+        assert service.cache_stats()["car_info"]["hits"] == 1
+
+        service.sell_car(Sale(
+            sales_number=f"20240903#{vin}", car_vin=vin, sales_date=datetime(2024, 9, 3), cost=Decimal("100"),
+        ))
+        assert service.get_car_info(vin).sales_cost == Decimal("100")
+        service.update_vin(vin, "NEWVIN0000000001")
+        assert service.get_car_info(vin) is None
+        assert service.get_car_info("NEWVIN0000000001").status == CarStatus.sold
+        service.revert_sale("20240903#NEWVIN0000000001")
+        assert service.get_car_info("NEWVIN0000000001").status == CarStatus.available
+        # Изменения копии не попадают в кэш
+        service.get_car_info("NEWVIN0000000001").price = Decimal("1")
+        assert service.get_car_info("NEWVIN0000000001").price == Decimal("2549.10")
+
+    def test_get_car_info_many_keeps_request_order(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, info_cache_size=0)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(
+            sales_number="20240903#5XYPH4A10GG021831", car_vin="5XYPH4A10GG021831",
+            sales_date=datetime(2024, 9, 3), cost=Decimal("100"),
+        ))
+
+        vins = [car.vin for car in reversed(car_data)] + ["UNKNOWN", car_data[1].vin]
+        expected = [service.get_car_info(vin) for vin in vins]
+        assert service.get_car_info_many(vins) == expected
+        assert expected[-1].sales_cost == Decimal("100")
+        assert expected[-2] is None
+
+    def test_sales_analytics_by_date_range(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        # VIN, дата, сумма: модели 1 (Kia), 3 (Mazda), 3, 1
+        sold = [
+            ("KNAGM4A77D5316538", datetime(2024, 9, 1, 10), Decimal("100")),
+            ("JM1BL1M58C1614725", datetime(2024, 9, 2, 11), Decimal("200")),
+            ("JM1BL1L83C1660152", datetime(2024, 9, 2, 12), Decimal("300")),
+            ("KNAGH4A48A5414970", datetime(2024, 9, 4, 9), Decimal("400")),
+        ]
+        for vin, sales_date, cost in reversed(sold):
+            service.sell_car(Sale(sales_number=f"{sales_date:%Y%m%d}#{vin}", car_vin=vin,
+                                  sales_date=sales_date, cost=cost))
+
+        start, end = datetime(2024, 9, 2), datetime(2024, 9, 4, 9)
+        assert [sale.car_vin for sale in service.sales_between(start, end)] == [
+            "JM1BL1M58C1614725", "JM1BL1L83C1660152"]
+        assert service.sales_revenue(datetime(2024, 9, 1), datetime(2024, 9, 5)) == Decimal("1000")
+        assert service.sales_by_day(datetime(2024, 9, 1), datetime(2024, 9, 3)) == {
+            datetime(2024, 9, 1).date(): (1, Decimal("100")),
+            datetime(2024, 9, 2).date(): (2, Decimal("500")),
+        }
+        assert service.sales_count_by_model(start, end) == {3: 2}
+        assert service.sales_count_by_brand(datetime(2024, 9, 1), datetime(2024, 9, 5)) == {"Kia": 2, "Mazda": 2}
+        top = service.top_models_by_sales(1, start=start)
+        assert [(item.car_model_name, item.sales_number) for item in top] == [("3", 2)]
+
+        # Отмена и смена VIN поддерживают индекс дат, в том числе после перезапуска
+        service.revert_sale("20240902#JM1BL1M58C1614725")
+        service.update_vin("JM1BL1L83C1660152", "NEWVIN0000000001")
+        for checked in (service, CarService(tmpdir)):
+            assert [sale.sales_number for sale in checked.sales_between(start, end)] == ["20240902#NEWVIN0000000001"]
+        os.remove(service.sales_date_index_file)
+        assert len(CarService(tmpdir).sales_between(datetime(2024, 9, 1), datetime(2024, 9, 5))) == 3
@@ -0,0 +1,58 @@
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from bibip_car_service import CarService
+from formats import STATUS_CODES
+from models import Car, CarStatus, Model, Sale
+
+np = pytest.importorskip('numpy')
+
+from snapshot import InventorySnapshot  # noqa: E402
+
+
+def _car(vin: str, model: int, price: str, day: int) -> Car:
+    return Car(vin=vin, model=model, price=Decimal(price), date_start=datetime(2024, 1, day),
+               status=CarStatus.available)
+
+
+def test_snapshot_aggregates_and_refreshes_incrementally(tmpdir: str) -> None:
+    service = CarService(tmpdir)
+    service.add_model(Model(id=1, name="Optima", brand="Kia"))
+    service.add_model(Model(id=2, name="3", brand="Mazda"))
+    service.add_car(_car("VIN1", 1, "1000", 1))
+    service.add_car(_car("VIN2", 1, "2000.50", 2))
+    service.add_car(_car("VIN3", 2, "3000", 3))
+
+    snapshot = service.inventory_snapshot()
+    assert snapshot.average_price_by_model() == {1: Decimal("1500.25"), 2: Decimal("3000")}
+    assert snapshot.age_histogram([0, 30, 365], now=datetime(2024, 1, 31)) == [2, 1]
+
+    service.sell_car(Sale(sales_number="S1", car_vin="VIN1", sales_date=datetime(2024, 2, 1), cost=Decimal("900")))
+    service.sell_car(Sale(sales_number="S2", car_vin="VIN3", sales_date=datetime(2024, 2, 2), cost=Decimal("2500")))
+    service.add_car(_car("VIN4", 2, "4000", 4))
+    service.revert_sale("S2")
+    service.refresh_snapshot(snapshot)
+
+    assert snapshot.car_count == 4
+    counts = snapshot.count_by_status()
+    assert counts[CarStatus.available] == 3 and counts[CarStatus.sold] == 1
+    # Коды статусов в столбце - фиксированные коды бинарного формата
+    assert snapshot.cars["status"].tolist() == [STATUS_CODES[CarStatus.sold]] + [STATUS_CODES[CarStatus.available]] * 3
+    assert snapshot.revenue_by_model() == {1: (1, Decimal("900"))}
+    assert snapshot.revenue_by_model(start=datetime(2024, 2, 2)) == {}
+
+    # Инкрементальное обновление совпадает со снимком, построенным заново
+    fresh = service.inventory_snapshot()
+    for name in InventorySnapshot.CAR_COLUMNS:
+        assert np.array_equal(snapshot.cars[name], fresh.cars[name])
+    for name in InventorySnapshot.SALE_COLUMNS:
+        assert np.array_equal(snapshot.sales[name], fresh.sales[name])
+
+    directory = os.path.join(tmpdir, "snapshot")
+    snapshot.save(directory)
+    loaded = InventorySnapshot.load(directory)
+    assert isinstance(loaded.cars["price"], np.memmap)
+    assert loaded.average_price_by_model(CarStatus.available) == {1: Decimal("2000.50"), 2: Decimal("3500")}
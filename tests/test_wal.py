@@ -0,0 +1,132 @@
+import os
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from bibip_car_service import CarService
+from models import Car, CarStatus, Model, Sale
+from wal import REPLACE_MANIFEST, GroupCommit, WriteAheadLog, finish_replace
+
+
+def test_replay_finishes_interrupted_sale(tmpdir: str) -> None:
+    service = CarService(tmpdir)
+    service.add_model(Model(id=1, name='Optima', brand='Kia'))
+    service.add_car(Car(vin='KNAGM4A77D5316538', model=1, price=Decimal('2000'),
+                        date_start=datetime(2024, 2, 8), status=CarStatus.available))
+
+    # Процесс "падает", успев записать автомобиль, но не продажу
+    def crash() -> None:
+        raise RuntimeError('сбой')
+    service.sales_store.apply = crash
+    with pytest.raises(RuntimeError):
+        service.sell_car(Sale(sales_number='20240903#KNAGM4A77D5316538', car_vin='KNAGM4A77D5316538',
+                              sales_date=datetime(2024, 9, 3), cost=Decimal('1999.09')))
+    assert os.path.getsize(service.wal_file) > 0
+
+    reopened = CarService(tmpdir)
+    info = reopened.get_car_info('KNAGM4A77D5316538')
+    assert info.status == CarStatus.sold
+    assert info.sales_cost == Decimal('1999.09')
+    assert [stats.sales_number for stats in reopened.top_models_by_sales()] == [1]
+    assert os.path.getsize(reopened.wal_file) == 0
+    reopened.close()
+
+
+def test_failed_commit_leaves_no_trace_in_memory(tmpdir: str) -> None:
+    service = CarService(tmpdir)
+    service.add_model(Model(id=1, name='Optima', brand='Kia'))
+    service.add_car(Car(vin='KNAGM4A77D5316538', model=1, price=Decimal('2000'),
+                        date_start=datetime(2024, 2, 8), status=CarStatus.available))
+    sale = Sale(sales_number='20240903#KNAGM4A77D5316538', car_vin='KNAGM4A77D5316538',
+                sales_date=datetime(2024, 9, 3), cost=Decimal('1999.09'))
+
+    # Сбой посреди записи в журнал: в нем остается оборванная запись
+    def torn_commit(writes: list) -> None:
+        os.write(service.wal._fd, b'WAL1')
+        raise OSError('сбой записи')
+    commit = service.wal.commit
+    service.wal.commit = torn_commit
+    with pytest.raises(OSError):
+        service.sell_car(sale)
+
+    info = service.get_car_info('KNAGM4A77D5316538')
+    assert info.status == CarStatus.available and info.sales_cost is None
+    assert service.get_sale(sale.sales_number) is None
+    assert service.get_cars(CarStatus.sold) == []
+    assert service.top_models_by_sales() == []
+
+    service.wal.commit = commit
+    service.sell_car(sale)
+    service.close()
+    with CarService(tmpdir) as reopened:
+        assert reopened.get_car_info('KNAGM4A77D5316538').sales_cost == Decimal('1999.09')
+        assert reopened.get_sale(sale.sales_number).cost == Decimal('1999.09')
+        assert len(reopened.sales_store) == 1
+
+
+def test_torn_record_is_ignored(tmpdir: str) -> None:
+    target = os.path.join(tmpdir, 'data.txt')
+    with open(target, 'wb') as f:
+        f.write(b'aaaa')
+    wal = WriteAheadLog(os.path.join(tmpdir, 'wal.log'))
+    wal.commit([('data.txt', 1, b'bb')])
+    wal.commit([('data.txt', 0, b'cccc')])
+    # Обрываем последнюю запись, как при сбое посреди write
+    os.truncate(wal.path, wal.size() - 2)
+
+    assert wal.replay(tmpdir) == 1
+    with open(target, 'rb') as f:
+        assert f.read() == b'abba'
+    assert wal.size() == 0
+    wal.close()
+
+
+def test_interrupted_replace_is_finished(tmpdir: str) -> None:
+    for name, data in (('a.txt', b'old'), ('b.txt.tmp', b'new b'), ('b.txt', b'old')):
+        with open(os.path.join(tmpdir, name), 'wb') as f:
+            f.write(data)
+    # Сбой после подмены a.txt, но до подмены b.txt
+    with open(os.path.join(tmpdir, 'a.txt'), 'wb') as f:
+        f.write(b'new a')
+    with open(os.path.join(tmpdir, REPLACE_MANIFEST), 'w') as f:
+        f.write('a.txt\nb.txt\n')
+
+    finish_replace(tmpdir)
+    for name, data in (('a.txt', b'new a'), ('b.txt', b'new b')):
+        with open(os.path.join(tmpdir, name), 'rb') as f:
+            assert f.read() == data
+    assert not os.path.exists(os.path.join(tmpdir, REPLACE_MANIFEST))
+
+
+def test_group_commit_batches_waiting_operations() -> None:
+    batches = []
+    first_started = threading.Event()
+    release_first = threading.Event()
+
+    def execute(batch) -> None:
+        batches.append(len(batch))
+        if len(batches) == 1:
+            first_started.set()
+            release_first.wait()
+        for request in batch:
+            request.run()
+
+    group = GroupCommit(execute)
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(group.submit(lambda: i)))
+               for i in range(4)]
+    threads[0].start()
+    first_started.wait()
+    # Пока фиксируется первая группа, остальные операции копятся в следующую
+    for thread in threads[1:]:
+        thread.start()
+    while len(group._queue) < 3:
+        threading.Event().wait(0.001)
+    release_first.set()
+    for thread in threads:
+        thread.join()
+
+    assert batches == [1, 3]
+    assert sorted(results) == [0, 1, 2, 3]